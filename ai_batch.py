@@ -0,0 +1,196 @@
+import json
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+
+
+def build_categorize_prompt(transactions: list, subcategories: list) -> str:
+    trans_list = "\n".join(
+        [f"{i}. Descrizione: '{t['description']}', Importo: {t['amount']}€"
+         for i, t in enumerate(transactions)]
+    )
+    return f"""Sei un esperto di finanza personale. Categorizza TUTTE queste transazioni bancarie italiane.
+Sottocategorie disponibili: {', '.join(subcategories)}
+Transazioni da categorizzare:
+{trans_list}
+Rispondi SOLO con un JSON valido in questo formato: {{"0": "Nome sottocategoria", "1": "Nome sottocategoria", ...}}
+Usa SOLO i nomi esatti delle sottocategorie della lista."""
+
+
+def parse_categorization(text: str) -> dict:
+    """Estrae il dizionario ``{"indice": "sottocategoria"}`` dalla risposta del modello."""
+    text = text.strip()
+    # Pulisci eventuale code block
+    if "```" in text:
+        text = text.split("```", 1)[1]
+        if text.startswith("json"):
+            text = text[len("json"):]
+        text = text.split("```", 1)[0]
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("nessun oggetto JSON nella risposta")
+    result = json.loads(text[start:end + 1])
+    if not isinstance(result, dict):
+        raise ValueError("la risposta non è un oggetto JSON")
+    return result
+
+
+class RateLimiter:
+    """Distanzia le richieste di almeno ``1 / requests_per_second`` secondi (thread-safe)."""
+
+    def __init__(self, requests_per_second: float = None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _categorize_batch(batch, client, subcategories, model, limiter, max_retries, backoff):
+    prompt = build_categorize_prompt(batch, subcategories)
+    last_error = None
+    for attempt in range(max_retries + 1):
+        if attempt:
+            # Backoff esponenziale con jitter
+            time.sleep(backoff * 2 ** (attempt - 1) * (1 + random.random()))
+        limiter.acquire()
+        try:
+            response = client.chat_completion(
+                messages=[{"role": "user", "content": prompt}],
+                model=model,
+                max_tokens=200 + 25 * len(batch),
+                temperature=0.1,
+            )
+            result = parse_categorization(response.choices[0].message.content)
+        except Exception as e:
+            last_error = e
+            continue
+        out = {}
+        for key, subcategory in result.items():
+            try:
+                idx = int(key)
+            except (TypeError, ValueError):
+                continue
+            if 0 <= idx < len(batch) and isinstance(subcategory, str):
+                out[idx] = subcategory
+        return out
+    raise last_error
+
+
+def categorize_in_batches(
+    transactions: list,
+    client,
+    subcategories: list,
+    model: str,
+    batch_size: int = 40,
+    max_workers: int = 4,
+    requests_per_second: float = None,
+    max_retries: int = 3,
+    backoff: float = 1.0,
+    on_batch_done=None,
+):
+    """Categorizza le transazioni in batch concorrenti di dimensione limitata.
+
+    Restituisce ``(risultati, errori)``: ``risultati`` ha come chiavi gli
+    indici (stringa) nella lista ``transactions``, come la risposta di un
+    singolo prompt; ``errori`` elenca ``(indice_iniziale, eccezione)`` dei
+    batch falliti dopo tutti i tentativi, le cui righe restano escluse.
+    ``on_batch_done(completati, totali)`` viene chiamato dal thread chiamante
+    a ogni batch concluso.
+    """
+    starts = list(range(0, len(transactions), batch_size))
+    results, errors = {}, []
+    if not starts:
+        return results, errors
+    limiter = RateLimiter(requests_per_second)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(starts)))) as pool:
+        futures = {
+            pool.submit(
+                _categorize_batch,
+                transactions[start:start + batch_size],
+                client,
+                subcategories,
+                model,
+                limiter,
+                max_retries,
+                backoff,
+            ): start
+            for start in starts
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            start = futures[future]
+            try:
+                for idx, subcategory in future.result().items():
+                    results[str(start + idx)] = subcategory
+            except Exception as e:
+                errors.append((start, e))
+            if on_batch_done:
+                on_batch_done(done, len(starts))
+    return results, errors
+
+
+class FakeInferenceClient:
+    """Client locale compatibile con ``InferenceClient.chat_completion``.
+
+    Legge le transazioni dal prompt e risponde con ``classify(descrizione,
+    importo)``, senza rete; ai prompt senza transazioni risponde ``reply``,
+    anche in streaming. Serve a provare batching, retry e cache offline:
+    ``latency`` simula il tempo di risposta, ``failures`` fa fallire le prime
+    N chiamate e ``truncate_over`` tronca il JSON dei batch più grandi, come
+    succede con un ``max_tokens`` troppo basso.
+    """
+
+    _LINE_RE = re.compile(r"^(\d+)\. Descrizione: '(.*)', Importo: (.*)€$", re.MULTILINE)
+
+    def __init__(
+        self,
+        classify=None,
+        latency: float = 0.0,
+        failures: int = 0,
+        truncate_over: int = None,
+        reply: str = "Risposta simulata: nessun consiglio reale.",
+    ):
+        self.classify = classify or (lambda description, amount: "Shopping & extra")
+        self.reply = reply
+        self.latency = latency
+        self.failures = failures
+        self.truncate_over = truncate_over
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def chat_completion(self, messages, model=None, max_tokens=None, temperature=None, stream=False, **kwargs):
+        prompt = messages[-1]["content"]
+        with self._lock:
+            self.calls.append({"model": model, "prompt_chars": len(prompt), "max_tokens": max_tokens})
+            fail = len(self.calls) <= self.failures
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise ConnectionError("FakeInferenceClient: errore simulato")
+        items = self._LINE_RE.findall(prompt)
+        if items:
+            answer = json.dumps(
+                {idx: self.classify(desc, amount) for idx, desc, amount in items},
+                ensure_ascii=False,
+            )
+        else:
+            answer = self.reply
+        if self.truncate_over is not None and len(items) > self.truncate_over:
+            answer = answer[: len(answer) // 2]
+        if stream:
+            return (
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+                for token in re.findall(r"\S+\s*", answer)
+            )
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
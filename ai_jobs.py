@@ -0,0 +1,140 @@
+import hashlib
+import queue
+import threading
+import time
+import uuid
+
+from instrumentation import StageProfiler
+
+
+def request_key(transactions: list, model: str = "") -> str:
+    """Impronta di una richiesta di categorizzazione: stesse transazioni, stesso modello."""
+    payload = "\n".join([model, *(f"{t['description']}\x1f{t['amount']}" for t in transactions)])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class AIJob:
+    """Una richiesta di categorizzazione in coda, condivisa dalle sessioni che l'hanno chiesta.
+
+    I campi vengono scritti solo dal worker; le sessioni li leggono a ogni
+    rerun per mostrare l'avanzamento. ``results`` ed ``errors`` hanno la
+    forma restituita da ``ai_batch_categorize``; ``profiler`` misura il
+    lavoro e le chiamate AI del worker, da unire con ``merge`` al profiler
+    di ogni sessione che riceve il risultato.
+    """
+
+    def __init__(self, key: str, transactions: list):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.transactions = transactions
+        self.status = "in coda"
+        self.done = 0
+        self.total = 0
+        self.sessions = 1
+        self.results = {}
+        self.errors = []
+        self.error = None
+        self.profiler = StageProfiler()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._finished = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    @property
+    def progress(self) -> float:
+        if self.finished:
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._finished.wait(timeout)
+
+    def _on_batch_done(self, done, total):
+        self.done, self.total = done, total
+
+
+class AIJobQueue:
+    """Coda di categorizzazioni AI condivisa da tutto il processo, con worker in background.
+
+    ``categorize(transactions, on_batch_done, errors, profiler)`` fa il
+    lavoro vero (di solito ``ai_batch_categorize`` con il client già legato,
+    passato da ``profiler.wrap_client``, più la scrittura delle risposte
+    nella cache merchant, così restano anche se nessuno ritira il job). Una
+    richiesta identica a una ancora in coda o in corso, anche da un'altra
+    sessione, non crea un nuovo job: riceve lo stesso ``AIJob``, quindi le
+    chiamate all'AI si fanno una volta sola. I job conclusi restano
+    consultabili con ``get`` finché non ne arrivano altri ``max_finished``.
+    """
+
+    def __init__(self, categorize, model: str = "", workers: int = 1, max_finished: int = 64):
+        self.categorize = categorize
+        self.model = model
+        self.workers = workers
+        self.max_finished = max_finished
+        self.submitted = 0
+        self.coalesced = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._jobs = {}
+        self._threads = []
+
+    def __len__(self) -> int:
+        # Job in coda o in corso
+        with self._lock:
+            return len(self._inflight)
+
+    def submit(self, transactions: list) -> AIJob:
+        key = request_key(transactions, self.model)
+        with self._lock:
+            self.submitted += 1
+            job = self._inflight.get(key)
+            if job is not None:
+                job.sessions += 1
+                self.coalesced += 1
+                return job
+            job = AIJob(key, transactions)
+            self._inflight[key] = job
+            self._jobs[job.id] = job
+            self._start_workers()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _start_workers(self):
+        # Thread avviati alla prima richiesta, daemon: non trattengono il processo
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"ai-jobs-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            job.status = "in corso"
+            job.started_at = time.time()
+            try:
+                with job.profiler.stage("ai_batch_categorize", rows=len(job.transactions)):
+                    job.results = self.categorize(
+                        job.transactions, job._on_batch_done, job.errors, job.profiler
+                    )
+                job.status = "completato"
+            except Exception as e:
+                job.error = e
+                job.status = "errore"
+            finally:
+                job.finished_at = time.time()
+                with self._lock:
+                    self._inflight.pop(job.key, None)
+                    finished = [j for j in self._jobs.values() if j.finished]
+                    for old in finished[: max(0, len(finished) + 1 - self.max_finished)]:
+                        del self._jobs[old.id]
+                job._finished.set()
+                self._queue.task_done()
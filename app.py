@@ -1,9 +1,56 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, date
-import plotly.express as px
-from huggingface_hub import InferenceClient
+from ai_jobs import AIJobQueue
+from frame_schema import amounts_float64, compact_transactions, concat_transactions
+from history_store import TransactionStore
+from instrumentation import NULL_PROFILER, StageProfiler
+from local_classifier import MerchantClassifier
+from mapping_profiles import MappingProfiles
+from merchant_index import MerchantIndex
+from merchant_cache import MerchantCategoryCache
+from pipeline import (
+    AI_CACHE_MAX_ENTRIES,
+    AI_CACHE_PATH,
+    AI_CACHE_VERSION,
+    AI_FAKE_LATENCY,
+    AI_JOB_WORKERS,
+    AI_MODEL,
+    ALL_SUBCATEGORIES,
+    DASHBOARD_COLUMNS,
+    DEFAULT_ACCOUNT,
+    HISTORY_PATH,
+    LOCAL_MIN_CONFIDENCE,
+    LOCAL_MODEL_PATH,
+    MAPPING_PROFILES_PATH,
+    RULES,
+    RULES_PATH,
+    SHEETS_CHUNK_ROWS,
+    SHEETS_FAKE,
+    SHEETS_REQUESTS_PER_SECOND,
+    SHEETS_WORKSHEET,
+    prepare_ai_request,
+    advice_key,
+    ai_batch_categorize,
+    apply_ai_results,
+    build_budget_prompt,
+    cache_ai_results,
+    process_files,
+    promote_recurring,
+    read_csv_preview,
+    sniff_csv,
+    stream_budget_advice,
+    suggest_mapping,
+)
+from recurring import detect_recurring
+from rollups import PeriodRollup, chart_aggregates
+from sheets_sync import SHEET_COLUMNS, FakeWorksheet, open_worksheet, sync_to_sheet
+from table_view import FILTER_COLUMNS, SORT_COLUMNS, TransactionTable
+import hashlib
+import io
 import json
+import os
+import threading
 
 # ---------------------------------------------------------
 # Configurazione pagina
@@ -20,9 +67,18 @@ st.markdown("---")
 # ---------------------------------------------------------
 # Inizializzazione Hugging Face
 # ---------------------------------------------------------
+# Il client (e l'import di huggingface_hub) nasce alla prima chiamata AI,
+# non a ogni avvio della pagina
 @st.cache_resource
 def init_ai():
+    if AI_FAKE_LATENCY is not None:
+        # Prove locali senza rete né token
+        from ai_batch import FakeInferenceClient
+
+        return FakeInferenceClient(latency=float(AI_FAKE_LATENCY))
     try:
+        from huggingface_hub import InferenceClient
+
         client = InferenceClient(
             token=st.secrets["huggingface"]["api_key"]
         )
@@ -31,505 +87,577 @@ def init_ai():
         st.warning(f"⚠️ AI non disponibile: {e}")
         return None
 
-ai_client = init_ai()
+def ai_configured() -> bool:
+    # Controlla solo i secrets, senza creare il client
+    if AI_FAKE_LATENCY is not None:
+        return True
+    try:
+        return "api_key" in st.secrets["huggingface"]
+    except Exception:
+        return False
 
 # ---------------------------------------------------------
 # Sidebar: upload + opzioni
 # ---------------------------------------------------------
-st.sidebar.header("📁 Carica estratto conto")
-uploaded_file = st.sidebar.file_uploader("Scegli il file CSV dell'estratto conto", type="csv")
+st.sidebar.header("📁 Carica estratti conto")
+uploaded_files = st.sidebar.file_uploader(
+    "Scegli i file CSV degli estratti conto (anche di banche diverse)",
+    type="csv",
+    accept_multiple_files=True,
+)
 st.sidebar.markdown("—")
-st.sidebar.caption("Supporto Hype + altre banche (mappatura colonne manuale).")
+st.sidebar.caption(
+    "Supporto Hype + altre banche: ogni formato si mappa una volta e viene poi riconosciuto."
+)
 st.sidebar.markdown("### 🤖 Intelligenza Artificiale")
 use_ai = st.sidebar.checkbox("Usa AI per riclassificare 'Altro variabile'", value=True)
+ai_group_by_sign = st.sidebar.checkbox(
+    "Raggruppa per merchant e segno dell'importo",
+    value=False,
+    help="Di default l'AI riceve un solo esempio per merchant normalizzato.",
+)
+use_local_model = st.sidebar.checkbox(
+    "Classificatore locale prima dell'AI",
+    value=True,
+    help="Un modello addestrato sulle tue transazioni risolve i merchant riconosciuti "
+    "con sicurezza; all'AI vanno solo quelli incerti.",
+)
+st.sidebar.markdown("### 🔁 Ricorrenze")
+promote_recurring_rows = st.sidebar.checkbox(
+    "Sposta i pagamenti ricorrenti in 'Fisso'",
+    value=True,
+    help="Gli addebiti periodici (settimanali, mensili, annuali) a importo stabile "
+    "rimasti in 'Variabile' diventano 'Abbonamenti ricorrenti'.",
+)
+st.sidebar.markdown("### 📚 Storico")
+use_history = st.sidebar.checkbox(
+    "Salva le transazioni nello storico locale",
+    value=True,
+    help="Le transazioni già importate vengono riconosciute e non ricategorizzate.",
+)
+st.sidebar.markdown("### 🩺 Diagnostica")
+show_profile = st.sidebar.checkbox(
+    "Misura tempi e memoria per fase",
+    value=False,
+    help="Registra durata, righe e memoria di ogni fase e delle chiamate AI.",
+)
+# Spento, il profiler nullo non misura nulla
+profiler = StageProfiler() if show_profile else NULL_PROFILER
 
 # ---------------------------------------------------------
 # Funzioni di utilità
 # ---------------------------------------------------------
-def load_csv(file):
+@st.cache_resource
+def init_history_store():
+    return TransactionStore(HISTORY_PATH)
+
+@st.cache_resource
+def init_mapping_profiles():
+    return MappingProfiles(MAPPING_PROFILES_PATH)
+
+@st.cache_resource
+def init_ai_cache():
+    return MerchantCategoryCache(
+        AI_CACHE_PATH,
+        version=AI_CACHE_VERSION,
+        max_entries=AI_CACHE_MAX_ENTRIES,
+    )
+
+@st.cache_resource
+def init_ai_queue():
+    # Una coda per tutto il server: le sessioni condividono worker e richieste in corso
+    client = init_ai()
+    if client is None:
+        return None
+    cache = init_ai_cache()
+
+    def categorize(transactions, on_batch_done, errors, job_profiler):
+        results = ai_batch_categorize(transactions, job_profiler.wrap_client(client), on_batch_done, errors)
+        # Le risposte vanno in cache già nel worker: non si perdono se nessuna
+        # sessione raccoglie il job (scheda chiusa, job scartato dalla coda)
+        with job_profiler.stage("ai_cache_store", rows=len(transactions)):
+            cache_ai_results(transactions, results, cache)
+        return results
+
+    return AIJobQueue(
+        categorize,
+        model=AI_MODEL,
+        workers=AI_JOB_WORKERS,
+    )
+
+@st.cache_resource
+def init_sheet():
+    # Un foglio per tutto il server, aperto alla prima sincronizzazione
+    if SHEETS_FAKE is not None:
+        return FakeWorksheet(SHEETS_WORKSHEET)
+    # Stessi secrets della connessione gsheets: service account in
+    # [connections.gsheets], chiave del foglio in [config]
+    return open_worksheet(
+        dict(st.secrets["connections"]["gsheets"]),
+        st.secrets["config"]["SPREADSHEET_ID"],
+        SHEETS_WORKSHEET,
+    )
+
+@st.cache_resource
+def sheet_sync_lock():
+    # Una sincronizzazione alla volta per server: lettura delle impronte,
+    # confronto e scrittura di due sessioni non si intrecciano
+    return threading.Lock()
+
+def sheets_configured() -> bool:
+    if SHEETS_FAKE is not None:
+        return True
     try:
-        df = pd.read_csv(file, sep=";")
-        if df.shape[1] == 1:
-            file.seek(0)
-            df = pd.read_csv(file, sep=",")
+        return "private_key" in st.secrets["connections"]["gsheets"] and "SPREADSHEET_ID" in st.secrets["config"]
     except Exception:
-        file.seek(0)
-        df = pd.read_csv(file)
-    return df
-
-FIXED_KEYWORDS = {
-    "Affitto / mutuo": ["affitto", "rent", "mutuo", "mortgage", "ferrari giuliana"],
-    "Utenze casa": ["enel", "a2a", "hera", "iren", "gas", "luce", "energia", "acqua"],
-    "Abbonamenti ricorrenti": [
-        "netflix", "spotify", "prime video", "now tv", "disney",
-        "abbonamento", "subscription", "telefono", "mobile", "internet", "fibra",
-        "iliad", "hype plus", "canone"
-    ],
-    "Rate & debiti": ["prestito", "loan", "finanziamento", "rate", "credito al consumo"],
-}
+        return False
 
-VARIABLE_KEYWORDS = {
-    "Cene & aperitivi": [
-        "ristorante", "restaurant", "trattoria", "osteria", "pizzeria",
-        "pub", "bar", "caffe", "caffè", "aperitivo", "apericena", "kebab"
-    ],
-    "Spesa supermercato": [
-        "esselunga", "coop", "iper", "ipercoop", "conad", "carrefour",
-        "lidl", "md", "pam", "aldi", "eurospin", "eurospar", "bennet", "mercato"
-    ],
-    "Trasporti & mobilità": [
-        "atm", "trenitalia", "italo", "uber", "bolt", "taxi",
-        "carburante", "benzina", "diesel", "telepass", "enjoy",
-        "share now", "sharenow", "free now", "freenow", "tper", "ridemovi", "buffet"
-    ],
-    "Sport & benessere": [
-        "palestra", "gym", "fitness", "decathlon", "sport center",
-        "yoga", "pilates", "spa", "wellness"
-    ],
-    "Salute": [
-        "farmacia", "pharmacy", "medico", "analisi", "ticket",
-        "dentista", "ottico", "occhiali", "visita", "esame", "unobravo"
-    ],
-    "Tabacco & vizi": [
-        "tabacchi", "tabaccheria", "sigarette", "tobacco",
-        "svapo", "vape", "sisal", "lotto", "scommessa", "palabingo"
-    ],
-    "Shopping & extra": [
-        "amazon", "zalando", "zara", "h&m", "hm", "mediaworld",
-        "unieuro", "ikea", "temu"
-    ],
-    "Cultura & formazione": [
-        "libreria", "feltrinelli", "ibs", "corso", "master",
-        "udemy", "coursera", "libro", "libri", "cinema"
-    ],
-    "Casa & arredo": [
-        "brico", "leroy merlin", "obi", "ikea", "casaforte", "arredo", "risparmio casa"
-    ],
-    "Animali": [
-        "zooplus", "arcaplanet", "pet shop", "toelettatura"
-    ],
-    "Viaggi": [
-        "booking.com", "airbnb", "hotel", "ryanair", "easyjet", "wizzair", "albergo"
-    ],
-    "Regali": [
-        "regalo", "gift", "fiori", "florist", "flower"
-    ],
-}
+@st.cache_resource
+def init_local_model():
+    model = MerchantClassifier(LOCAL_MODEL_PATH, ALL_SUBCATEGORIES)
+    history = init_history_store()
+    if len(model) == 0 and len(history):
+        # Primo avvio: parte dallo storico già categorizzato
+        labeled = history.load(columns=["normalized_merchant", "macro_category", "subcategory"])
+        labeled = labeled[labeled["macro_category"] != "Entrata"]
+        model.learn(labeled["normalized_merchant"], labeled["subcategory"])
+    return model
 
-SAVINGS_INVEST_KEYWORDS = {
-    "Risparmio conto / deposito": [
-        "conto deposito", "risparmio", "saving", "savings", "deposito", "caparra"
-    ],
-    "Investimenti azioni/ETF": [
-        "degiro", "etoro", "revolut trading", "trade republic",
-        "fineco", "directa", "interactive brokers", "broker"
-    ],
-    "Crypto & speculativi": [
-        "binance", "coinbase", "kraken", "crypto.com", "bitpanda"
-    ],
-    "Altri investimenti": [
-        "polizza", "assicurazione vita", "gestione patrimoniale"
-    ],
-}
+@st.cache_resource
+def init_merchant_index():
+    # I nomi canonici già nello storico restano quelli di riferimento
+    names = init_history_store().load(columns=["canonical_merchant"])["canonical_merchant"]
+    return MerchantIndex(names=names.dropna().unique())
 
-INCOME_KEYWORDS = {
-    "Stipendio & lavoro": [
-        "stipendio", "salary", "paga", "retribuzione", "busta paga",
-        "azioninnova", "saldo", "compenso", "mensilita"
-    ],
-    "Rimborsi & rientri": [
-        "rimborso", "refund", "rimborso spese", "chargeback",
-        "accredito", "restituzione", "referendum"
-    ],
-    "Entrate passive": [
-        "interessi", "dividendo", "royalty", "cedola"
-    ],
-}
+ADVICE_MEMO_MAX_ENTRIES = 256
 
-ALL_SUBCATEGORIES = (
-    list(FIXED_KEYWORDS.keys())
-    + list(VARIABLE_KEYWORDS.keys())
-    + list(SAVINGS_INVEST_KEYWORDS.keys())
-    + list(INCOME_KEYWORDS.keys())
-)
+@st.cache_resource
+def advice_memo() -> dict:
+    # Consigli già generati, condivisi tra rerun e sessioni
+    return {}
+
+def remember_advice(key: str, text: str) -> str:
+    memo = advice_memo()
+    memo[key] = text
+    while len(memo) > ADVICE_MEMO_MAX_ENTRIES:
+        memo.pop(next(iter(memo)))
+    return text
+
+def upload_digest(uploaded_file) -> str:
+    # Hash calcolato una sola volta per file caricato, non a ogni rerun
+    digests = st.session_state.setdefault("upload_digests", {})
+    if uploaded_file.file_id not in digests:
+        digests[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    return digests[uploaded_file.file_id]
 
-def normalize_text(s: str) -> str:
-    if not isinstance(s, str):
-        s = str(s)
-    return s.lower()
+def inspect_upload(uploaded_file, profiles) -> dict:
+    """Formato, anteprima e profilo di mappatura riconosciuto di un file caricato."""
+    csv_format = sniff_csv(uploaded_file)
+    preview = read_csv_preview(uploaded_file, csv_format)
+    return {
+        "file": uploaded_file,
+        "name": uploaded_file.name,
+        "digest": upload_digest(uploaded_file),
+        "csv_format": csv_format,
+        "preview": preview,
+        "profile": profiles.get(preview.columns),
+    }
 
-def normalize_merchant(desc: str) -> str:
-    txt = normalize_text(desc)
-    remove_tokens = [
-        "pagamento pos", "pagamento carta", "acquisto carta",
-        "operazione pos", "contactless", "e-commerce", "ecommerce", "pagamento"
+def upload_jobs(uploads) -> list:
+    # Un BytesIO per file: i thread di process_files non condividono cursori
+    return [
+        {
+            "name": u["name"],
+            "file": io.BytesIO(u["file"].getvalue()),
+            "csv_format": u["csv_format"],
+            "mapping": u["mapping"],
+            "account": u["account"],
+        }
+        for u in uploads
     ]
-    for t in remove_tokens:
-        txt = txt.replace(t, " ")
-    return " ".join(txt.split())
-
-def match_keywords(description: str, rules: dict):
-    desc = normalize_text(description)
-    for category, words in rules.items():
-        for w in words:
-            if w in desc:
-                return category
-    return None
-
-def ai_batch_categorize(transactions: list, client) -> dict:
-    if client is None or len(transactions) == 0:
-        return {}
-    try:
-        trans_list = "\n".join(
-            [f"{i}. Descrizione: '{t['description']}', Importo: {t['amount']}€"
-             for i, t in enumerate(transactions)]
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def categorize_uploads(file_digests, _uploads, specs, rules_version, _rules, _profiler=NULL_PROFILER):
+    # _uploads e _rules sono esclusi dall'hash di st.cache_data: li
+    # identificano file_digests e specs (formato, mappatura e conto di ogni
+    # file) e rules_version, che cambia quando si modifica il file delle regole.
+    # Se il risultato è già in cache le fasi interne non vengono misurate.
+    return process_files(
+        upload_jobs(_uploads),
+        profiler=_profiler,
+        merchant_index=init_merchant_index(),
+        rules=_rules,
+    )
+
+def report_ai_stats(stats):
+    if stats["cache_rows"]:
+        st.info(
+            f"🗂 Cache AI: {stats['cache_rows']} transazioni risolte in locale "
+            f"({stats['cache_merchants']} merchant)."
         )
-        prompt = f"""Sei un esperto di finanza personale. Categorizza TUTTE queste transazioni bancarie italiane.
-Sottocategorie disponibili: {', '.join(ALL_SUBCATEGORIES)}
-Transazioni da categorizzare:
-{trans_list}
-Rispondi SOLO con un JSON valido in questo formato: {{"0": "Nome sottocategoria", "1": "Nome sottocategoria", ...}}
-Usa SOLO i nomi esatti delle sottocategorie della lista."""
-
-        messages = [{"role": "user", "content": prompt}]
-        
-        response = client.chat_completion(
-            messages=messages,
-            model="mistralai/Mistral-7B-Instruct-v0.2",
-            max_tokens=2000,
-            temperature=0.1
+    if stats["local_rows"]:
+        st.info(
+            f"🧠 Classificatore locale: {stats['local_rows']} transazioni "
+            f"({stats['local_merchants']} merchant) categorizzate senza AI."
         )
-        
-        result_text = response.choices[0].message.content.strip()
-
-        # Pulisci eventuale code block
-        if "```json" in result_text:
-            result_text = result_text.split("```json", 1)[1]
-            result_text = result_text.split("```", 1).strip()
-        elif "```" in result_text:
-            result_text = result_text.split("```", 1)[11]
-            result_text = result_text.split("```", 1)[0].strip()
-
-        categorization = json.loads(result_text)
-        return categorization
-    except Exception as e:
-        st.warning(f"AI batch errore: {e}")
-        return {}
-
-def categorize_row_basic(row):
-    desc = row["description"]
-    amount = row["amount"] or 0.0
-    row["normalized_merchant"] = normalize_merchant(desc)
-
-    if amount > 0:
-        sub = match_keywords(desc, INCOME_KEYWORDS)
-        row["macro_category"] = "Entrata"
-        row["subcategory"] = sub if sub else "Entrate varie"
-        return row
-
-    sub_save = match_keywords(desc, SAVINGS_INVEST_KEYWORDS)
-    if sub_save:
-        row["macro_category"] = "Risparmi & investimenti"
-        row["subcategory"] = sub_save
-        return row
-
-    sub_fixed = match_keywords(desc, FIXED_KEYWORDS)
-    if sub_fixed:
-        row["macro_category"] = "Fisso"
-        row["subcategory"] = sub_fixed
-        return row
-
-    sub_var = match_keywords(desc, VARIABLE_KEYWORDS)
-    if sub_var:
-        row["macro_category"] = "Variabile"
-        row["subcategory"] = sub_var
-        return row
-
-    row["macro_category"] = "Variabile"
-    row["subcategory"] = "Altro variabile"
-    return row
-
-def generate_budget_advice(df, client):
-    if client is None:
-        return "AI non disponibile per consigli."
-    try:
-        entrate = df[df["macro_category"] == "Entrata"]["amount"].sum()
-        fisso = abs(df[df["macro_category"] == "Fisso"]["amount"].sum())
-        variabile = abs(df[df["macro_category"] == "Variabile"]["amount"].sum())
-        risparmi = abs(df[df["macro_category"] == "Risparmi & investimenti"]["amount"].sum())
-        var_by_cat = (
-            df[df["macro_category"] == "Variabile"]
-            .groupby("subcategory")["amount"]
-            .sum()
-            .abs()
-            .sort_values(ascending=False)
-            .head(5)
+    if stats["errors"]:
+        st.warning(
+            f"AI batch errore: {len(stats['errors'])} batch falliti ({stats['failed_merchants']} "
+            f"merchant restano in 'Altro variabile'). Ultimo errore: {stats['errors'][-1][1]}"
         )
-        prompt = f"""Sei un consulente finanziario personale. Analizza questi dati e dai 3-4 consigli pratici per ottimizzare il budget mensile.
-Dati periodo analizzato:
-- Entrate totali: {entrate:.0f}€
-- Spese fisse: {fisso:.0f}€ ({(fisso/entrate*100) if entrate > 0 else 0:.1f}%)
-- Spese variabili: {variabile:.0f}€ ({(variabile/entrate*100) if entrate > 0 else 0:.1f}%)
-- Risparmi/investimenti: {risparmi:.0f}€ ({(risparmi/entrate*100) if entrate > 0 else 0:.1f}%)
-Principali spese variabili:
-{var_by_cat.to_string()}
-Fornisci consigli pratici, con numeri specifici e percentuali. Sii conciso (max 4 punti)."""
-
-        messages = [{"role": "user", "content": prompt}]
-        response = client.chat_completion(
-            messages=messages,
-            model="mistralai/Mistral-7B-Instruct-v0.2",
-            max_tokens=500,
-            temperature=0.7
+    if stats["ai_rows"]:
+        st.success(
+            f"✅ AI ha categorizzato {stats['ai_rows']} transazioni "
+            f"({stats['ai_merchants']} merchant)!"
         )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        return f"Errore generazione consigli: {e}"
 
-def build_internal_df(df_raw, col_date, col_desc, col_amount, col_name=None, col_type=None, col_iban=None):
-    df = df_raw.copy()
-    df["date"] = pd.to_datetime(df[col_date], errors="coerce", dayfirst=True)
+def run_ai_categorization(df_categorized, group_by_sign=False):
+    """Cache e modello locale subito, in place; le righe rimaste vanno all'AI in background.
 
-    if col_name and col_name in df.columns:
-        df["description"] = (
-            df[col_name].astype(str).fillna("") + " - " + df[col_desc].astype(str).fillna("")
-        ).str.strip(" -")
-    else:
-        df["description"] = df[col_desc].astype(str)
-
-    raw_amount = (
-        df[col_amount]
-        .astype(str)
-        .str.strip()
-        .str.replace("€", "", regex=False)
-        .str.replace("\u20ac", "", regex=False)
-        .str.replace(" ", "", regex=False)
+    Restituisce il lavoro AI in sospeso (job della coda condivisa, richiesta
+    e statistiche) oppure ``None`` se non serve l'AI.
+    """
+    local_model = init_local_model() if use_local_model else None
+    stats = {}
+    with st.spinner("🧠 Cache merchant e classificatore locale..."):
+        request = prepare_ai_request(
+            df_categorized,
+            init_ai_cache() if use_ai else None,
+            group_by_sign,
+            stats,
+            profiler=profiler,
+            local_model=local_model,
+        )
+    report_ai_stats(stats)
+    queue = init_ai_queue() if use_ai and request is not None else None
+    if queue is None:
+        return None
+    job = queue.submit(request["transactions"])
+    shared = " La stessa richiesta era già in corso: la risposta viene condivisa." if job.sessions > 1 else ""
+    st.info(
+        f"🤖 {stats['pending_rows']} transazioni in 'Altro variabile' inviate all'AI "
+        f"in background ({len(request['transactions'])} merchant distinti).{shared}"
     )
+    return {"job_id": job.id, "request": request, "stats": stats, "local": use_local_model}
 
-    def parse_amount(x):
-        if x is None or x == "" or str(x).lower() == "nan":
-            return None
-        x = str(x)
-        if "," in x and x.rfind(",") > x.rfind("."):
-            x = x.replace(".", "").replace(",", ".")
-        elif "." in x and x.rfind(".") > x.rfind(","):
-            x = x.replace(",", "")
-        try:
-            return float(x)
-        except ValueError:
-            return None
-
-    df["amount"] = raw_amount.apply(parse_amount)
-
-    if col_iban and col_iban in df.columns:
-        df["account"] = df[col_iban].astype(str)
-    else:
-        df["account"] = "Conto principale"
-
-    if col_type and col_type in df.columns:
-        df["bank_category"] = df[col_type].astype(str)
-    else:
-        df["bank_category"] = ""
+def finish_ai_job(pending, job):
+    """Riporta sulle righe le risposte del job concluso e completa il dataset in sospeso."""
+    df_categorized = pending["df"]
+    stats = pending["stats"]
+    stats["errors"].extend(job.errors)
+    if job.error is not None:
+        stats["errors"].append((0, job.error))
+    # Tempi e chiamate del worker vanno con la preparazione dati, se misurata
+    st.session_state.get("prepare_profile", profiler).merge(job.profiler)
+    with profiler.stage("ai_apply_results", rows=len(df_categorized)):
+        # La cache l'ha già aggiornata il worker della coda
+        apply_ai_results(
+            df_categorized,
+            pending["request"],
+            job.results,
+            stats,
+            local_model=init_local_model() if pending["local"] else None,
+        )
+    if pending["history"]:
+        store = init_history_store()
+        with profiler.stage("history_append", rows=len(df_categorized)):
+            store.append_new(df_categorized)
+        with profiler.stage("history_load") as record:
+            df_categorized = compact_transactions(store.load(columns=DASHBOARD_COLUMNS))
+            record["rows"] = len(df_categorized)
+    st.session_state["dataset"] = {"key": pending["dataset_key"], "df": df_categorized}
+    st.session_state["ai_report"] = stats
 
-    df["direction"] = df["amount"].apply(
-        lambda x: "Entrata" if x is not None and x > 0 else "Uscita"
-    )
-    df["macro_category"] = ""
-    df["subcategory"] = ""
-    df["normalized_merchant"] = ""
-
-    df = df.sort_values("date")
-
-    cols = [
-        "date",
-        "description",
-        "amount",
-        "account",
-        "bank_category",
-        "direction",
-        "macro_category",
-        "subcategory",
-        "normalized_merchant",
-    ]
-    return df[cols]
+AI_POLL_SECONDS = 1.0
 
-# ---------------------------------------------------------
-# Corpo principale app
-# ---------------------------------------------------------
-if uploaded_file is not None:
-    df_raw = load_csv(uploaded_file)
-
-    st.subheader("📄 Anteprima CSV originale")
-    st.dataframe(df_raw.head(20), use_container_width=True)
+@st.fragment(run_every=AI_POLL_SECONDS)
+def render_ai_job():
+    # Solo questo frammento si riesegue a ogni controllo, non tutta la pagina
+    pending = st.session_state.get("ai_pending")
+    if pending is None:
+        return
+    queue = init_ai_queue()
+    job = queue.get(pending["job_id"]) if queue is not None else None
+    if job is None:
+        st.session_state.pop("ai_pending")
+        # Le righe nuove entrano comunque nello storico, con le categorie di
+        # regole e modello locale già mostrate nel dashboard
+        if pending["history"]:
+            with profiler.stage("history_append", rows=len(pending["df"])):
+                init_history_store().append_new(pending["df"])
+        st.warning(
+            "Il lavoro AI non è più disponibile: le transazioni restano con le categorie "
+            "delle regole e del classificatore locale."
+        )
+        return
+    if not job.finished:
+        total = job.total or "?"
+        st.progress(job.progress, text=f"🤖 AI in background ({job.status}): batch {job.done}/{total}")
+        st.caption("La pagina resta utilizzabile: il dashboard si aggiorna appena l'AI ha risposto.")
+        return
+    finish_ai_job(pending, job)
+    st.session_state.pop("ai_pending")
+    st.rerun()
 
-    st.markdown("### 🧩 Mappa le colonne del tuo estratto conto")
-    columns = df_raw.columns.tolist()
+def mapping_form(upload) -> dict:
+    """Selettori di mappatura di un file, precompilati dal profilo o dai suggerimenti."""
+    key = upload["file"].file_id
+    profile = upload["profile"]
+    csv_format = upload["csv_format"]
+    st.caption(f"Separatore `{csv_format['sep']}` • encoding `{csv_format['encoding']}`")
+    st.dataframe(upload["preview"], use_container_width=True)
 
-    def suggest(col_names, keywords):
-        for k in keywords:
-            for c in col_names:
-                if k.lower() in c.lower():
-                    return c
-        return None
+    columns = upload["preview"].columns.tolist()
+    suggested = profile["mapping"] if profile else suggest_mapping(columns)
 
-    default_date = suggest(columns, ["Data operazione", "Data", "date"])
-    default_desc = suggest(columns, ["Descrizione", "Causale", "Description"])
-    default_amount = suggest(columns, ["Importo", "Amount", "Valore"])
-    default_name = suggest(columns, ["Nome", "Name", "Beneficiario", "Controparte"])
-    default_type = suggest(columns, ["Tipologia", "Tipo", "Type"])
-    default_iban = suggest(columns, ["Iban", "IBAN", "Account"])
+    def default_index(field, optional=False):
+        if suggested.get(field) not in columns:
+            return 0
+        return columns.index(suggested[field]) + (1 if optional else 0)
 
     col1, col2, col3 = st.columns(3)
     with col1:
         col_date = st.selectbox(
             "Colonna DATA operazione",
             options=columns,
-            index=columns.index(default_date) if default_date in columns else 0,
+            index=default_index("col_date"),
+            key=f"{key}_col_date",
         )
         col_amount = st.selectbox(
             "Colonna IMPORTO",
             options=columns,
-            index=columns.index(default_amount) if default_amount in columns else 0,
+            index=default_index("col_amount"),
+            key=f"{key}_col_amount",
         )
     with col2:
         col_desc = st.selectbox(
             "Colonna DESCRIZIONE",
             options=columns,
-            index=columns.index(default_desc) if default_desc in columns else 0,
+            index=default_index("col_desc"),
+            key=f"{key}_col_desc",
         )
         col_name = st.selectbox(
             "Colonna NOME / merchant (opzionale)",
             options=["(nessuna)"] + columns,
-            index=(columns.index(default_name) + 1) if default_name in columns else 0,
+            index=default_index("col_name", optional=True),
+            key=f"{key}_col_name",
         )
     with col3:
         col_type = st.selectbox(
             "Colonna TIPOLOGIA (opzionale)",
             options=["(nessuna)"] + columns,
-            index=(columns.index(default_type) + 1) if default_type in columns else 0,
+            index=default_index("col_type", optional=True),
+            key=f"{key}_col_type",
         )
         col_iban = st.selectbox(
             "Colonna IBAN / conto (opzionale)",
             options=["(nessuna)"] + columns,
-            index=(columns.index(default_iban) + 1) if default_iban in columns else 0,
+            index=default_index("col_iban", optional=True),
+            key=f"{key}_col_iban",
         )
 
-    if st.button("✅ Conferma mappatura e prepara dati"):
-        df_internal = build_internal_df(
-            df_raw,
-            col_date,
-            col_desc,
-            col_amount,
-            None if col_name == "(nessuna)" else col_name,
-            None if col_type == "(nessuna)" else col_type,
-            None if col_iban == "(nessuna)" else col_iban,
+    mapping = {
+        "col_date": col_date,
+        "col_desc": col_desc,
+        "col_amount": col_amount,
+        "col_name": None if col_name == "(nessuna)" else col_name,
+        "col_type": None if col_type == "(nessuna)" else col_type,
+        "col_iban": None if col_iban == "(nessuna)" else col_iban,
+    }
+    col_profile, col_account = st.columns(2)
+    with col_profile:
+        profile_name = st.text_input(
+            "Nome del profilo (es. la banca)",
+            value=profile["name"] if profile else os.path.splitext(upload["name"])[0],
+            key=f"{key}_profile_name",
+        )
+    with col_account:
+        account = st.text_input(
+            "Conto delle transazioni",
+            value=(profile and profile["account"]) or DEFAULT_ACCOUNT,
+            disabled=mapping["col_iban"] is not None,
+            help="Usato quando il file non ha una colonna IBAN: con più banche "
+            "senza IBAN dai a ognuna un nome diverso.",
+            key=f"{key}_account",
         )
+    save = st.checkbox(
+        "Ricorda questa mappatura per i prossimi file con le stesse colonne",
+        value=True,
+        key=f"{key}_save_profile",
+    )
+    # La stessa mappatura si può riusare con batch_cli.py --mapping
+    st.download_button(
+        label="💾 Salva mappatura (JSON)",
+        data=json.dumps(mapping, indent=2, ensure_ascii=False).encode("utf-8"),
+        file_name="mappatura_colonne.json",
+        mime="application/json",
+        key=f"{key}_download_mapping",
+    )
+    return {
+        "mapping": mapping,
+        "account": None if mapping["col_iban"] else account,
+        "profile_name": profile_name.strip() or upload["name"],
+        "save": save,
+    }
 
-        with st.spinner("📊 Categorizzazione con regole..."):
-            df_categorized = df_internal.apply(categorize_row_basic, axis=1)
+TABLE_PAGE_SIZE = 100
+COLUMN_LABELS = {
+    "date": "Data",
+    "amount": "Importo",
+    "description": "Descrizione",
+    "canonical_merchant": "Merchant",
+    "macro_category": "Macro-categoria",
+    "subcategory": "Sottocategoria",
+    "account": "Conto",
+    "direction": "Direzione",
+}
+EXPORT_FORMATS = {"CSV": ("csv", "text/csv"), "Parquet": ("parquet", "application/octet-stream")}
 
-        if use_ai and ai_client:
-            uncategorized = df_categorized[df_categorized["subcategory"] == "Altro variabile"]
-            if len(uncategorized) > 0:
-                st.info(
-                    f"🤖 Trovate {len(uncategorized)} transazioni in 'Altro variabile'. L'AI le sta categorizzando..."
-                )
-                trans_for_ai = [
-                    {"description": row["description"], "amount": row["amount"]}
-                    for _, row in uncategorized.iterrows()
-                ]
-                with st.spinner(
-                    f"🤖 Categorizzazione AI in corso ({len(trans_for_ai)} transazioni)..."
-                ):
-                    ai_results = ai_batch_categorize(trans_for_ai, ai_client)
-                if ai_results:
-                    for idx_str, subcategory in ai_results.items():
-                        try:
-                            idx = int(idx_str)
-                            original_idx = uncategorized.iloc[idx].name
-                            if subcategory in FIXED_KEYWORDS:
-                                df_categorized.at[original_idx, "macro_category"] = "Fisso"
-                            elif subcategory in VARIABLE_KEYWORDS:
-                                df_categorized.at[original_idx, "macro_category"] = "Variabile"
-                            elif subcategory in SAVINGS_INVEST_KEYWORDS:
-                                df_categorized.at[original_idx, "macro_category"] = "Risparmi & investimenti"
-                            elif subcategory in INCOME_KEYWORDS:
-                                df_categorized.at[original_idx, "macro_category"] = "Entrata"
-                            df_categorized.at[original_idx, "subcategory"] = subcategory
-                        except Exception:
-                            pass
-                    st.success(f"✅ AI ha categorizzato {len(ai_results)} transazioni!")
-
-        st.subheader("📚 Transazioni categorizzate")
-        csv_export = df_categorized.to_csv(index=False).encode("utf-8")
-        st.download_button(
-            label="💾 Scarica dati categorizzati (CSV)",
-            data=csv_export,
-            file_name=f"finanze_categorizzate_{datetime.now().strftime('%Y%m%d')}.csv",
-            mime="text/csv",
+def render_table(table, key, lo=0, hi=None, export_name="transazioni"):
+    """Una pagina di ``table`` con ricerca, filtri, ordinamento ed export su richiesta."""
+    col_query, col_sort, col_order = st.columns([3, 2, 1])
+    with col_query:
+        query = st.text_input("🔎 Cerca in descrizione e merchant", key=f"{key}_query")
+    with col_sort:
+        sort_by = st.selectbox(
+            "Ordina per", SORT_COLUMNS, format_func=COLUMN_LABELS.get, key=f"{key}_sort"
         )
-        st.dataframe(df_categorized, use_container_width=True, hide_index=True)
-
-        col_a, col_b, col_c = st.columns(3)
-        with col_a:
-            st.metric("Numero transazioni", len(df_categorized))
-        with col_b:
-            saldo = df_categorized["amount"].sum(skipna=True)
-            st.metric("Saldo totale", f"€ {saldo:,.2f}")
-        with col_c:
-            data_min = df_categorized["date"].min()
-            data_max = df_categorized["date"].max()
-            if pd.notnull(data_min) and pd.notnull(data_max):
-                periodo = f"{data_min.date()} → {data_max.date()}"
-            else:
-                periodo = "N/D"
-            st.metric("Periodo coperto", periodo)
-
-        st.markdown("### 🎛 Filtro periodo")
+    with col_order:
+        descending = st.toggle("Decrescente", key=f"{key}_desc")
+    filters = {}
+    with st.expander("Filtri per colonna"):
+        for column, col in zip(FILTER_COLUMNS, st.columns(len(FILTER_COLUMNS))):
+            with col:
+                filters[column] = st.multiselect(
+                    COLUMN_LABELS[column], table.options(column), key=f"{key}_{column}"
+                )
+
+    with profiler.stage("table_select") as record:
+        positions = table.select(lo, hi, query, filters, sort_by, descending, key=key)
+        record["rows"] = len(positions)
+    n_pages = max(1, -(-len(positions) // TABLE_PAGE_SIZE))
+    # Dopo un filtro più stretto la pagina salvata può non esistere più
+    if st.session_state.get(f"{key}_page", 1) > n_pages:
+        st.session_state[f"{key}_page"] = n_pages
+    page = st.number_input("Pagina", min_value=1, max_value=n_pages, step=1, key=f"{key}_page")
+    st.dataframe(
+        table.page(positions, page - 1, TABLE_PAGE_SIZE),
+        use_container_width=True,
+        hide_index=True,
+    )
+    st.caption(f"{len(positions)} transazioni • pagina {page} di {n_pages}")
+
+    # L'export si genera solo su richiesta e vale finché la selezione non cambia
+    col_format, col_prepare, col_download = st.columns([1, 1, 2])
+    with col_format:
+        label = st.selectbox("Formato", list(EXPORT_FORMATS), key=f"{key}_format")
+    fmt, mime = EXPORT_FORMATS[label]
+    selection = (id(table), lo, hi, query, str(sorted(filters.items())), sort_by, descending, fmt)
+    export_key = f"{key}_export"
+    with col_prepare:
+        if st.button("📦 Prepara export", key=f"{key}_prepare"):
+            with st.spinner("Preparazione export..."):
+                st.session_state[export_key] = (selection, table.export(positions, fmt))
+    prepared = st.session_state.get(export_key)
+    if prepared is not None and prepared[0] == selection:
+        with col_download:
+            st.download_button(
+                label=f"💾 Scarica {len(positions)} transazioni ({label})",
+                data=prepared[1],
+                file_name=f"{export_name}_{datetime.now().strftime('%Y%m%d')}.{fmt}",
+                mime=mime,
+                key=f"{key}_download",
+            )
+
+def render_dashboard(dataset):
+    # plotly serve solo ai grafici: caricarlo qui alleggerisce la pagina iniziale
+    import plotly.express as px
+
+    # Ricorrenze cercate sull'intero dataset, una volta sola
+    if "recurring" not in dataset:
+        with profiler.stage("recurring_detect", rows=len(dataset["df"])):
+            dataset["recurring"] = detect_recurring(dataset["df"])
+    recurrences, is_recurring = dataset["recurring"]
+    # Cubo e tabella partono dalle righe già promosse: cambiando l'opzione si ricostruiscono
+    if dataset.get("promoted") != promote_recurring_rows:
+        with profiler.stage("recurring_promote", rows=int(is_recurring.sum())):
+            dataset["view"] = (
+                promote_recurring(dataset["df"], is_recurring) if promote_recurring_rows else dataset["df"]
+            )
+        dataset["promoted"] = promote_recurring_rows
+        dataset.pop("rollup", None)
+        dataset.pop("table", None)
+    df_categorized = dataset["view"]
+    # Cubo mensile e indice per data: costruiti una volta per dataset
+    if "rollup" not in dataset:
+        with profiler.stage("rollup", rows=len(df_categorized)):
+            dataset["rollup"] = PeriodRollup(df_categorized)
+    rollup = dataset["rollup"]
+    # Testo di ricerca e ordinamenti della tabella: anche questi una volta per dataset
+    if "table" not in dataset:
+        with profiler.stage("table_index", rows=len(rollup.df)):
+            dataset["table"] = TransactionTable(rollup.df)
+    table = dataset["table"]
+
+    st.subheader("📚 Transazioni categorizzate")
+    render_table(table, "table_all", export_name="finanze_categorizzate")
+
+    col_a, col_b, col_c = st.columns(3)
+    with col_a:
+        st.metric("Numero transazioni", len(df_categorized))
+    with col_b:
+        saldo = amounts_float64(df_categorized["amount"]).sum(skipna=True)
+        st.metric("Saldo totale", f"€ {saldo:,.2f}")
+    with col_c:
+        data_min = rollup.date_min
+        data_max = rollup.date_max
         if pd.notnull(data_min) and pd.notnull(data_max):
-            start_default = data_min.date()
-            end_default = data_max.date()
+            periodo = f"{data_min.date()} → {data_max.date()}"
         else:
-            start_default = end_default = date.today()
+            periodo = "N/D"
+        st.metric("Periodo coperto", periodo)
 
-        start_date, end_date = st.date_input(
-            "Seleziona intervallo date",
-            value=(start_default, end_default),
-        )
+    st.markdown("### 🎛 Filtro periodo")
+    if pd.notnull(data_min) and pd.notnull(data_max):
+        start_default = data_min.date()
+        end_default = data_max.date()
+    else:
+        start_default = end_default = date.today()
 
-        mask = df_categorized["date"].between(
-            pd.to_datetime(start_date), pd.to_datetime(end_date)
-        )
-        df_filtered = df_categorized[mask].copy()
-        df_filtered["amount_abs"] = df_filtered["amount"].abs()
-
-        st.markdown("### 📌 Sintesi periodo selezionato")
-        col_a, col_b, col_c = st.columns(3)
-        with col_a:
-            st.metric("Numero transazioni", len(df_filtered))
-        with col_b:
-            saldo_reale = df_filtered["amount"].sum(skipna=True)
-            st.metric("Saldo netto (Entrate - Uscite)", f"€ {saldo_reale:,.2f}")
-        with col_c:
-            spese_fisse = df_filtered.loc[
-                df_filtered["macro_category"] == "Fisso", "amount_abs"
-            ].sum()
-            spese_var = df_filtered.loc[
-                df_filtered["macro_category"] == "Variabile", "amount_abs"
-            ].sum()
-            st.metric(
-                "Spese fisse / variabili",
-                f"Fisso: {spese_fisse:,.0f}€ • Var: {spese_var:,.0f}€",
-            )
+    period = st.date_input(
+        "Seleziona intervallo date",
+        value=(start_default, end_default),
+    )
+    # Durante la selezione il widget restituisce una sola data
+    start_date, end_date = (period[0], period[-1]) if period else (start_default, end_default)
+
+    with profiler.stage("period_filter") as record:
+        lo, hi = rollup.positions(start_date, end_date)
+        summary = rollup.summary(start_date, end_date)
+        record["rows"] = hi - lo
+    with profiler.stage("chart_aggregates", rows=len(summary)):
+        charts = chart_aggregates(summary)
+    by_macro = charts["by_macro"]
 
-        st.markdown("### 🥧 Macro-categorie (Entrate / Fissi / Variabili / Risparmi)")
-        df_macro = df_filtered.copy()
-        df_macro["value_for_chart"] = df_macro.apply(
-            lambda r: r["amount"] if r["macro_category"] == "Entrata" else r["amount_abs"],
-            axis=1,
+    st.markdown("### 📌 Sintesi periodo selezionato")
+    col_a, col_b, col_c = st.columns(3)
+    with col_a:
+        st.metric("Numero transazioni", int(summary["count"].sum()))
+    with col_b:
+        saldo_reale = summary["amount"].sum()
+        st.metric("Saldo netto (Entrate - Uscite)", f"€ {saldo_reale:,.2f}")
+    with col_c:
+        spese_fisse = by_macro["amount_abs"].get("Fisso", 0.0)
+        spese_var = by_macro["amount_abs"].get("Variabile", 0.0)
+        st.metric(
+            "Spese fisse / variabili",
+            f"Fisso: {spese_fisse:,.0f}€ • Var: {spese_var:,.0f}€",
         )
-        agg_macro = df_macro.groupby("macro_category")["value_for_chart"].sum().reset_index()
-        if not agg_macro.empty:
+
+    st.markdown("### 🥧 Macro-categorie (Entrate / Fissi / Variabili / Risparmi)")
+    agg_macro = charts["macro_pie"]
+    if not agg_macro.empty:
+        with profiler.stage("chart_macro_pie", rows=len(agg_macro)):
             fig_macro = px.pie(
                 agg_macro,
                 names="macro_category",
@@ -538,18 +666,13 @@ if uploaded_file is not None:
                 title="Distribuzione importi per macro-categoria",
             )
             st.plotly_chart(fig_macro, use_container_width=True)
-        else:
-            st.info("Nessuna transazione nel periodo selezionato.")
-
-        st.markdown("### 📊 Sottocategorie spese variabili")
-        df_var = df_filtered[df_filtered["macro_category"] == "Variabile"]
-        agg_sub = (
-            df_var.groupby("subcategory")["amount_abs"]
-            .sum()
-            .reset_index()
-            .sort_values("amount_abs")
-        )
-        if not agg_sub.empty:
+    else:
+        st.info("Nessuna transazione nel periodo selezionato.")
+
+    st.markdown("### 📊 Sottocategorie spese variabili")
+    agg_sub = charts["variable_bar"]
+    if not agg_sub.empty:
+        with profiler.stage("chart_variable_bar", rows=len(agg_sub)):
             fig_sub = px.bar(
                 agg_sub,
                 x="amount_abs",
@@ -559,21 +682,326 @@ if uploaded_file is not None:
                 labels={"amount_abs": "Importo €", "subcategory": "Categoria"},
             )
             st.plotly_chart(fig_sub, use_container_width=True)
-        else:
-            st.info("Nessuna spesa variabile nel periodo selezionato.")
-
-        if ai_client and len(df_filtered) > 0:
-            st.markdown("### 💡 Consigli AI per il budget")
-            with st.spinner("🤖 Sto generando consigli personalizzati..."):
-                consigli = generate_budget_advice(df_filtered, ai_client)
-            st.info(consigli)
+    else:
+        st.info("Nessuna spesa variabile nel periodo selezionato.")
 
-        st.markdown("### 📚 Transazioni filtrate")
+    st.markdown("### 🔁 Pagamenti ricorrenti")
+    active = recurrences[recurrences["active"]]
+    recurring_columns = {
+        "merchant": st.column_config.TextColumn("Merchant"),
+        "period": st.column_config.TextColumn("Periodicità"),
+        "next_date": st.column_config.DateColumn("Prossimo addebito", format="DD/MM/YYYY"),
+        "next_amount": st.column_config.NumberColumn("Importo previsto", format="€ %.2f"),
+        "monthly_cost": st.column_config.NumberColumn("Costo mensile", format="€ %.2f"),
+        "charges": st.column_config.NumberColumn("Addebiti"),
+        "last_date": st.column_config.DateColumn("Ultimo addebito", format="DD/MM/YYYY"),
+        "subcategory": st.column_config.TextColumn("Sottocategoria"),
+    }
+    if not active.empty:
+        st.caption(
+            f"{len(active)} pagamenti ricorrenti attivi • circa € "
+            f"{active['monthly_cost'].sum():,.2f} al mese"
+        )
         st.dataframe(
-            df_filtered.drop(columns=["amount_abs"]),
+            active[list(recurring_columns)],
+            column_config=recurring_columns,
             use_container_width=True,
             hide_index=True,
         )
+    else:
+        st.info("Nessun pagamento ricorrente attivo rilevato.")
+    ended = recurrences[~recurrences["active"]]
+    if not ended.empty:
+        with st.expander(f"Ricorrenze concluse ({len(ended)})"):
+            st.dataframe(
+                ended[list(recurring_columns)],
+                column_config=recurring_columns,
+                use_container_width=True,
+                hide_index=True,
+            )
+
+    if ai_configured() and hi > lo:
+        st.markdown("### 💡 Consigli AI per il budget")
+        prompt = build_budget_prompt(summary)
+        memo = advice_memo()
+        key = advice_key(prompt)
+        if key in memo:
+            st.info(memo[key])
+        elif init_ai() is not None:
+            # Nessun consiglio per questi aggregati: la risposta arriva token per token
+            try:
+                with profiler.stage("generate_budget_advice"):
+                    consigli = st.write_stream(
+                        stream_budget_advice(prompt, profiler.wrap_client(init_ai()))
+                    )
+                if isinstance(consigli, str):
+                    remember_advice(key, consigli.strip())
+            except Exception as e:
+                st.info(f"Errore generazione consigli: {e}")
+
+    st.markdown("### 📚 Transazioni filtrate")
+    render_table(table, "table_period", lo, hi, export_name="finanze_periodo")
+
+    if sheets_configured():
+        render_sheets_sync(dataset)
+
+def render_sheets_sync(dataset):
+    """Invia al foglio Google condiviso le transazioni che non ha ancora."""
+    st.markdown("### 📤 Google Sheets")
+    if not st.button(f"📤 Sincronizza con il foglio «{SHEETS_WORKSHEET}»"):
+        return
+    # Con lo storico si invia lo storico intero, con le impronte salvate
+    if use_history:
+        source = init_history_store().load(columns=[column for column, _ in SHEET_COLUMNS])
+    else:
+        source = dataset["df"]
+    stats = {}
+    try:
+        with st.spinner("📤 Sincronizzazione delle transazioni nuove..."), sheet_sync_lock():
+            sync_to_sheet(
+                source,
+                init_sheet(),
+                chunk_rows=SHEETS_CHUNK_ROWS,
+                requests_per_second=SHEETS_REQUESTS_PER_SECOND,
+                stats=stats,
+                profiler=profiler,
+            )
+    except Exception as e:
+        st.error(f"❌ Sincronizzazione non riuscita: {e}")
+        return
+    if stats["rows"]:
+        st.success(
+            f"✅ {stats['rows']} transazioni aggiunte al foglio in {stats['calls']} chiamate API "
+            f"({stats['skipped']} già presenti)."
+        )
+    else:
+        st.info(f"Il foglio è già aggiornato: {stats['skipped']} transazioni già presenti.")
+
+def render_profile_panel():
+    """Tempi per fase dell'ultima preparazione dati e del rerun corrente, con export JSON."""
+    prepared = st.session_state.get("prepare_profile")
+    runs = {"preparazione": prepared if prepared is not profiler else None, "rerun": profiler}
+    report = {name: p.to_dict() for name, p in runs.items() if p is not None and p.stages}
+    with st.sidebar.expander("🩺 Tempi e memoria per fase", expanded=True):
+        if not report:
+            st.caption("Nessuna fase misurata: conferma la mappatura per misurare la preparazione dati.")
+            return
+        for name, data in report.items():
+            st.caption(f"**{name.capitalize()}** • {data['started']}")
+            st.dataframe(pd.DataFrame(data["stages"]), hide_index=True, use_container_width=True)
+            ai = data["ai"]
+            if ai["requests"]:
+                st.caption(
+                    f"🤖 {ai['requests']} richieste AI ({ai['errors']} errori) • "
+                    f"latenza mediana {ai['seconds_median']:.2f}s, max {ai['seconds_max']:.2f}s • "
+                    f"prompt {ai['prompt_chars']:,} caratteri, risposte {ai['response_chars']:,}"
+                )
+        st.download_button(
+            label="💾 Esporta misure (JSON)",
+            data=json.dumps(report, indent=2, ensure_ascii=False).encode("utf-8"),
+            file_name=f"profilo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+            mime="application/json",
+        )
+
+def render_rules_panel():
+    """Regole in uso, con righe catturate e tempo per regola; restituisce il ``RuleSet`` mostrato."""
+    try:
+        rules = RULES.current()
+    except Exception as e:
+        st.sidebar.error(f"❌ Regole di categorizzazione non caricate ({RULES_PATH}): {e}")
+        st.stop()
+    with st.sidebar.expander(f"📏 Regole di categorizzazione ({len(rules)})"):
+        st.caption(
+            f"`{RULES_PATH}` • versione {rules.version}: il file si ricarica da solo quando cambia. "
+            "Le regole nuove valgono per le transazioni importate da quel momento."
+        )
+        if RULES.error:
+            st.warning(f"⚠️ Il file modificato non è valido, restano le regole precedenti: {RULES.error}")
+        report = rules.report()
+        if rules.rows:
+            idle = report.loc[report["hits"] == 0, "id"].tolist()
+            top = report.loc[report["hits"].idxmax()]
+            slow = report.loc[report["ms"].idxmax()]
+            st.caption(
+                f"{rules.rows:,} righe categorizzate • «{top['id']}» ne cattura il {top['share']:.0%} • "
+                f"la più lenta è «{slow['id']}» ({slow['ms']:.1f} ms stimati)"
+                + (f" • mai usate: {', '.join(idle)}" if idle else "")
+            )
+        st.dataframe(
+            report.rename(columns={
+                "id": "Regola",
+                "subcategory": "Sottocategoria",
+                "priority": "Priorità",
+                "hits": "Righe",
+                "share": "Quota",
+                "ms": "ms stimati",
+            }),
+            hide_index=True,
+            use_container_width=True,
+        )
+        if st.button("🧹 Azzera contatori regole"):
+            rules.reset_stats()
+    return rules
+
+# ---------------------------------------------------------
+# Corpo principale app
+# ---------------------------------------------------------
+if use_ai:
+    st.sidebar.caption(f"🗂 Cache AI: {len(init_ai_cache())} merchant memorizzati")
+    if st.sidebar.button("🧹 Svuota cache AI"):
+        init_ai_cache().clear()
+if use_local_model:
+    report = init_local_model().report(LOCAL_MIN_CONFIDENCE)
+    if report["accuracy"] is not None:
+        st.sidebar.caption(
+            f"🧠 Classificatore locale: {report['trained']} merchant appresi, accuratezza "
+            f"{report['accuracy']:.0%} su {report['holdout']} di verifica "
+            f"({report['confident_share']:.0%} sopra soglia)"
+        )
+    else:
+        st.sidebar.caption(f"🧠 Classificatore locale: {report['trained']} merchant appresi")
+    if st.sidebar.button("🧹 Azzera classificatore locale"):
+        init_local_model().clear()
+# Una sola versione delle regole per tutto il rerun, anche se il file cambia nel frattempo
+rules = render_rules_panel()
+profiles = init_mapping_profiles()
+if len(profiles):
+    with st.sidebar.expander(f"🧩 Profili di mappatura ({len(profiles)})"):
+        for profile in profiles.profiles():
+            if st.button(f"🗑 {profile['name']}", key=f"remove_profile_{profile['signature']}"):
+                profiles.remove(profile["signature"])
+                st.rerun()
+if use_history:
+    st.sidebar.caption(f"📚 Storico: {len(init_history_store())} transazioni salvate")
+    if st.sidebar.button("🧹 Svuota storico"):
+        init_history_store().clear()
+        init_merchant_index.clear()
+        st.session_state.pop("dataset", None)
+
+# Avanzamento e risultato dell'AI in background, sopra al resto della pagina
+ai_status = st.container()
+
+if uploaded_files:
+    uploads = [inspect_upload(f, profiles) for f in uploaded_files]
+
+    st.subheader("📄 Estratti conto caricati")
+    for upload in uploads:
+        profile = upload["profile"]
+        if profile is not None:
+            st.success(f"✅ **{upload['name']}**: formato «{profile['name']}» riconosciuto")
+            upload["review"] = st.checkbox(
+                "Rivedi la mappatura", key=f"{upload['file'].file_id}_review"
+            )
+        else:
+            st.warning(f"🧩 **{upload['name']}**: formato nuovo, mappa le colonne")
+            upload["review"] = True
+        if upload["review"]:
+            with st.expander(f"Mappatura di {upload['name']}", expanded=True):
+                upload.update(mapping_form(upload))
+        else:
+            upload.update(mapping=profile["mapping"], account=profile["account"], save=False)
+
+    # Il risultato resta valido finché file, mappature, regole e opzioni AI non cambiano
+    dataset_key = "|".join([
+        *(
+            f"{u['digest']}:{json.dumps(u['mapping'], sort_keys=True)}:{u['account']}"
+            for u in uploads
+        ),
+        f"ai={use_ai}",
+        f"local={use_local_model}",
+        f"sign={ai_group_by_sign}",
+        f"history={use_history}",
+        f"rules={rules.version}",
+    ])
+    # File tutti riconosciuti: si elabora subito, senza passare dalla mappatura.
+    # Una volta sola per gruppo di file e versione delle regole; cambiando le
+    # opzioni si conferma a mano.
+    files_key = "|".join([*sorted(u["digest"] for u in uploads), rules.version])
+    auto_prepared = st.session_state.setdefault("auto_prepared", set())
+    auto_prepare = not any(u["review"] for u in uploads) and files_key not in auto_prepared
+
+    if st.button("✅ Conferma mappatura e prepara dati") or auto_prepare:
+        auto_prepared.add(files_key)
+        for upload in uploads:
+            if upload["save"]:
+                profiles.save(
+                    upload["preview"].columns,
+                    upload["mapping"],
+                    upload["profile_name"],
+                    upload["account"],
+                )
+        if use_history:
+            store = init_history_store()
+            stats = {}
+            with st.spinner("📊 Lettura in parallelo e categorizzazione delle sole transazioni nuove..."):
+                with profiler.stage("history_fingerprints"):
+                    known_fingerprints = store.fingerprints()
+                df_categorized = process_files(
+                    upload_jobs(uploads),
+                    known_fingerprints=known_fingerprints,
+                    stats=stats,
+                    profiler=profiler,
+                    merchant_index=init_merchant_index(),
+                    rules=rules,
+                )
+            st.info(
+                f"📚 {len(df_categorized)} transazioni nuove, "
+                f"{stats['skipped'] - stats['duplicates']} già presenti nello storico"
+                + (f", {stats['duplicates']} ripetute in più file." if stats["duplicates"] else ".")
+            )
+            if len(uploads) > 1:
+                st.caption(" • ".join(
+                    f"{name}: {s['rows']} lette, {s['skipped']} già nello storico"
+                    for name, s in stats["files"].items()
+                ))
+        else:
+            with st.spinner("📊 Lettura in parallelo e categorizzazione con regole..."):
+                with profiler.stage("categorize_uploads") as record:
+                    df_categorized = categorize_uploads(
+                        [u["digest"] for u in uploads],
+                        uploads,
+                        [(u["name"], u["csv_format"], u["mapping"], u["account"]) for u in uploads],
+                        rules.version,
+                        rules,
+                        _profiler=profiler,
+                    )
+                    record["rows"] = len(df_categorized)
+
+        st.session_state.pop("ai_pending", None)
+        ai_pending = None
+        if use_ai or use_local_model:
+            ai_pending = run_ai_categorization(df_categorized, ai_group_by_sign)
+
+        if ai_pending is not None:
+            # Finché l'AI non risponde il dashboard mostra le categorie di regole e
+            # modello locale; le righe nuove entrano nello storico a lavoro concluso
+            st.session_state["ai_pending"] = {
+                **ai_pending,
+                "df": df_categorized,
+                "dataset_key": dataset_key,
+                "history": use_history,
+            }
+            if use_history:
+                with profiler.stage("history_load") as record:
+                    history = compact_transactions(store.load(columns=DASHBOARD_COLUMNS))
+                    df_categorized = concat_transactions(
+                        [history, df_categorized[DASHBOARD_COLUMNS]]
+                    ).sort_values("date", kind="stable", ignore_index=True)
+                    record["rows"] = len(df_categorized)
+        elif use_history:
+            with profiler.stage("history_append", rows=len(df_categorized)):
+                store.append_new(df_categorized)
+            with profiler.stage("history_load") as record:
+                df_categorized = compact_transactions(store.load(columns=DASHBOARD_COLUMNS))
+                record["rows"] = len(df_categorized)
+        st.session_state["dataset"] = {"key": dataset_key, "df": df_categorized}
+        if profiler.enabled:
+            # Le fasi di preparazione restano visibili nei rerun successivi
+            st.session_state["prepare_profile"] = profiler
+
+    dataset = st.session_state.get("dataset")
+    if dataset is not None and dataset["key"] == dataset_key:
+        render_dashboard(dataset)
 
 else:
     st.info("👆 Carica un CSV dal sidebar per iniziare.")
@@ -583,3 +1011,23 @@ else:
 - Le colonne tipiche sono: `Data operazione`, `Data contabile`, `Iban`, `Tipologia`, `Nome`, `Descrizione`, `Importo ( € )`.
 - L'app proverà a riconoscerle automaticamente, ma puoi sempre cambiarle dalla mappatura."""
     )
+    if use_history:
+        store = init_history_store()
+        n_history = len(store)
+        if n_history and st.checkbox(f"📚 Mostra lo storico salvato ({n_history} transazioni)"):
+            history_key = f"history|{store.version()}"
+            dataset = st.session_state.get("dataset")
+            if dataset is None or dataset["key"] != history_key:
+                # Legge solo le colonne usate dalla dashboard, non i CSV originali
+                dataset = {"key": history_key, "df": compact_transactions(store.load(columns=DASHBOARD_COLUMNS))}
+                st.session_state["dataset"] = dataset
+            render_dashboard(dataset)
+
+with ai_status:
+    if "ai_report" in st.session_state:
+        report_ai_stats(st.session_state.pop("ai_report"))
+    if "ai_pending" in st.session_state:
+        render_ai_job()
+
+if show_profile:
+    render_profile_panel()
@@ -0,0 +1,301 @@
+"""Categorizzazione batch di estratti conto CSV, senza interfaccia Streamlit.
+
+Uso::
+
+    python batch_cli.py estratti/ "archivio/*.csv" --mapping mappatura_colonne.json \\
+        --output-dir categorizzate --format parquet --workers 4 [--local] [--ai]
+
+La mappatura è il JSON scaricato dall'app ("💾 Salva mappatura (JSON)"); senza
+``--mapping`` si usa il profilo salvato dall'app per le intestazioni del file
+(``--profiles``) e, se non c'è, le colonne vengono riconosciute come nell'app. I file vengono
+letti e categorizzati con le regole in processi paralleli; con ``--ai`` le
+righe rimaste in 'Altro variabile' passano poi dalla cache merchant e
+dall'AI, nel processo principale; con ``--local`` prima dell'AI le prova il
+classificatore locale, che impara dalle righe categorizzate. Nella cartella
+di output finiscono un file categorizzato per ogni CSV e ``summary.json``.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tomllib
+from concurrent.futures import ProcessPoolExecutor
+
+from frame_schema import amounts_float64
+from local_classifier import MerchantClassifier
+from mapping_profiles import MappingProfiles
+from merchant_cache import MerchantCategoryCache
+from pipeline import (
+    AI_CACHE_MAX_ENTRIES,
+    AI_CACHE_PATH,
+    AI_CACHE_VERSION,
+    ALL_SUBCATEGORIES,
+    LOCAL_MIN_CONFIDENCE,
+    LOCAL_MODEL_PATH,
+    MAPPING_KEYWORDS,
+    MAPPING_PROFILES_PATH,
+    REQUIRED_MAPPING,
+    ai_recategorize,
+    process_csv,
+    read_csv_preview,
+    sniff_csv,
+    suggest_mapping,
+)
+
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+
+
+def expand_inputs(patterns) -> list:
+    """File CSV indicati da cartelle, glob o percorsi, senza duplicati."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(glob.glob(os.path.join(pattern, "*.csv"))))
+        else:
+            paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return list(dict.fromkeys(os.path.abspath(p) for p in paths))
+
+
+def load_mapping(path) -> dict:
+    with open(path, encoding="utf-8") as f:
+        mapping = json.load(f)
+    unknown = set(mapping) - set(MAPPING_KEYWORDS)
+    if unknown:
+        raise ValueError(f"chiavi di mappatura sconosciute: {', '.join(sorted(unknown))}")
+    return {key: mapping.get(key) for key in MAPPING_KEYWORDS}
+
+
+def resolve_mapping(columns, mapping=None) -> dict:
+    if mapping is None:
+        mapping = suggest_mapping(columns)
+    missing = [key for key in REQUIRED_MAPPING if mapping.get(key) not in columns]
+    if missing:
+        raise ValueError(f"colonne obbligatorie non trovate: {', '.join(missing)}")
+    # Le colonne opzionali assenti da questo file vengono ignorate
+    return {key: value if value in columns else None for key, value in mapping.items()}
+
+
+def categorize_file(path, mapping=None, profiles_path=None):
+    """Lavoro di un processo: lettura a blocchi e categorizzazione con regole."""
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        csv_format = sniff_csv(f)
+        columns = read_csv_preview(f, csv_format, nrows=0).columns.tolist()
+        profile = None
+        if mapping is None and profiles_path:
+            profile = MappingProfiles(profiles_path).get(columns)
+        account = profile["account"] if profile else None
+        mapping = resolve_mapping(columns, profile["mapping"] if profile else mapping)
+        stats = {}
+        df = process_csv(f, csv_format, mapping, stats=stats, account=account)
+    stats.update(
+        csv_format=csv_format,
+        mapping=mapping,
+        profile=profile["name"] if profile else None,
+        seconds=time.perf_counter() - started,
+    )
+    return df, stats
+
+
+def load_ai_client():
+    """Client Hugging Face da ``HF_TOKEN`` o da ``.streamlit/secrets.toml``."""
+    token = os.environ.get("HF_TOKEN")
+    if not token and os.path.exists(SECRETS_PATH):
+        with open(SECRETS_PATH, "rb") as f:
+            token = tomllib.load(f).get("huggingface", {}).get("api_key")
+    if not token:
+        raise RuntimeError(f"nessun token Hugging Face (HF_TOKEN o {SECRETS_PATH})")
+    from huggingface_hub import InferenceClient
+
+    return InferenceClient(token=token)
+
+
+def file_summary(df) -> dict:
+    amount = amounts_float64(df["amount"])
+    by_macro = amount.groupby(df["macro_category"], observed=True).sum()
+    by_sub = amount.groupby(df["subcategory"], observed=True).agg(["sum", "size"])
+    dates = df["date"].dropna()
+    return {
+        "rows": len(df),
+        "date_min": str(dates.min().date()) if len(dates) else None,
+        "date_max": str(dates.max().date()) if len(dates) else None,
+        "balance": round(float(amount.sum()), 2),
+        "by_macro_category": {k: round(float(v), 2) for k, v in by_macro.items()},
+        "by_subcategory": {
+            k: {"amount": round(float(row["sum"]), 2), "count": int(row["size"])}
+            for k, row in by_sub.iterrows()
+        },
+    }
+
+
+def output_paths(paths, output_dir, fmt) -> list:
+    """Un file di output distinto per ogni input, nello stesso ordine.
+
+    Il nome è ``<nome>_categorizzate.<fmt>``; se più input hanno lo stesso
+    nome (es. ``a/estratto.csv`` e ``b/estratto.csv``) davanti si aggiungono
+    le cartelle che li distinguono (``a_estratto_...``) e, se non basta, un
+    contatore.
+    """
+    stems = [os.path.splitext(os.path.basename(p))[0] for p in paths]
+    for stem in set(stems):
+        same = [i for i, s in enumerate(stems) if s == stem]
+        if len(same) < 2:
+            continue
+        root = os.path.commonpath([os.path.dirname(paths[i]) for i in same])
+        for i in same:
+            folders = os.path.relpath(os.path.dirname(paths[i]), root)
+            if folders != os.curdir:
+                stems[i] = f"{folders.replace(os.sep, '_')}_{stem}"
+    names, used = [], set()
+    for stem in stems:
+        name, n = f"{stem}_categorizzate.{fmt}", 1
+        while name.lower() in used:
+            n += 1
+            name = f"{stem}_{n}_categorizzate.{fmt}"
+        used.add(name.lower())
+        names.append(os.path.join(output_dir, name))
+    return names
+
+
+def write_output(df, out_path, fmt) -> str:
+    if fmt == "parquet":
+        df.to_parquet(out_path, index=False)
+    else:
+        df.assign(amount=amounts_float64(df["amount"])).to_csv(out_path, index=False)
+    return out_path
+
+
+class _InlineJob:
+    # Stessa interfaccia di un Future, per l'esecuzione senza processi figli
+    def __init__(self, func, *args):
+        self._func, self._args = func, args
+
+    def result(self):
+        return self._func(*self._args)
+
+
+def run(
+    paths,
+    mapping,
+    output_dir,
+    fmt="csv",
+    workers=None,
+    client=None,
+    cache=None,
+    log=print,
+    local_model=None,
+    profiles_path=None,
+) -> dict:
+    """Elabora ``paths`` e restituisce il riepilogo scritto in ``summary.json``."""
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.perf_counter()
+    outputs = output_paths(paths, output_dir, fmt)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    if workers == 1:
+        jobs = [_InlineJob(categorize_file, path, mapping, profiles_path) for path in paths]
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        jobs = [pool.submit(categorize_file, path, mapping, profiles_path) for path in paths]
+
+    files = []
+    for path, out_path, job in zip(paths, outputs, jobs):
+        entry = {"input": path}
+        try:
+            df, stats = job.result()
+        except Exception as e:
+            entry["error"] = f"{type(e).__name__}: {e}"
+            log(f"✗ {path}: {entry['error']}")
+            files.append(entry)
+            continue
+        entry.update(
+            sep=stats["csv_format"]["sep"],
+            encoding=stats["csv_format"]["encoding"],
+            mapping=stats["mapping"],
+            profile=stats["profile"],
+            read_seconds=round(stats["seconds"], 3),
+        )
+        if client is not None or cache is not None or local_model is not None:
+            ai_stats = ai_recategorize(df, client, cache, local_model=local_model)
+            entry["ai"] = {k: v for k, v in ai_stats.items() if k != "errors"}
+            entry["ai"]["failed_batches"] = len(ai_stats["errors"])
+        entry["output"] = write_output(df, out_path, fmt)
+        entry.update(file_summary(df))
+        log(f"✓ {path}: {entry['rows']} transazioni → {entry['output']}")
+        files.append(entry)
+    if workers > 1:
+        pool.shutdown()
+
+    done = [f for f in files if "error" not in f]
+    summary = {
+        "files": files,
+        "processed": len(done),
+        "failed": len(files) - len(done),
+        "rows": sum(f["rows"] for f in done),
+        "workers": workers,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    if local_model is not None:
+        summary["local_model"] = local_model.report(LOCAL_MIN_CONFIDENCE)
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Categorizza in batch estratti conto CSV.")
+    parser.add_argument("inputs", nargs="+", help="file, cartelle o glob di CSV")
+    parser.add_argument("--mapping", help="JSON della mappatura colonne salvato dall'app")
+    parser.add_argument(
+        "--profiles",
+        default=MAPPING_PROFILES_PATH,
+        help="profili di mappatura salvati dall'app, usati se manca --mapping",
+    )
+    parser.add_argument("--output-dir", default="categorizzate")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--workers", type=int, default=None, help="processi paralleli (default: CPU)")
+    parser.add_argument("--ai", action="store_true", help="riclassifica 'Altro variabile' con cache e AI")
+    parser.add_argument("--no-cache", action="store_true", help="con --ai, non usa la cache merchant")
+    parser.add_argument(
+        "--local", action="store_true", help="riclassifica 'Altro variabile' con il classificatore locale"
+    )
+    args = parser.parse_args(argv)
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error("nessun file CSV trovato")
+    mapping = load_mapping(args.mapping) if args.mapping else None
+    client = cache = None
+    if args.ai:
+        client = load_ai_client()
+        if not args.no_cache:
+            cache = MerchantCategoryCache(
+                AI_CACHE_PATH,
+                version=AI_CACHE_VERSION,
+                max_entries=AI_CACHE_MAX_ENTRIES,
+            )
+
+    local_model = MerchantClassifier(LOCAL_MODEL_PATH, ALL_SUBCATEGORIES) if args.local else None
+
+    summary = run(
+        paths,
+        mapping,
+        args.output_dir,
+        args.format,
+        args.workers,
+        client,
+        cache,
+        local_model=local_model,
+        profiles_path=args.profiles,
+    )
+    print(
+        f"{summary['processed']} file elaborati ({summary['rows']} transazioni), "
+        f"{summary['failed']} con errori in {summary['seconds']}s. "
+        f"Riepilogo: {os.path.join(args.output_dir, 'summary.json')}"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
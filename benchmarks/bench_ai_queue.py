@@ -0,0 +1,76 @@
+"""Sessioni concorrenti sulla coda AI condivisa, con ``FakeInferenceClient``.
+
+Simula ``--sessions`` sessioni che caricano lo stesso estratto conto nello
+stesso momento: ognuna invia la stessa richiesta di categorizzazione alla
+``AIJobQueue`` e attende il risultato. Viene confrontato con il
+comportamento senza coda (ogni sessione chiama l'AI per conto suo): chiamate
+al client, tempo totale e attesa massima di una sessione.
+
+Uso: ``python benchmarks/bench_ai_queue.py [--sessions 8] [--merchants 400] [--latency 0.2]``
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pipeline  # noqa: E402
+from ai_batch import FakeInferenceClient  # noqa: E402
+from ai_jobs import AIJobQueue  # noqa: E402
+
+
+def transactions(n: int) -> list:
+    return [{"description": f"Pagamento POS negozio {i}", "amount": -float(i % 90 + 1)} for i in range(n)]
+
+
+def run_sessions(sessions: int, work) -> tuple:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        waits = list(pool.map(lambda _: work(), range(sessions)))
+    return time.perf_counter() - started, max(waits)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--merchants", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.2, help="secondi per chiamata del client finto")
+    args = parser.parse_args(argv)
+    request = transactions(args.merchants)
+
+    client = FakeInferenceClient(latency=args.latency)
+
+    def direct():
+        started = time.perf_counter()
+        pipeline.ai_batch_categorize(request, client)
+        return time.perf_counter() - started
+
+    seconds, worst = run_sessions(args.sessions, direct)
+    print(f"senza coda : {len(client.calls):>4} chiamate, {seconds:.2f}s, attesa massima {worst:.2f}s")
+
+    client = FakeInferenceClient(latency=args.latency)
+    queue = AIJobQueue(
+        lambda t, on_batch_done, errors, profiler: pipeline.ai_batch_categorize(
+            t, profiler.wrap_client(client), on_batch_done, errors
+        ),
+        model=pipeline.AI_MODEL,
+    )
+
+    def queued():
+        started = time.perf_counter()
+        job = queue.submit(list(request))
+        job.wait()
+        assert len(job.results) == len(request)
+        return time.perf_counter() - started
+
+    seconds, worst = run_sessions(args.sessions, queued)
+    print(
+        f"con la coda: {len(client.calls):>4} chiamate, {seconds:.2f}s, attesa massima {worst:.2f}s "
+        f"({queue.coalesced} richieste su {queue.submitted} unite a un job in corso)"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
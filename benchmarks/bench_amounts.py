@@ -0,0 +1,77 @@
+"""Confronto tra il parsing importi riga per riga (versione storica) e quello
+vettoriale di ``pipeline.parse_amounts``.
+
+Uso: ``python benchmarks/bench_amounts.py [righe ...]``
+"""
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pipeline  # noqa: E402
+
+
+def legacy_parse(values: pd.Series) -> pd.Series:
+    raw_amount = (
+        values.astype(str)
+        .str.strip()
+        .str.replace("€", "", regex=False)
+        .str.replace(" ", "", regex=False)
+    )
+
+    def parse_amount(x):
+        if x is None or x == "" or str(x).lower() == "nan":
+            return None
+        x = str(x)
+        if "," in x and x.rfind(",") > x.rfind("."):
+            x = x.replace(".", "").replace(",", ".")
+        elif "." in x and x.rfind(".") > x.rfind(","):
+            x = x.replace(",", "")
+        try:
+            return float(x)
+        except ValueError:
+            return None
+
+    return raw_amount.apply(parse_amount)
+
+
+def legacy_direction(amounts: pd.Series) -> pd.Series:
+    return amounts.apply(lambda x: "Entrata" if x is not None and x > 0 else "Uscita")
+
+
+def hype_amounts(n: int, seed: int = 0) -> pd.Series:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        cents = rng.randint(1, 300_000)
+        sign = "" if rng.random() < 0.15 else "-"
+        euros = f"{cents // 100:,}".replace(",", ".")
+        out.append(f"{sign}{euros},{cents % 100:02d}")
+    return pd.Series(out)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    print(f"{'righe':>10} {'parse old':>10} {'parse new':>10} {'dir old':>9} {'dir new':>9} {'speedup':>8}")
+    for n in sizes:
+        values = hype_amounts(n)
+        old, t_parse_old = timed(legacy_parse, values)
+        new, t_parse_new = timed(pipeline.parse_amounts, values)
+        assert np.allclose(old.to_numpy(dtype=float), new.to_numpy(), equal_nan=True)
+        _, t_dir_old = timed(legacy_direction, old)
+        _, t_dir_new = timed(lambda a: np.where(a.gt(0), "Entrata", "Uscita"), new)
+        speedup = (t_parse_old + t_dir_old) / (t_parse_new + t_dir_new)
+        print(f"{n:>10} {t_parse_old:>9.3f}s {t_parse_new:>9.3f}s {t_dir_old:>8.3f}s {t_dir_new:>8.3f}s {speedup:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100_000, 1_000_000])
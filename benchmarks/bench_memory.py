@@ -0,0 +1,70 @@
+"""Byte per transazione del dataset interno: schema storico (object/float64)
+contro schema compatto (categorie, string[pyarrow], float32).
+
+Uso: ``python benchmarks/bench_memory.py [righe]``
+"""
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pipeline  # noqa: E402
+from frame_schema import memory_report  # noqa: E402
+
+MAPPING = {
+    "col_date": "Data operazione",
+    "col_desc": "Descrizione",
+    "col_amount": "Importo ( € )",
+    "col_name": "Nome",
+    "col_type": "Tipologia",
+    "col_iban": "Iban",
+}
+MERCHANTS = [
+    "ESSELUNGA", "Netflix", "Bar Centrale", "Farmacia Comunale", "Amazon",
+    "Trenitalia", "Enel Energia", "Ristorante Da Mario", "Libreria Feltrinelli", "Negozio Rossi",
+]
+LEGACY_DTYPES = {
+    "description": object,
+    "amount": "float64",
+    "account": object,
+    "bank_category": object,
+    "direction": object,
+    "macro_category": object,
+    "subcategory": object,
+    "normalized_merchant": object,
+    "canonical_merchant": object,
+}
+
+
+def hype_csv(n: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    lines = ["Data operazione;Data contabile;Iban;Tipologia;Nome;Descrizione;Importo ( € )"]
+    for _ in range(n):
+        day = f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2020, 2024)}"
+        merchant = rng.choice(MERCHANTS)
+        amount = f"-{rng.randint(1, 300)},{rng.randint(0, 99):02d}"
+        lines.append(
+            f"{day};{day};IT60X0542811101000000123456;Pagamento;{merchant};"
+            f"Pagamento POS {merchant} {rng.randint(1, 500)};{amount}"
+        )
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def main(n: int):
+    data = hype_csv(n)
+    df = pipeline.process_csv(io.BytesIO(data), {"sep": ";", "encoding": "utf-8"}, MAPPING)
+    df = df.drop(columns=["fingerprint"])
+    legacy = df.astype(LEGACY_DTYPES)
+    legacy["amount"] = legacy["amount"].round(2)
+    before, after = memory_report(legacy), memory_report(df)
+    print(f"{n} transazioni")
+    print(f"{'colonna':<22} {'prima B/riga':>13} {'dopo B/riga':>12}")
+    for col in df.columns:
+        print(f"{col:<22} {before['by_column'][col] / n:>13.1f} {after['by_column'][col] / n:>12.1f}")
+    print(f"{'TOTALE':<22} {before['bytes_per_row']:>13.1f} {after['bytes_per_row']:>12.1f}"
+          f"  ({before['bytes'] / after['bytes']:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,55 @@
+"""Latenza di ``MerchantIndex`` con molti merchant noti: chiavi già viste,
+varianti vicine (ricerca per trigrammi) e merchant nuovi.
+
+Uso: ``python benchmarks/bench_merchant_index.py [merchant_noti]``
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from merchant_index import MerchantIndex, canonicalize_merchants  # noqa: E402
+
+LETTERS = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+QUERIES = 5_000
+
+
+def random_names(n: int, rng) -> list:
+    return [
+        f"{''.join(rng.choice(LETTERS, rng.integers(4, 12)))} {''.join(rng.choice(LETTERS, rng.integers(3, 9)))}"
+        for _ in range(n)
+    ]
+
+
+def per_query_us(func, queries) -> float:
+    started = time.perf_counter()
+    for q in queries:
+        func(q)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+
+def main(n: int):
+    rng = np.random.default_rng(0)
+    names = random_names(n, rng)
+    started = time.perf_counter()
+    index = MerchantIndex(names=names)
+    print(f"{n} merchant noti, indice costruito in {time.perf_counter() - started:.2f}s")
+
+    known = names[:QUERIES]
+    # Una lettera cambiata in fondo: resta sopra la soglia di similarità
+    variants = [name[:-1] + ("x" if name[-1] != "x" else "y") for name in known]
+    unknown = random_names(QUERIES, np.random.default_rng(1))
+    print(f"  chiave nota      {per_query_us(index.lookup, known):>8.1f} µs")
+    print(f"  variante vicina  {per_query_us(index.lookup, variants):>8.1f} µs")
+    print(f"  merchant nuovo   {per_query_us(index.lookup, unknown):>8.1f} µs")
+
+    raw = [f"PAGAMENTO POS {name.upper()} {rng.integers(1, 999)} MILANO" for name in known] * 20
+    started = time.perf_counter()
+    canonicalize_merchants(raw)
+    print(f"  canonicalize_merchants su {len(raw)} righe: {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50_000)
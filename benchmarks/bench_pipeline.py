@@ -0,0 +1,210 @@
+"""Tempi e picchi di memoria della pipeline, fase per fase, su estratti Hype sintetici.
+
+Fasi misurate separatamente: ``load_csv``, ``build_internal_df``,
+categorizzazione con regole, passaggio AI (client finto, senza rete, con
+cache merchant in memoria), costruzione del cubo mensile, filtro per periodo
+e aggregati dei grafici; ``process_csv`` misura il percorso a blocchi
+completo usato dall'app. Il picco di memoria è l'RSS massimo sopra quello di
+inizio fase, campionato da un thread.
+
+I risultati vanno in ``benchmarks/results/pipeline_latest.json`` e vengono
+confrontati con ``pipeline_baseline.json``: una fase più lenta della
+baseline oltre la tolleranza è una regressione (exit code 1). I tempi
+dipendono dalla macchina, quindi la baseline è locale (non versionata) e il
+confronto si fa solo se è stata registrata sulla stessa macchina (host,
+CPU, piattaforma e Python); altrimenti va rigenerata con ``--save-baseline``.
+
+Uso: ``python benchmarks/bench_pipeline.py [--sizes 1000 100000 1000000 5000000]
+[--save-baseline] [--tolerance 0.3]``
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+os.environ.setdefault("FINANZE_AI_REQUESTS_PER_SECOND", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pipeline  # noqa: E402
+from ai_batch import FakeInferenceClient  # noqa: E402
+from hype_synth import HYPE_MAPPING, write_hype_csv  # noqa: E402
+from merchant_cache import MerchantCategoryCache  # noqa: E402
+from rollups import PeriodRollup, budget_aggregates, chart_aggregates  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, ".data")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+LATEST_PATH = os.path.join(RESULTS_DIR, "pipeline_latest.json")
+BASELINE_PATH = os.path.join(RESULTS_DIR, "pipeline_baseline.json")
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000, 5_000_000]
+# Sotto questa durata il rumore conta più della fase
+MIN_COMPARE_SECONDS = 0.02
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class PeakMemory:
+    """RSS massimo sopra quello iniziale durante il blocco ``with`` (solo Linux)."""
+
+    def __init__(self, interval: float = 0.002):
+        self.interval = interval
+        self.available = os.path.exists("/proc/self/statm")
+        self.peak = 0
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_bytes() - self.start)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if self.available:
+            self.start = _rss_bytes()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.available:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, _rss_bytes() - self.start)
+
+
+def measure(results: dict, stage: str, func, *args, **kwargs):
+    gc.collect()
+    with PeakMemory() as mem:
+        started = time.perf_counter()
+        out = func(*args, **kwargs)
+        seconds = time.perf_counter() - started
+    results[stage] = {
+        "seconds": round(seconds, 4),
+        "peak_mb": round(mem.peak / 2**20, 1) if mem.available else None,
+    }
+    print(f"  {stage:<18} {seconds:>9.3f}s {results[stage]['peak_mb'] or 0:>9.1f} MB", flush=True)
+    return out
+
+
+def month_windows(rollup) -> list:
+    """Un intervallo per mese più l'intero periodo, come nel filtro della dashboard."""
+    starts = [s for s in rollup.month_starts.astype("datetime64[D]")]
+    windows = [(s, (s.astype("datetime64[M]") + 1).astype("datetime64[D]") - 1) for s in starts]
+    return windows + [(rollup.date_min, rollup.date_max)]
+
+
+def period_filter(rollup, windows):
+    return [(rollup.rows(start, end), rollup.summary(start, end)) for start, end in windows]
+
+
+def charts(filtered):
+    return [(chart_aggregates(summary), budget_aggregates(summary)) for _, summary in filtered]
+
+
+def ai_pass(df):
+    cache = MerchantCategoryCache(":memory:", pipeline.AI_CACHE_VERSION)
+    client = FakeInferenceClient()
+    stats = pipeline.ai_recategorize(df, client, cache)
+    stats["requests"] = len(client.calls)
+    return stats
+
+
+def bench_size(n: int, data_dir: str) -> dict:
+    path = os.path.join(data_dir, f"hype_{n}.csv")
+    if not os.path.exists(path):
+        print(f"  generazione {path}...", flush=True)
+        write_hype_csv(path, n)
+    results = {}
+    with open(path, "rb") as f:
+        raw = measure(results, "load_csv", pipeline.load_csv, f)
+    df = measure(results, "build_internal_df", pipeline.build_internal_df, raw, **HYPE_MAPPING)
+    del raw
+    df = measure(results, "categorize", pipeline.categorize_df, df)
+    ai_stats = measure(results, "ai_fake", ai_pass, df)
+    results["ai_fake"]["requests"] = ai_stats["requests"]
+    rollup = measure(results, "rollup", PeriodRollup, df)
+    windows = month_windows(rollup)
+    filtered = measure(results, "period_filter", period_filter, rollup, windows)
+    measure(results, "charts", charts, filtered)
+    del df, rollup, filtered
+    with open(path, "rb") as f:
+        csv_format = pipeline.sniff_csv(f)
+        measure(results, "process_csv", pipeline.process_csv, f, csv_format, HYPE_MAPPING)
+    return results
+
+
+def machine_info() -> dict:
+    return {
+        "host": platform.node(),
+        "processor": platform.processor() or platform.machine(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(latest: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for size, stages in latest["results"].items():
+        for stage, now in stages.items():
+            before = baseline.get("results", {}).get(size, {}).get(stage)
+            if not before or before["seconds"] < MIN_COMPARE_SECONDS:
+                continue
+            ratio = now["seconds"] / before["seconds"]
+            if ratio > 1 + tolerance:
+                regressions.append((size, stage, before["seconds"], now["seconds"], ratio))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--data-dir", default=DATA_DIR, help="dove tenere i CSV generati")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="rallentamento ammesso (0.3 = +30%%)")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    latest = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": machine_info(),
+        "results": {},
+    }
+    for n in args.sizes:
+        print(f"{n} transazioni", flush=True)
+        latest["results"][str(n)] = bench_size(n, args.data_dir)
+    with open(LATEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(latest, f, indent=2)
+
+    if args.save_baseline:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(latest, f, indent=2)
+        print(f"Baseline salvata in {BASELINE_PATH}")
+        return 0
+    if not os.path.exists(BASELINE_PATH):
+        print("Nessuna baseline: usa --save-baseline per crearla.")
+        return 0
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != latest["machine"]:
+        print(
+            f"Baseline registrata su un'altra macchina ({baseline.get('machine')}): "
+            "nessun confronto, rigenerala qui con --save-baseline."
+        )
+        return 0
+    regressions = compare(latest, baseline, args.tolerance)
+    for size, stage, before, now, ratio in regressions:
+        print(f"REGRESSIONE {size} righe, {stage}: {before:.3f}s → {now:.3f}s ({ratio:.2f}x)")
+    if not regressions:
+        print("Nessuna regressione rispetto alla baseline.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Tempo e qualità di ``detect_recurring`` su storici sintetici pluriennali.
+
+Lo storico copre ``--years`` anni: qualche centinaio di abbonamenti
+(settimanali, mensili, annuali) con giorni che slittano, addebiti saltati e
+aumenti di prezzo, più acquisti sporadici dagli stessi merchant e molte
+spese casuali da merchant diversi. Per ogni dimensione vengono riportati il
+tempo di rilevamento, precisione e richiamo sui merchant ricorrenti e quanti
+prossimi addebiti previsti cadono entro la tolleranza del periodo.
+
+Uso: ``python benchmarks/bench_recurring.py [--sizes 100000 1000000] [--years 5]``
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from recurring import PERIODS, detect_recurring  # noqa: E402
+
+SUBSCRIPTIONS = 300
+# Quota di abbonamenti per periodo: settimanali, mensili, annuali
+PERIOD_MIX = [0.15, 0.7, 0.15]
+NOISE_MERCHANTS = 20_000
+START = np.datetime64("2020-01-01")
+
+
+def plant_subscriptions(rng, years: int):
+    """Addebiti degli abbonamenti e, per ognuno, la scadenza dopo l'ultimo addebito."""
+    end = pd.Timestamp(START) + pd.DateOffset(years=years)
+    steps = [pd.Timedelta(days=7), pd.DateOffset(months=1), pd.DateOffset(years=1)]
+    merchants, dates, amounts, truth = [], [], [], {}
+    kinds = rng.choice(len(PERIODS), SUBSCRIPTIONS, p=PERIOD_MIX)
+    for i, kind in enumerate(kinds):
+        merchant = f"abbonamento {PERIODS[kind][0]} {i}"
+        price = round(float(rng.lognormal(2.5, 0.8)), 2)
+        due = pd.Timestamp(START) + pd.Timedelta(days=int(rng.integers(0, 365)))
+        while due <= end:
+            if merchants and rng.random() < 0.01:
+                price = round(price * 1.05, 2)
+            if rng.random() > 0.03:
+                # Il giorno di addebito può slittare (festivi, fine settimana)
+                jitter = pd.Timedelta(days=int(rng.integers(-2, 3)) if kind else 0)
+                merchants.append(merchant)
+                dates.append(np.datetime64(due + jitter, "D"))
+                amounts.append(-price)
+                truth[merchant] = due + steps[kind]
+            due = due + steps[kind]
+    return merchants, dates, amounts, truth
+
+
+def synthetic_history(n: int, years: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    merchants, dates, amounts, truth = plant_subscriptions(rng, years)
+    # Dai merchant degli abbonamenti anche acquisti sporadici con altri importi
+    extra = np.repeat(np.array(list(truth), dtype=object), rng.poisson(3 * years, len(truth)))
+    noise = max(0, n - len(merchants) - len(extra))
+    pool = np.array([f"negozio {i}" for i in range(NOISE_MERCHANTS)], dtype=object)
+    merchants = np.r_[np.array(merchants, dtype=object), extra, rng.choice(pool, noise)]
+    random_days = START + rng.integers(0, int(years * 365.25), len(extra) + noise).astype("timedelta64[D]")
+    dates = np.r_[np.array(dates, dtype="datetime64[D]"), random_days]
+    amounts = np.r_[np.array(amounts), -np.round(rng.lognormal(3, 1.2, len(extra) + noise), 2)]
+    order = np.argsort(dates, kind="stable")
+    df = pd.DataFrame({
+        "date": dates[order].astype("datetime64[ns]"),
+        "amount": amounts[order].astype(np.float32),
+        "canonical_merchant": pd.Categorical(merchants[order]),
+        "subcategory": pd.Categorical.from_codes(np.zeros(len(order), dtype=np.int8), ["Altro variabile"]),
+    })
+    return df, truth
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--years", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    for n in args.sizes:
+        df, truth = synthetic_history(n, args.years)
+        started = time.perf_counter()
+        recurrences, is_recurring = detect_recurring(df)
+        seconds = time.perf_counter() - started
+        found = set(recurrences["merchant"])
+        hits = found & set(truth)
+        predicted = recurrences.set_index("merchant")["next_date"]
+        tolerance = {p[0]: p[2] for p in PERIODS}
+        on_time = sum(
+            abs((predicted[m] - pd.Timestamp(truth[m])).days)
+            <= tolerance[recurrences.set_index("merchant").at[m, "period"]] + 2
+            for m in hits
+        )
+        print(
+            f"{len(df):>9} righe: {seconds:.3f}s • {len(found)} ricorrenze, "
+            f"precisione {len(hits) / max(1, len(found)):.1%}, "
+            f"richiamo {len(hits) / len(truth):.1%}, "
+            f"prossimo addebito corretto {on_time / max(1, len(hits)):.1%} • "
+            f"{int(is_recurring.sum())} righe ricorrenti"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
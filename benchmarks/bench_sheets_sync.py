@@ -0,0 +1,64 @@
+"""Chiamate API e tempi di ``sync_to_sheet`` su un ``FakeWorksheet`` in memoria.
+
+Per ogni dimensione: prima sincronizzazione su un foglio vuoto, una seconda
+con il 10% di transazioni in più (solo quelle vengono scritte) e una terza
+senza novità. Le chiamate sono riportate anche ogni 10.000 righe, accanto
+a quelle di una scrittura riga per riga.
+
+Uso: ``python benchmarks/bench_sheets_sync.py [--sizes 10000 100000] [--chunk-rows 5000]``
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from history_store import transaction_fingerprints  # noqa: E402
+from sheets_sync import FakeWorksheet, sync_to_sheet  # noqa: E402
+
+
+def synthetic_transactions(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "date": pd.Timestamp("2022-01-01") + pd.to_timedelta(rng.integers(0, 1000, n), unit="D"),
+        "description": pd.Categorical([f"Pagamento POS negozio {i}" for i in rng.integers(0, 5000, n)]),
+        "amount": -np.round(rng.lognormal(3, 1.2, n), 2),
+        "account": "Conto principale",
+        "macro_category": pd.Categorical(["Variabile"] * n),
+        "subcategory": pd.Categorical(["Shopping & extra"] * n),
+        "canonical_merchant": pd.Categorical([f"negozio {i}" for i in rng.integers(0, 5000, n)]),
+    }).sort_values("date", kind="stable", ignore_index=True)
+    df["fingerprint"] = transaction_fingerprints(df)
+    return df
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    for n in args.sizes:
+        df = synthetic_transactions(n + n // 10)
+        sheet = FakeWorksheet()
+        runs = [("foglio vuoto", df.iloc[:n]), ("+10% righe", df), ("nessuna novità", df)]
+        for label, part in runs:
+            stats = {}
+            started = time.perf_counter()
+            sync_to_sheet(part, sheet, chunk_rows=args.chunk_rows, stats=stats)
+            seconds = time.perf_counter() - started
+            print(
+                f"{len(part):>8} righe, {label:<15}: {seconds:.3f}s • {stats['rows']:>7} scritte, "
+                f"{stats['skipped']:>7} già presenti • {stats['calls']} chiamate "
+                f"({stats['calls'] * 10_000 / len(part):.1f} ogni 10k righe; "
+                f"riga per riga sarebbero {stats['rows']})"
+            )
+        assert len(sheet.values) == len(df) + 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Tempo di avvio della pagina iniziale (nessun file caricato), a freddo.
+
+Ogni misura gira in un interprete nuovo, in una cartella vuota (niente cache
+né storico): importa Streamlit ed esegue ``app.py`` con ``AppTest`` fino alla
+fine dello script, cioè fino al primo disegno completo della pagina. Vengono
+riportati anche il tempo di un rerun e quali moduli pesanti risultano
+caricati. Con ``--baseline REV`` la stessa misura gira anche sull'app della
+revisione git indicata, per confrontare prima e dopo.
+
+I risultati vanno in ``benchmarks/results/startup_latest.json``.
+
+Uso: ``python benchmarks/bench_startup.py [--runs 5] [--baseline HEAD~1]``
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+LATEST_PATH = os.path.join(RESULTS_DIR, "startup_latest.json")
+HEAVY_MODULES = ["plotly.express", "huggingface_hub.inference._client"]
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {src!r})
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({app!r}, default_timeout=300).run()
+first = time.perf_counter() - started
+started = time.perf_counter()
+app.run()
+rerun = time.perf_counter() - started
+print(json.dumps({{
+    "first_paint": first,
+    "rerun": rerun,
+    "exceptions": [e.value for e in app.exception],
+    "heavy_modules": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure_once(src: str) -> dict:
+    code = CHILD.format(src=src, app=os.path.join(src, "app.py"), heavy=HEAVY_MODULES)
+    with tempfile.TemporaryDirectory() as cwd:
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=cwd, capture_output=True, text=True, check=True
+        )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(src: str, runs: int) -> dict:
+    samples = [measure_once(src) for _ in range(runs)]
+    first = [s["first_paint"] for s in samples]
+    rerun = [s["rerun"] for s in samples]
+    return {
+        "first_paint_median": round(statistics.median(first), 4),
+        "first_paint_min": round(min(first), 4),
+        "rerun_median": round(statistics.median(rerun), 4),
+        "heavy_modules": samples[-1]["heavy_modules"],
+        "exceptions": samples[-1]["exceptions"],
+    }
+
+
+def export_revision(rev: str, dest: str) -> str:
+    archive = os.path.join(dest, "src.tar")
+    subprocess.run(["git", "-C", REPO_DIR, "archive", "-o", archive, rev], check=True)
+    src = os.path.join(dest, "src")
+    with tarfile.open(archive) as tar:
+        tar.extractall(src)
+    return src
+
+
+def report(label: str, result: dict):
+    print(
+        f"{label:<12} primo disegno {result['first_paint_median']:.3f}s "
+        f"(min {result['first_paint_min']:.3f}s) • rerun {result['rerun_median']:.3f}s • "
+        f"moduli pesanti: {', '.join(result['heavy_modules']) or 'nessuno'}"
+    )
+    for exc in result["exceptions"]:
+        print(f"  eccezione: {exc}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="processi misurati per versione")
+    parser.add_argument("--baseline", help="revisione git da confrontare (es. HEAD~1)")
+    args = parser.parse_args(argv)
+
+    latest = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "runs": args.runs,
+        "results": {},
+    }
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as tmp:
+            latest["results"][args.baseline] = measure(export_revision(args.baseline, tmp), args.runs)
+        report(args.baseline, latest["results"][args.baseline])
+    latest["results"]["working tree"] = measure(REPO_DIR, args.runs)
+    report("working tree", latest["results"]["working tree"])
+    if args.baseline:
+        before = latest["results"][args.baseline]["first_paint_median"]
+        after = latest["results"]["working tree"]["first_paint_median"]
+        print(f"Primo disegno: {before:.3f}s → {after:.3f}s ({before / after:.2f}x)")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(LATEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(latest, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
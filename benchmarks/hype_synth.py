@@ -0,0 +1,138 @@
+"""Generatore di estratti conto sintetici in formato Hype.
+
+Le colonne sono quelle dell'export CSV di Hype (separatore ``;``, importi
+con la virgola decimale e il punto delle migliaia); i merchant vengono dalle
+tabelle di keyword dell'app, più una quota di negozi sconosciuti che finisce
+in 'Altro variabile' e passa dall'AI.
+
+Uso: ``python benchmarks/hype_synth.py righe percorso.csv [seed]``
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pipeline  # noqa: E402
+
+HYPE_COLUMNS = [
+    "Data operazione",
+    "Data contabile",
+    "Iban",
+    "Tipologia",
+    "Nome",
+    "Descrizione",
+    "Importo ( € )",
+]
+HYPE_MAPPING = {
+    "col_date": "Data operazione",
+    "col_desc": "Descrizione",
+    "col_amount": "Importo ( € )",
+    "col_name": "Nome",
+    "col_type": "Tipologia",
+    "col_iban": "Iban",
+}
+IBANS = ["IT60X0542811101000000123456", "IT02L1234512345123456789012"]
+CITIES = ["Milano", "Roma", "Torino", "Bologna", "Napoli", ""]
+UNKNOWN_MERCHANTS = 500
+# Quota di transazioni per gruppo e importo tipico in centesimi (min, max)
+MIX = {
+    "income": (0.05, (2_000, 250_000)),
+    "fixed": (0.10, (1_000, 120_000)),
+    "savings": (0.03, (5_000, 100_000)),
+    "variable": (0.72, (150, 25_000)),
+    "unknown": (0.10, (200, 15_000)),
+}
+TEMPLATES = {
+    "income": ("Bonifico", "Bonifico in entrata da {}"),
+    "fixed": ("Addebito diretto", "Addebito SDD {}"),
+    "savings": ("Bonifico", "Bonifico a favore di {}"),
+    "variable": ("Pagamento", "Pagamento POS {}"),
+    "unknown": ("Pagamento", "Pagamento POS {}"),
+}
+
+
+def merchant_pool(group: str) -> list:
+    # Merchant presi dalle parole delle regole, così il sintetico resta categorizzabile
+    macros = {
+        "income": "Entrata",
+        "fixed": "Fisso",
+        "savings": "Risparmi & investimenti",
+        "variable": "Variabile",
+    }
+    if group == "unknown":
+        return [f"Bottega {i:03d}" for i in range(UNKNOWN_MERCHANTS)]
+    return [
+        w.title()
+        for rule in pipeline.RULES.current().rules
+        if pipeline.SUBCATEGORY_MACRO[rule.subcategory] == macros[group]
+        for w in rule.keywords + rule.words
+    ]
+
+
+def italian_amounts(cents: np.ndarray) -> list:
+    # -123456 -> "-1.234,56"
+    return [
+        f"{'-' if c < 0 else ''}{abs(c) // 100:,}".replace(",", ".") + f",{abs(c) % 100:02d}"
+        for c in cents.tolist()
+    ]
+
+
+def hype_frame(n: int, rng: np.random.Generator, start: str = "2020-01-01", days: int = 5 * 365) -> pd.DataFrame:
+    groups = list(MIX)
+    group_idx = rng.choice(len(groups), size=n, p=[MIX[g][0] for g in groups])
+    names = np.empty(n, dtype=object)
+    descriptions = np.empty(n, dtype=object)
+    kinds = np.empty(n, dtype=object)
+    cents = np.empty(n, dtype=np.int64)
+    for i, group in enumerate(groups):
+        rows = np.flatnonzero(group_idx == i)
+        pool = np.array(merchant_pool(group), dtype=object)
+        picked = pool[rng.integers(0, len(pool), size=len(rows))]
+        city = np.array(CITIES, dtype=object)[rng.integers(0, len(CITIES), size=len(rows))]
+        kind, template = TEMPLATES[group]
+        names[rows] = picked
+        descriptions[rows] = [template.format(f"{m} {c}".strip()) for m, c in zip(picked, city)]
+        kinds[rows] = kind
+        low, high = MIX[group][1]
+        sign = 1 if group == "income" else -1
+        cents[rows] = sign * rng.integers(low, high, size=len(rows))
+    dates = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, days, size=n)), unit="D")
+    day_strings = dates.strftime("%d/%m/%Y")
+    return pd.DataFrame({
+        "Data operazione": day_strings,
+        "Data contabile": day_strings,
+        "Iban": np.array(IBANS, dtype=object)[rng.integers(0, len(IBANS), size=n)],
+        "Tipologia": kinds,
+        "Nome": names,
+        "Descrizione": descriptions,
+        "Importo ( € )": italian_amounts(cents),
+    }, columns=HYPE_COLUMNS)
+
+
+def write_hype_csv(path: str, n: int, seed: int = 0, chunk_rows: int = 250_000) -> str:
+    """Scrive ``n`` transazioni in ``path`` a blocchi, senza tenerle tutte in memoria."""
+    rng = np.random.default_rng(seed)
+    days = 5 * 365
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(";".join(HYPE_COLUMNS) + "\n")
+        for first in range(0, n, chunk_rows):
+            size = min(chunk_rows, n - first)
+            # Ogni blocco copre un tratto successivo del periodo: date crescenti come nell'export
+            offset = days * first // max(n, 1)
+            span = max(1, days * (first + size) // max(n, 1) - offset)
+            start = pd.Timestamp("2020-01-01") + pd.Timedelta(days=offset)
+            hype_frame(size, rng, start=start, days=span).to_csv(f, sep=";", header=False, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def hype_csv_bytes(n: int, seed: int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+    return hype_frame(n, rng).to_csv(sep=";", index=False).encode("utf-8")
+
+
+if __name__ == "__main__":
+    write_hype_csv(sys.argv[2], int(sys.argv[1]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
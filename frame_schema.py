@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Colonne a bassa cardinalità memorizzate come categorie
+CATEGORY_COLUMNS = [
+    "account",
+    "bank_category",
+    "direction",
+    "macro_category",
+    "subcategory",
+    "normalized_merchant",
+    "canonical_merchant",
+]
+TEXT_DTYPE = "string[pyarrow]"
+# Sotto 2**16 € un float32 distingue ancora tutti i centesimi
+FLOAT32_EXACT_LIMIT = 2 ** 16
+
+
+def compact_amounts(amounts: pd.Series) -> pd.Series:
+    """Importi in float32 se la conversione non perde centesimi, altrimenti float64."""
+    amounts = amounts.astype("float64")
+    if amounts.abs().max(skipna=True) < FLOAT32_EXACT_LIMIT:
+        return amounts.astype("float32")
+    return amounts
+
+
+def amounts_float64(amounts: pd.Series) -> pd.Series:
+    """Importi in float64 per somme e confronti, con i centesimi ripristinati."""
+    if amounts.dtype == "float32":
+        return amounts.astype("float64").round(2)
+    return amounts.astype("float64")
+
+
+def as_category(values, categories=()) -> pd.Categorical:
+    known = list(categories)
+    seen = set(known)
+    extra = [v for v in pd.unique(np.asarray(values, dtype=object)) if v not in seen and pd.notna(v)]
+    return pd.Categorical(values, categories=known + extra)
+
+
+def add_categories(series: pd.Series, values) -> pd.Series:
+    # Una colonna categorica accetta solo valori già tra le sue categorie
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    missing = [v for v in pd.unique(np.asarray(values, dtype=object)) if v not in series.cat.categories and pd.notna(v)]
+    return series.cat.add_categories(missing) if missing else series
+
+
+def compact_transactions(df) -> pd.DataFrame:
+    """Converte (in place) le colonne del dataset interno nello schema compatto."""
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = as_category(df[col])
+    if "description" in df.columns and df["description"].dtype != TEXT_DTYPE:
+        df["description"] = df["description"].astype(TEXT_DTYPE)
+    if "amount" in df.columns:
+        df["amount"] = compact_amounts(amounts_float64(df["amount"]))
+    return df
+
+
+def concat_transactions(parts: list) -> pd.DataFrame:
+    """``pd.concat`` che mantiene categorie e float32 anche tra blocchi diversi."""
+    if len(parts) == 1:
+        return parts[0]
+    columns = {}
+    for col in parts[0].columns:
+        series = [p[col] for p in parts]
+        if all(isinstance(s.dtype, pd.CategoricalDtype) for s in series):
+            columns[col] = union_categoricals([s.array for s in series], ignore_order=True)
+        elif col == "amount":
+            columns[col] = compact_amounts(pd.concat([amounts_float64(s) for s in series])).array
+        else:
+            columns[col] = pd.concat(series).array
+    index = parts[0].index.append([p.index for p in parts[1:]])
+    return pd.DataFrame(columns, index=index)
+
+
+def memory_report(df) -> dict:
+    """Occupazione in memoria (deep) totale, per colonna e per transazione."""
+    by_column = df.memory_usage(deep=True, index=False)
+    total = int(by_column.sum())
+    return {
+        "rows": len(df),
+        "bytes": total,
+        "bytes_per_row": total / len(df) if len(df) else 0.0,
+        "by_column": {col: int(v) for col, v in by_column.items()},
+    }
@@ -0,0 +1,161 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from frame_schema import amounts_float64
+
+FINGERPRINT_COLUMNS = ["date", "amount", "description", "account"]
+
+HISTORY_SCHEMA = pa.schema([
+    ("date", pa.timestamp("ns")),
+    ("description", pa.string()),
+    ("amount", pa.float64()),
+    ("account", pa.string()),
+    ("bank_category", pa.string()),
+    ("direction", pa.string()),
+    ("macro_category", pa.string()),
+    ("subcategory", pa.string()),
+    ("normalized_merchant", pa.string()),
+    ("canonical_merchant", pa.string()),
+    ("fingerprint", pa.uint64()),
+])
+
+
+class SeenCounts:
+    """Occorrenze delle impronte di base già viste nei blocchi precedenti.
+
+    Chiavi e conteggi stanno in due array ordinati: la ricerca di un blocco
+    costa ``O(blocco · log visti)``, senza ricostruire strutture grandi quanto
+    tutto il file a ogni blocco.
+    """
+
+    def __init__(self):
+        self.keys = np.array([], dtype=np.uint64)
+        self.counts = np.array([], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def update(self, base: np.ndarray) -> np.ndarray:
+        """Restituisce per ogni valore di ``base`` le occorrenze precedenti, poi le aggiunge."""
+        uniques, inverse, counts = np.unique(base, return_inverse=True, return_counts=True)
+        pos = np.searchsorted(self.keys, uniques)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == uniques[found]
+        prior = np.zeros(len(uniques), dtype=np.int64)
+        prior[found] = self.counts[pos[found]]
+        self.counts[pos[found]] += counts[found]
+        new = ~found
+        self.keys = np.insert(self.keys, pos[new], uniques[new])
+        self.counts = np.insert(self.counts, pos[new], counts[new])
+        return prior[inverse]
+
+
+def transaction_fingerprints(df, seen_counts: SeenCounts = None) -> pd.Series:
+    """Impronta uint64 di ogni transazione su (data, importo, descrizione, conto).
+
+    Le righe identiche nello stesso file (es. due caffè uguali nello stesso
+    giorno) ricevono impronte diverse grazie al numero di occorrenza. Passando
+    lo stesso ``seen_counts`` a blocchi successivi il conteggio prosegue tra
+    un blocco e l'altro, come se il file fosse letto tutto insieme.
+    """
+    key = pd.DataFrame({
+        "date": df["date"],
+        "amount": amounts_float64(df["amount"]).round(2),
+        "description": df["description"].astype(str).str.strip(),
+        "account": df["account"].astype(str),
+    })
+    base = pd.util.hash_pandas_object(key, index=False)
+    occurrence = base.groupby(base, sort=False).cumcount()
+    if seen_counts is not None:
+        occurrence = occurrence + seen_counts.update(base.to_numpy())
+    return pd.util.hash_pandas_object(
+        pd.DataFrame({"base": base, "occurrence": occurrence}), index=False
+    ).rename("fingerprint")
+
+
+class TransactionStore:
+    """Storico locale delle transazioni categorizzate, in file Parquet.
+
+    Ogni ``append`` scrive un nuovo file nella cartella; le letture passano da
+    ``pyarrow.dataset`` e caricano solo le colonne (e le date) richieste.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _parts(self) -> list:
+        return sorted(f for f in os.listdir(self.root) if f.endswith(".parquet"))
+
+    def _dataset(self):
+        parts = [os.path.join(self.root, f) for f in self._parts()]
+        return ds.dataset(parts, schema=HISTORY_SCHEMA, format="parquet") if parts else None
+
+    def version(self) -> str:
+        # Cambia a ogni append: utile come chiave di cache
+        parts = self._parts()
+        return f"{len(parts)}:{parts[-1] if parts else ''}"
+
+    def __len__(self) -> int:
+        dataset = self._dataset()
+        return dataset.count_rows() if dataset else 0
+
+    def fingerprints(self) -> np.ndarray:
+        dataset = self._dataset()
+        if dataset is None:
+            return np.array([], dtype=np.uint64)
+        return dataset.to_table(columns=["fingerprint"]).column("fingerprint").to_numpy()
+
+    def append(self, df) -> int:
+        if len(df) == 0:
+            return 0
+        columns = [f.name for f in HISTORY_SCHEMA]
+        df = df[columns].assign(amount=amounts_float64(df["amount"]))
+        table = pa.Table.from_pandas(df, schema=HISTORY_SCHEMA, preserve_index=False)
+        name = f"part-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        tmp_path = os.path.join(self.root, f".{name}.tmp")
+        pq.write_table(table, tmp_path)
+        # Rename atomico: un lettore non vede mai un file scritto a metà
+        os.replace(tmp_path, os.path.join(self.root, name))
+        return len(df)
+
+    def append_new(self, df) -> int:
+        """Come ``append``, ma scarta le righe la cui impronta è già nello storico.
+
+        Serve quando più sessioni importano lo stesso file: ognuna ha
+        confrontato le impronte prima che l'altra salvasse.
+        """
+        with self._lock:
+            known = pd.Index(self.fingerprints())
+            if len(known) and len(df):
+                df = df[known.get_indexer(df["fingerprint"]) < 0]
+            return self.append(df)
+
+    def load(self, columns=None, start=None, end=None) -> pd.DataFrame:
+        dataset = self._dataset()
+        if dataset is None:
+            return HISTORY_SCHEMA.empty_table().select(columns or HISTORY_SCHEMA.names).to_pandas()
+        condition = None
+        if start is not None:
+            condition = ds.field("date") >= pd.Timestamp(start)
+        if end is not None:
+            upper = ds.field("date") <= pd.Timestamp(end)
+            condition = upper if condition is None else condition & upper
+        df = dataset.to_table(columns=columns, filter=condition).to_pandas()
+        if "date" in df.columns:
+            df = df.sort_values("date", kind="stable", ignore_index=True)
+        return df
+
+    def clear(self) -> None:
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+def rss_bytes():
+    """Memoria residente del processo in byte (``None`` fuori da Linux)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+_END = object()
+
+
+class StageProfiler:
+    """Tempi, righe e variazione di memoria di ogni fase del flusso principale.
+
+    Le fasi con lo stesso nome si sommano (es. ``load_csv`` su tutti i blocchi
+    del file), contando le chiamate. Le chiamate AI fatte da ``wrap_client``
+    finiscono in ``ai_calls`` con latenza e dimensioni di prompt e risposta.
+    È thread-safe: i batch AI concorrenti scrivono sullo stesso profiler.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {}
+        self.ai_calls = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, rows: int = None):
+        """Misura il blocco ``with``; le righe si possono passare o scrivere in ``record["rows"]``."""
+        record = {"rows": rows}
+        rss_start = rss_bytes()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self._finish(name, started, rss_start, record["rows"])
+
+    def iterate(self, name: str, iterable):
+        """Itera ``iterable`` attribuendo alla fase ``name`` il tempo di ogni ``next``."""
+        iterator = iter(iterable)
+        while True:
+            rss_start = rss_bytes()
+            started = time.perf_counter()
+            item = next(iterator, _END)
+            if item is _END:
+                return
+            self._finish(name, started, rss_start, len(item) if hasattr(item, "__len__") else None)
+            yield item
+
+    def _finish(self, name, started, rss_start, rows):
+        seconds = time.perf_counter() - started
+        rss_end = rss_bytes()
+        delta = rss_end - rss_start if rss_start is not None and rss_end is not None else None
+        self._add(name, seconds, rows, delta)
+
+    def _add(self, name, seconds, rows, memory_delta):
+        with self._lock:
+            stage = self.stages.setdefault(
+                name, {"seconds": 0.0, "calls": 0, "rows": None, "memory_delta_mb": None}
+            )
+            stage["seconds"] += seconds
+            stage["calls"] += 1
+            if rows is not None:
+                stage["rows"] = (stage["rows"] or 0) + int(rows)
+            if memory_delta is not None:
+                stage["memory_delta_mb"] = (stage["memory_delta_mb"] or 0.0) + memory_delta / 2**20
+
+    def record_ai_call(self, seconds: float, prompt_chars: int, response_chars: int, stream=False, error=None):
+        with self._lock:
+            self.ai_calls.append({
+                "seconds": round(seconds, 4),
+                "prompt_chars": prompt_chars,
+                "response_chars": response_chars,
+                "stream": stream,
+                "error": None if error is None else repr(error),
+            })
+
+    def wrap_client(self, client):
+        return None if client is None else ProfiledClient(client, self)
+
+    def merge(self, other):
+        """Somma a queste le fasi e le chiamate AI di ``other`` (es. misurate in un altro thread)."""
+        if not other.enabled:
+            return
+        with other._lock:
+            stages = {name: dict(stage) for name, stage in other.stages.items()}
+            calls = list(other.ai_calls)
+        for name, stage in stages.items():
+            with self._lock:
+                mine = self.stages.setdefault(
+                    name, {"seconds": 0.0, "calls": 0, "rows": None, "memory_delta_mb": None}
+                )
+                mine["seconds"] += stage["seconds"]
+                mine["calls"] += stage["calls"]
+                if stage["rows"] is not None:
+                    mine["rows"] = (mine["rows"] or 0) + stage["rows"]
+                if stage["memory_delta_mb"] is not None:
+                    mine["memory_delta_mb"] = (mine["memory_delta_mb"] or 0.0) + stage["memory_delta_mb"]
+        with self._lock:
+            self.ai_calls.extend(calls)
+
+    def rows(self) -> list:
+        """Una riga per fase, in ordine di prima esecuzione, pronta per un dataframe."""
+        with self._lock:
+            return [
+                {
+                    "stage": name,
+                    "seconds": round(stage["seconds"], 4),
+                    "calls": stage["calls"],
+                    "rows": stage["rows"],
+                    "memory_delta_mb": (
+                        None if stage["memory_delta_mb"] is None else round(stage["memory_delta_mb"], 1)
+                    ),
+                }
+                for name, stage in self.stages.items()
+            ]
+
+    def ai_summary(self) -> dict:
+        with self._lock:
+            calls = list(self.ai_calls)
+        latencies = sorted(c["seconds"] for c in calls)
+        return {
+            "requests": len(calls),
+            "errors": sum(c["error"] is not None for c in calls),
+            "seconds_total": round(sum(latencies), 4),
+            "seconds_max": latencies[-1] if latencies else 0.0,
+            "seconds_median": latencies[len(latencies) // 2] if latencies else 0.0,
+            "prompt_chars": sum(c["prompt_chars"] for c in calls),
+            "response_chars": sum(c["response_chars"] for c in calls),
+        }
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            calls = list(self.ai_calls)
+        return {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "stages": self.rows(),
+            "ai": self.ai_summary(),
+            "ai_calls": calls,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, ensure_ascii=False)
+
+
+class _NullProfiler:
+    """Profiler spento: ogni metodo restituisce subito, senza misurare nulla."""
+
+    enabled = False
+    _CONTEXT = nullcontext({})
+
+    def stage(self, name: str, rows: int = None):
+        return self._CONTEXT
+
+    def iterate(self, name: str, iterable):
+        return iterable
+
+    def record_ai_call(self, *args, **kwargs):
+        pass
+
+    def wrap_client(self, client):
+        return client
+
+    def merge(self, other):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
+
+
+class ProfiledClient:
+    """Inoltra ``chat_completion`` al client registrando ogni richiesta nel profiler.
+
+    Con ``stream=True`` la richiesta si chiude quando il generatore è esaurito.
+    """
+
+    def __init__(self, client, profiler: StageProfiler):
+        self._client = client
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def chat_completion(self, messages, stream=False, **kwargs):
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        started = time.perf_counter()
+        try:
+            response = self._client.chat_completion(messages=messages, stream=stream, **kwargs)
+        except Exception as e:
+            self._profiler.record_ai_call(time.perf_counter() - started, prompt_chars, 0, stream, e)
+            raise
+        if stream:
+            return self._stream(response, prompt_chars, started)
+        content = response.choices[0].message.content or ""
+        self._profiler.record_ai_call(time.perf_counter() - started, prompt_chars, len(content))
+        return response
+
+    def _stream(self, chunks, prompt_chars, started):
+        received = 0
+        error = None
+        try:
+            for chunk in chunks:
+                received += len(chunk.choices[0].delta.content or "")
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._profiler.record_ai_call(time.perf_counter() - started, prompt_chars, received, True, error)
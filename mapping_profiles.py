@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def _normalize_header(column) -> str:
+    return " ".join(str(column).split()).lower()
+
+
+def header_signature(columns) -> str:
+    """Impronta delle intestazioni del CSV: stesse colonne nello stesso ordine.
+
+    Maiuscole e spazi ripetuti non contano, così piccole differenze tra un
+    export e l'altro della stessa banca non cambiano la firma.
+    """
+    normalized = "\x1f".join(_normalize_header(c) for c in columns)
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+class MappingProfiles:
+    """Mappature colonne salvate, una per formato di estratto conto.
+
+    Ogni profilo è indicizzato dalla firma delle intestazioni del CSV e
+    contiene un nome (di solito la banca), gli argomenti colonna di
+    ``build_internal_df`` e il conto da assegnare quando il file non ha una
+    colonna IBAN. Il registro è un file JSON riscritto per intero a ogni
+    modifica, con sostituzione atomica.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._profiles = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._profiles = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def get(self, columns):
+        """Profilo per le intestazioni ``columns``, o ``None`` se il formato è nuovo.
+
+        La mappatura restituita usa i nomi di colonna di ``columns``, anche se
+        differiscono per maiuscole o spazi da quelli del file salvato.
+        """
+        with self._lock:
+            profile = self._profiles.get(header_signature(columns))
+        if profile is None:
+            return None
+        actual = {_normalize_header(c): c for c in columns}
+        mapping = {
+            key: None if value is None else actual.get(_normalize_header(value), value)
+            for key, value in profile["mapping"].items()
+        }
+        return {**profile, "mapping": mapping}
+
+    def profiles(self) -> list:
+        with self._lock:
+            return sorted(self._profiles.values(), key=lambda p: p["name"].lower())
+
+    def save(self, columns, mapping: dict, name: str, account: str = None) -> dict:
+        """Salva (o sostituisce) il profilo delle intestazioni ``columns``."""
+        signature = header_signature(columns)
+        profile = {
+            "signature": signature,
+            "name": name,
+            "columns": [str(c) for c in columns],
+            "mapping": dict(mapping),
+            "account": account or None,
+            "updated_at": time.time(),
+        }
+        with self._lock:
+            self._profiles[signature] = profile
+            self._write()
+        return dict(profile)
+
+    def remove(self, signature: str) -> None:
+        with self._lock:
+            if self._profiles.pop(signature, None) is not None:
+                self._write()
+
+    def _write(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._profiles, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,98 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def cache_version(subcategories, model: str = "") -> str:
+    """Impronta dell'elenco sottocategorie (e del modello) usata come versione.
+
+    Se cambia la tassonomia, le voci salvate con la versione precedente non
+    vengono più restituite.
+    """
+    payload = "\n".join([model, *subcategories]).encode("utf-8")
+    return hashlib.sha1(payload).hexdigest()[:16]
+
+
+class MerchantCategoryCache:
+    """Cache persistente merchant normalizzato → sottocategoria assegnata dall'AI.
+
+    È un file SQLite con limite di voci (eviction LRU sull'ultimo utilizzo),
+    TTL opzionale in secondi e versione legata alla tassonomia: le voci di
+    un'altra versione vengono eliminate all'apertura.
+    """
+
+    def __init__(self, path: str, version: str, max_entries: int = 50_000, ttl: float = None):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS merchant_category (
+                    merchant TEXT PRIMARY KEY,
+                    subcategory TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_merchant_last_used ON merchant_category (last_used)"
+            )
+            self._conn.execute("DELETE FROM merchant_category WHERE version != ?", (version,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM merchant_category").fetchone()[0]
+
+    def get_many(self, merchants) -> dict:
+        """Restituisce ``{merchant: sottocategoria}`` per i soli merchant presenti."""
+        keys = list(dict.fromkeys(m for m in merchants if m))
+        if not keys:
+            return {}
+        now = time.time()
+        min_created = now - self.ttl if self.ttl else float("-inf")
+        found = {}
+        with self._lock, self._conn:
+            # SQLite limita il numero di parametri per query
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT merchant, subcategory FROM merchant_category "
+                    f"WHERE version = ? AND created_at >= ? AND merchant IN ({placeholders})",
+                    [self.version, min_created, *batch],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._conn.executemany(
+                    "UPDATE merchant_category SET last_used = ? WHERE merchant = ?",
+                    [(now, m) for m in found],
+                )
+        return found
+
+    def put_many(self, items: dict) -> None:
+        if not items:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO merchant_category "
+                "(merchant, subcategory, version, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(m, sub, self.version, now, now) for m, sub in items.items() if m],
+            )
+            self._conn.execute(
+                "DELETE FROM merchant_category WHERE merchant IN ("
+                "SELECT merchant FROM merchant_category ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM merchant_category")
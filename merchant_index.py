@@ -0,0 +1,180 @@
+import math
+import threading
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+# Città che compaiono in coda ai nomi dei negozi. Niente sigle di due lettere
+# né nomi ambigui ("mi", "to", "como"): sono anche parole dei nomi
+CITY_TOKENS = [
+    "milano", "roma", "torino", "napoli", "bologna", "firenze", "genova", "venezia",
+    "verona", "padova", "bari", "palermo", "catania", "brescia", "bergamo", "monza",
+    "varese", "trento", "trieste", "parma", "modena", "pisa", "rimini", "italia", "italy",
+]
+# Parole che da sole non identificano un negozio: se dopo la pulizia resta
+# solo questo, città e numeri tolti erano il nome ("bar roma", "bottega 001")
+GENERIC_TOKENS = {
+    "bar", "caffe", "caffè", "hotel", "albergo", "pizzeria", "ristorante", "trattoria",
+    "osteria", "farmacia", "bottega", "negozio", "market", "minimarket", "supermercato",
+    "tabacchi", "edicola", "panetteria", "forno", "macelleria", "parrucchiere", "casa",
+    "shop", "store", "atm", "bancomat", "da", "di", "del", "della", "la", "il", "lo", "e",
+}
+# Variazioni da refuso: una sola modifica, in parole abbastanza lunghe da non
+# confondere nomi diversi ("marco" / "mario")
+TYPO_MIN_LENGTH = 6
+LEGAL_SUFFIX_RE = (
+    r"\b(s ?p ?a|s ?r ?l ?s?|s ?n ?c|s ?a ?s|sarl|s ?a ?r ?l|ltd|limited|inc|gmbh|llc|bv|plc)\b"
+)
+# Indirizzi: da "via ..." in poi non è più il nome del negozio
+ADDRESS_RE = r"\b(via|viale|v le|piazza|piazzale|p zza|corso|c so|largo|strada|loc|localita)\b.*$"
+# Diciture dell'operazione bancaria che precedono il nome della controparte
+OPERATION_RE = (
+    r"\b(bonifico( istantaneo)?( in entrata| in uscita)?( da| a favore di| a)?"
+    r"|addebito( sdd| diretto)?|disposizione|ricarica|prelievo)\b"
+)
+STORE_TOKEN_RE = r"\b(n|nr|num|pv|punto vendita|filiale|negozio n)\b"
+DOMAIN_RE = r"\b(www)\b|\b(it|com|eu|net|org|de|fr|es|co uk)\b$"
+
+
+def canonicalize_merchants(merchants) -> pd.Series:
+    """Chiave canonica dei merchant normalizzati, calcolata una volta per valore distinto.
+
+    Toglie punteggiatura, indirizzi, forme societarie, diciture bancarie e
+    parole ripetute (nome e descrizione uniti spesso ripetono il merchant),
+    poi numeri di negozio e città in coda: "esselunga 123 milano",
+    "esselunga s.p.a." ed "esselunga via roma 5" diventano tutti
+    "esselunga". Numeri e città restano se senza di loro rimarrebbero solo
+    parole generiche (``GENERIC_TOKENS``): "bar roma" e "bar italia",
+    "bottega 001" e "bottega 002" restano distinti. Se non resta nulla la
+    chiave è il merchant di partenza.
+    """
+    merchants = pd.Series(merchants, dtype=object)
+    codes, uniques = pd.factorize(merchants.fillna("").astype(str), use_na_sentinel=False)
+    original = pd.Series(uniques, dtype=object)
+    text = original.str.lower().str.replace(r"[^\w&]+", " ", regex=True)
+    text = text.str.replace(ADDRESS_RE, " ", regex=True)
+    text = text.str.replace(OPERATION_RE, " ", regex=True)
+    text = text.str.replace(LEGAL_SUFFIX_RE, " ", regex=True)
+    text = text.str.replace(STORE_TOKEN_RE, " ", regex=True)
+    text = text.str.split().map(lambda words: " ".join(dict.fromkeys(words)))
+    text = text.str.replace(DOMAIN_RE, " ", regex=True).str.strip()
+    short = text.str.replace(r"\b\d+\b", " ", regex=True)
+    short = short.str.replace(r"(\s+\b(" + "|".join(CITY_TOKENS) + r")\b)+\s*$", " ", regex=True)
+    short = short.str.split()
+    distinctive = short.map(lambda words: any(w not in GENERIC_TOKENS for w in words))
+    text = text.where(~distinctive, short.str.join(" "))
+    keys = text.where(text.str.len() > 0, original.str.strip()).to_numpy(dtype=object)
+    return pd.Series(keys[codes], index=merchants.index)
+
+
+def _one_typo(a: str, b: str) -> bool:
+    # Stesse parole tranne una, lunga, con una sola lettera cambiata, aggiunta,
+    # tolta o scambiata con la vicina; numeri sempre identici
+    words_a, words_b = a.split(), b.split()
+    if len(words_a) != len(words_b):
+        return False
+    diff = [(x, y) for x, y in zip(words_a, words_b) if x != y]
+    if len(diff) != 1:
+        return False
+    x, y = diff[0]
+    if min(len(x), len(y)) < TYPO_MIN_LENGTH or not (x.isalpha() and y.isalpha()):
+        return False
+    if len(x) > len(y):
+        x, y = y, x
+    if len(y) - len(x) > 1:
+        return False
+    i = 0
+    while i < len(x) and x[i] == y[i]:
+        i += 1
+    if len(x) < len(y):
+        return x[i:] == y[i + 1:]
+    return x[i + 1:] == y[i + 1:] or (x[i + 2:] == y[i + 2:] and x[i:i + 2] == y[i:i + 2][::-1])
+
+
+def trigrams(key: str) -> frozenset:
+    padded = f"  {key} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class MerchantIndex:
+    """Indice dei merchant canonici con ricerca approssimata per trigrammi.
+
+    Ogni chiave prodotta da ``canonicalize_merchants`` viene risolta nel nome
+    canonico del gruppo a cui appartiene: la prima chiave vista di un gruppo
+    ne diventa il nome, le successive con similarità di Jaccard dei trigrammi
+    almeno ``threshold`` vi confluiscono solo se differiscono per un refuso
+    (es. "eselunga" → "esselunga", non "pizzeria da marco" → "pizzeria da
+    mario" né "bottega 001" → "bottega 002"). La
+    ricerca usa il prefix filtering: bastano le liste dei trigrammi più rari
+    della chiave, quindi il costo non cresce con il numero di merchant noti.
+    ``names`` sono nomi canonici già assegnati (es. dallo storico): entrano
+    così come sono, senza confrontarli tra loro.
+    """
+
+    def __init__(self, threshold: float = 0.7, names=()):
+        self.threshold = threshold
+        self._resolved = {}
+        self._names = []
+        self._grams = []
+        self._postings = defaultdict(list)
+        self._lock = threading.Lock()
+        for name in dict.fromkeys(names):
+            self._add(name, trigrams(name))
+
+    def __len__(self) -> int:
+        # Gruppi canonici distinti
+        return len(self._names)
+
+    def _nearest(self, key: str):
+        grams = trigrams(key)
+        size = len(grams)
+        # Jaccard >= t richiede almeno ceil(t·|q|) trigrammi in comune: tra
+        # |q| - ceil(t·|q|) + 1 trigrammi qualsiasi della chiave almeno uno è condiviso
+        prefix = size - math.ceil(self.threshold * size) + 1
+        rarest = sorted(grams, key=lambda g: len(self._postings.get(g, ())))[:prefix]
+        candidates = {c for g in rarest for c in self._postings.get(g, ())}
+        best, best_score = None, self.threshold
+        for candidate in candidates:
+            other = self._grams[candidate]
+            if not self.threshold * size <= len(other) <= size / self.threshold:
+                continue
+            common = len(grams & other)
+            score = common / (size + len(other) - common)
+            if score >= best_score and _one_typo(key, self._names[candidate]):
+                best, best_score = candidate, score
+        return best, grams
+
+    def lookup(self, key: str):
+        """Nome canonico di ``key`` senza aggiungerla all'indice (``None`` se nuova)."""
+        with self._lock:
+            if key in self._resolved:
+                return self._resolved[key]
+            best, _ = self._nearest(key)
+            return None if best is None else self._names[best]
+
+    def resolve(self, key: str) -> str:
+        """Nome canonico di ``key``; se non somiglia a nessun gruppo ne apre uno nuovo."""
+        with self._lock:
+            if key in self._resolved:
+                return self._resolved[key]
+            best, grams = self._nearest(key)
+            return self._add(key, grams) if best is None else self._alias(key, best)
+
+    def _add(self, key: str, grams: frozenset) -> str:
+        group = len(self._names)
+        self._names.append(key)
+        self._grams.append(grams)
+        for gram in grams:
+            self._postings[gram].append(group)
+        return self._alias(key, group)
+
+    def _alias(self, key: str, group: int) -> str:
+        name = self._names[group]
+        self._resolved[key] = name
+        return name
+
+    def resolve_many(self, keys) -> np.ndarray:
+        codes, uniques = pd.factorize(pd.Series(keys, dtype=object), use_na_sentinel=False)
+        names = np.array([self.resolve(str(k)) for k in uniques], dtype=object)
+        return names[codes]
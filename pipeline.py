@@ -0,0 +1,671 @@
+import codecs
+import csv
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from ai_batch import categorize_in_batches
+from frame_schema import (
+    TEXT_DTYPE,
+    add_categories,
+    as_category,
+    compact_amounts,
+    concat_transactions,
+)
+from history_store import SeenCounts, transaction_fingerprints
+from instrumentation import NULL_PROFILER
+from merchant_cache import cache_version
+from merchant_index import MerchantIndex, canonicalize_merchants
+from rollups import budget_aggregates
+from rules import RuleBook
+
+CSV_SNIFF_BYTES = 64 * 1024
+CSV_CHUNK_ROWS = 50_000
+CSV_DELIMITERS = [";", ",", "\t", "|"]
+CSV_ENCODINGS = ["utf-8-sig", "cp1252", "latin-1"]
+
+def sniff_csv(file, sample_bytes=CSV_SNIFF_BYTES) -> dict:
+    """Rileva encoding e separatore leggendo solo i primi KB del file.
+
+    Restituisce i kwargs da passare a ``pd.read_csv`` (``sep``, ``encoding``).
+    Come in passato il ``;`` ha la precedenza sulla ``,``.
+    """
+    file.seek(0)
+    sample = file.read(sample_bytes)
+    file.seek(0)
+    if isinstance(sample, str):
+        text, encoding = sample, None
+    else:
+        for encoding in CSV_ENCODINGS:
+            try:
+                # Decoder incrementale: un carattere troncato a fine campione non è un errore
+                text = codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+                break
+            except UnicodeDecodeError:
+                continue
+    lines = text.splitlines()
+    header = lines[0] if lines else ""
+    sep = ","
+    for candidate in CSV_DELIMITERS:
+        if len(next(csv.reader([header], delimiter=candidate), [])) > 1:
+            sep = candidate
+            break
+    return {"sep": sep, "encoding": encoding}
+
+def read_csv_preview(file, csv_format, nrows=20):
+    # Legge solo le prime righe, non tutto il file
+    file.seek(0)
+    return pd.read_csv(file, nrows=nrows, dtype=str, **csv_format)
+
+def iter_csv_chunks(file, csv_format, chunksize=CSV_CHUNK_ROWS):
+    file.seek(0)
+    with pd.read_csv(file, chunksize=chunksize, dtype=str, **csv_format) as reader:
+        yield from reader
+
+def load_csv(file):
+    csv_format = sniff_csv(file)
+    return pd.read_csv(file, dtype=str, **csv_format)
+
+# Tassonomia: sottocategorie per macro-categoria. Le keyword che le assegnano
+# sono nel file delle regole (``RULES_PATH``), modificabile a server avviato.
+SUBCATEGORIES = {
+    "Fisso": ["Affitto / mutuo", "Utenze casa", "Abbonamenti ricorrenti", "Rate & debiti"],
+    "Variabile": [
+        "Cene & aperitivi", "Spesa supermercato", "Trasporti & mobilità", "Sport & benessere",
+        "Salute", "Tabacco & vizi", "Shopping & extra", "Cultura & formazione",
+        "Casa & arredo", "Animali", "Viaggi", "Regali",
+    ],
+    "Risparmi & investimenti": [
+        "Risparmio conto / deposito", "Investimenti azioni/ETF", "Crypto & speculativi",
+        "Altri investimenti",
+    ],
+    "Entrata": ["Stipendio & lavoro", "Rimborsi & rientri", "Entrate passive"],
+}
+
+ALL_SUBCATEGORIES = [sub for subs in SUBCATEGORIES.values() for sub in subs]
+
+MACRO_CATEGORIES = ["Entrata", "Fisso", "Variabile", "Risparmi & investimenti"]
+
+SUBCATEGORY_MACRO = {sub: macro for macro, subs in SUBCATEGORIES.items() for sub in subs}
+DEFAULT_INCOME = ("Entrata", "Entrate varie")
+DEFAULT_EXPENSE = ("Variabile", "Altro variabile")
+
+AI_MODEL = "mistralai/Mistral-7B-Instruct-v0.2"
+AI_BATCH_SIZE = int(os.environ.get("FINANZE_AI_BATCH_SIZE", "40"))
+AI_MAX_CONCURRENCY = int(os.environ.get("FINANZE_AI_MAX_CONCURRENCY", "4"))
+AI_REQUESTS_PER_SECOND = float(os.environ.get("FINANZE_AI_REQUESTS_PER_SECOND", "2"))
+AI_MAX_RETRIES = int(os.environ.get("FINANZE_AI_MAX_RETRIES", "3"))
+AI_JOB_WORKERS = int(os.environ.get("FINANZE_AI_JOB_WORKERS", "2"))
+# Con una latenza in secondi l'app usa FakeInferenceClient al posto di Hugging Face
+AI_FAKE_LATENCY = os.environ.get("FINANZE_FAKE_AI_LATENCY")
+AI_CACHE_PATH = os.environ.get(
+    "FINANZE_AI_CACHE_PATH", os.path.join(".cache", "merchant_categories.sqlite")
+)
+AI_CACHE_MAX_ENTRIES = int(os.environ.get("FINANZE_AI_CACHE_MAX_ENTRIES", "50000"))
+# Le voci sono per merchant normalizzato: le vecchie, per merchant canonico, scadono
+AI_CACHE_VERSION = cache_version(ALL_SUBCATEGORIES, f"{AI_MODEL}|normalized_merchant")
+LOCAL_MODEL_PATH = os.environ.get(
+    "FINANZE_LOCAL_MODEL_PATH", os.path.join(".cache", "local_classifier.npz")
+)
+# Sotto questa probabilità il merchant passa comunque dall'AI
+LOCAL_MIN_CONFIDENCE = float(os.environ.get("FINANZE_LOCAL_MIN_CONFIDENCE", "0.8"))
+
+HISTORY_PATH = os.environ.get("FINANZE_HISTORY_PATH", os.path.join(".data", "history"))
+MAPPING_PROFILES_PATH = os.environ.get(
+    "FINANZE_MAPPING_PROFILES_PATH", os.path.join(".data", "mapping_profiles.json")
+)
+UPLOAD_MAX_WORKERS = int(os.environ.get("FINANZE_UPLOAD_MAX_WORKERS", "4"))
+DEFAULT_ACCOUNT = "Conto principale"
+RULES_PATH = os.environ.get(
+    "FINANZE_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+)
+# Regole compilate alla prima categorizzazione e ricaricate quando il file cambia
+RULES = RuleBook(RULES_PATH, SUBCATEGORY_MACRO)
+SHEETS_WORKSHEET = os.environ.get("FINANZE_SHEETS_WORKSHEET", "Transazioni")
+SHEETS_CHUNK_ROWS = int(os.environ.get("FINANZE_SHEETS_CHUNK_ROWS", "5000"))
+# Google Sheets: 60 scritture al minuto per utente
+SHEETS_REQUESTS_PER_SECOND = float(os.environ.get("FINANZE_SHEETS_REQUESTS_PER_SECOND", "1"))
+# Foglio in memoria al posto di Google Sheets, per le prove locali
+SHEETS_FAKE = os.environ.get("FINANZE_FAKE_SHEETS")
+DASHBOARD_COLUMNS = [
+    "date",
+    "description",
+    "amount",
+    "account",
+    "bank_category",
+    "direction",
+    "macro_category",
+    "subcategory",
+    "normalized_merchant",
+    "canonical_merchant",
+]
+
+def normalize_text(s: str) -> str:
+    if not isinstance(s, str):
+        s = str(s)
+    return s.lower()
+
+def normalize_merchant(desc: str) -> str:
+    txt = normalize_text(desc)
+    remove_tokens = [
+        "pagamento pos", "pagamento carta", "acquisto carta",
+        "operazione pos", "contactless", "e-commerce", "ecommerce", "pagamento"
+    ]
+    for t in remove_tokens:
+        txt = txt.replace(t, " ")
+    return " ".join(txt.split())
+
+def ai_batch_categorize(transactions: list, client, on_batch_done=None, errors=None) -> dict:
+    """Categorizza con l'AI, in batch, le transazioni ``{"description", "amount"}``.
+
+    Se passato, ``errors`` riceve ``(indice_iniziale, eccezione)`` dei batch falliti.
+    """
+    if client is None or len(transactions) == 0:
+        return {}
+    categorization, failed = categorize_in_batches(
+        transactions,
+        client,
+        ALL_SUBCATEGORIES,
+        AI_MODEL,
+        batch_size=AI_BATCH_SIZE,
+        max_workers=AI_MAX_CONCURRENCY,
+        requests_per_second=AI_REQUESTS_PER_SECOND,
+        max_retries=AI_MAX_RETRIES,
+        on_batch_done=on_batch_done,
+    )
+    if errors is not None:
+        errors.extend(failed)
+    return categorization
+
+def unique_map(values: pd.Series, func) -> pd.Series:
+    # Applica func una sola volta per valore distinto
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    mapped = np.array([func(u) for u in uniques], dtype=object)
+    return pd.Series(mapped[codes], index=values.index)
+
+def canonical_merchants(normalized, merchant_index=None) -> pd.Categorical:
+    """Merchant canonico di ogni riga: chiave di ``canonicalize_merchants`` risolta nell'indice."""
+    if merchant_index is None:
+        merchant_index = MerchantIndex()
+    return as_category(merchant_index.resolve_many(canonicalize_merchants(normalized)))
+
+def categorize_df(df, merchant_index=None, rules=None):
+    """Merchant e categorie di regole per tutto il dataframe.
+
+    Le categorie vengono dalle regole correnti di ``RULES`` (o da ``rules``,
+    un ``RuleSet``), le righe senza regola restano in 'Entrate varie' o
+    'Altro variabile'. Aggiunge anche ``canonical_merchant``, risolto in
+    ``merchant_index`` se passato (altrimenti in un indice nuovo).
+    """
+    df = df.copy()
+    desc = df["description"]
+    df["normalized_merchant"] = as_category(unique_map(desc, normalize_merchant))
+    df["canonical_merchant"] = canonical_merchants(df["normalized_merchant"], merchant_index)
+
+    if rules is None:
+        rules = RULES.current()
+    macro, sub, _ = rules.categorize(
+        desc,
+        df["amount"],
+        df["account"] if "account" in df.columns else None,
+        default_income=DEFAULT_INCOME,
+        default_expense=DEFAULT_EXPENSE,
+    )
+    df["macro_category"] = as_category(macro, MACRO_CATEGORIES)
+    df["subcategory"] = as_category(sub, ALL_SUBCATEGORIES + [DEFAULT_INCOME[1], DEFAULT_EXPENSE[1]])
+    return df
+
+def apply_subcategories(df, subcategories: pd.Series):
+    """Scrive in ``df`` le sottocategorie indicizzate come le sue righe.
+
+    La macro-categoria viene aggiornata solo per i nomi presenti nelle tabelle.
+    """
+    subcategories = subcategories.astype(object)
+    df["subcategory"] = add_categories(df["subcategory"], subcategories)
+    df.loc[subcategories.index, "subcategory"] = subcategories
+    macro = subcategories.map(SUBCATEGORY_MACRO).dropna()
+    df["macro_category"] = add_categories(df["macro_category"], macro)
+    df.loc[macro.index, "macro_category"] = macro
+
+RECURRING_SUBCATEGORY = "Abbonamenti ricorrenti"
+
+def promote_recurring(df, is_recurring):
+    """Copia di ``df`` con le righe ricorrenti ancora in 'Variabile' spostate in 'Fisso'.
+
+    ``is_recurring`` è la maschera per posizione di ``detect_recurring``; le
+    righe promosse prendono la sottocategoria 'Abbonamenti ricorrenti'.
+    """
+    promote = np.flatnonzero(np.asarray(is_recurring) & (df["macro_category"] == "Variabile").to_numpy())
+    if not len(promote):
+        return df
+    df = df.copy()
+    # Per posizione: dopo l'unione di più file le etichette dell'indice possono ripetersi
+    for column, value in [("macro_category", "Fisso"), ("subcategory", RECURRING_SUBCATEGORY)]:
+        df[column] = add_categories(df[column], [value])
+        df.iloc[promote, df.columns.get_loc(column)] = value
+    return df
+
+def group_by_merchant(df, by_sign=False):
+    """Raggruppa le righe per merchant normalizzato (ed eventualmente per segno).
+
+    Restituisce ``(rappresentanti, gruppi)``: la prima riga di ogni gruppo, in
+    ordine di apparizione, e per ogni riga di ``df`` la posizione del suo
+    rappresentante. Cache e richieste AI usano ``normalized_merchant``: il
+    merchant canonico unisce varianti per mostrarle insieme, ma un errore di
+    unione non deve estendere una sottocategoria a negozi diversi.
+    """
+    keys = [df["normalized_merchant"]]
+    if by_sign:
+        keys.append(np.sign(df["amount"]))
+    groups = df.groupby(keys, sort=False, dropna=False, observed=True).ngroup()
+    return df[~groups.duplicated()], groups
+
+
+def prepare_ai_request(
+    df,
+    cache=None,
+    group_by_sign=False,
+    stats=None,
+    profiler=NULL_PROFILER,
+    local_model=None,
+    min_confidence=LOCAL_MIN_CONFIDENCE,
+):
+    """Prima metà di ``ai_recategorize``: tutto ciò che non chiede all'AI.
+
+    Applica in place cache e modello locale e restituisce la richiesta per
+    l'AI (un dict con ``transactions``, da passare ad
+    ``ai_batch_categorize``, e i gruppi per riportare le risposte sulle
+    righe), oppure ``None`` se non resta nulla da chiedere.
+    """
+    stats = {} if stats is None else stats
+    stats.update(
+        cache_rows=0, cache_merchants=0, local_rows=0, local_merchants=0, pending_rows=0,
+        ai_requested=0, ai_rows=0, ai_merchants=0, failed_merchants=0, errors=[],
+    )
+    if local_model is not None:
+        # Il modello classifica solo uscite: le entrate non gli servono
+        labeled = df[df["subcategory"].isin(SUBCATEGORY_MACRO) & (df["macro_category"] != "Entrata")]
+        with profiler.stage("local_learn", rows=len(labeled)):
+            local_model.learn(labeled["normalized_merchant"], labeled["subcategory"])
+    uncategorized = df[df["subcategory"] == "Altro variabile"]
+    if len(uncategorized) > 0 and cache is not None:
+        with profiler.stage("ai_cache_lookup", rows=len(uncategorized)):
+            merchants = uncategorized["normalized_merchant"]
+            cached = cache.get_many(merchants.unique())
+            cached_labels = merchants.map(cached).dropna()
+            apply_subcategories(df, cached_labels)
+            uncategorized = uncategorized.drop(cached_labels.index)
+        stats.update(cache_rows=len(cached_labels), cache_merchants=len(cached))
+    if len(uncategorized) > 0 and local_model is not None and local_model.ready:
+        with profiler.stage("local_classify", rows=len(uncategorized)):
+            representatives, groups = group_by_merchant(uncategorized)
+            labels, confidence = local_model.predict(representatives["normalized_merchant"])
+            confident = np.flatnonzero(confidence >= min_confidence)
+            local_labels = groups.map(pd.Series(labels[confident], index=confident, dtype=object)).dropna()
+            apply_subcategories(df, local_labels)
+            uncategorized = uncategorized.drop(local_labels.index)
+        stats.update(local_rows=len(local_labels), local_merchants=len(confident))
+    stats["pending_rows"] = len(uncategorized)
+    if len(uncategorized) == 0:
+        return None
+
+    representatives, groups = group_by_merchant(uncategorized, group_by_sign)
+    return {
+        "transactions": [
+            {"description": description, "amount": amount}
+            for description, amount in zip(representatives["description"], representatives["amount"])
+        ],
+        "merchants": representatives["normalized_merchant"].tolist(),
+        "groups": groups,
+    }
+
+def _ai_group_labels(ai_results, requested: int) -> dict:
+    # Risposte dell'AI per posizione nella richiesta, scartando indici non validi
+    group_labels = {}
+    for idx_str, subcategory in ai_results.items():
+        try:
+            idx = int(idx_str)
+        except ValueError:
+            continue
+        if 0 <= idx < requested:
+            group_labels[idx] = subcategory
+    return group_labels
+
+def cache_ai_results(transactions: list, ai_results, cache) -> dict:
+    """Scrive in ``cache`` le risposte valide dell'AI per ``transactions``.
+
+    La chiave è il merchant normalizzato della descrizione, la stessa di
+    ``prepare_ai_request``: serve a chi ha solo la richiesta (es. il worker
+    della coda AI) e non le righe da cui è nata. Restituisce le coppie scritte.
+    """
+    merchant_labels = {
+        normalize_merchant(transactions[idx]["description"]): subcategory
+        for idx, subcategory in _ai_group_labels(ai_results, len(transactions)).items()
+        if subcategory in SUBCATEGORY_MACRO
+    }
+    if merchant_labels:
+        cache.put_many(merchant_labels)
+    return merchant_labels
+
+def apply_ai_results(df, request, ai_results, stats, cache=None, local_model=None):
+    """Seconda metà di ``ai_recategorize``: scrive in ``df`` le risposte dell'AI.
+
+    ``stats`` è quello di ``prepare_ai_request``, con in ``errors`` i batch
+    falliti; le sottocategorie valide finiscono in ``cache`` e addestrano
+    ``local_model``, se passati.
+    """
+    requested = len(request["transactions"])
+    stats["ai_requested"] = requested
+    stats["failed_merchants"] = sum(
+        min(AI_BATCH_SIZE, requested - start) for start, _ in stats["errors"]
+    )
+    group_labels = _ai_group_labels(ai_results, requested)
+    if not group_labels:
+        return stats
+    ai_labels = request["groups"].map(pd.Series(group_labels, dtype=object)).dropna()
+    apply_subcategories(df, ai_labels)
+    merchant_labels = {
+        request["merchants"][idx]: subcategory
+        for idx, subcategory in group_labels.items()
+        if subcategory in SUBCATEGORY_MACRO
+    }
+    if cache is not None:
+        cache.put_many(merchant_labels)
+    if local_model is not None:
+        local_model.learn(list(merchant_labels), list(merchant_labels.values()))
+    stats.update(ai_rows=len(ai_labels), ai_merchants=len(group_labels))
+    return stats
+
+def ai_recategorize(
+    df,
+    client,
+    cache=None,
+    group_by_sign=False,
+    on_batch_done=None,
+    stats=None,
+    profiler=NULL_PROFILER,
+    local_model=None,
+    min_confidence=LOCAL_MIN_CONFIDENCE,
+) -> dict:
+    """Riclassifica in place le righe 'Altro variabile': cache, modello locale, poi AI.
+
+    Con ``local_model`` (un ``MerchantClassifier``) le righe già categorizzate
+    dalle keyword e le risposte dell'AI addestrano il modello, che risolve i
+    merchant con confidenza almeno ``min_confidence``; solo gli altri vanno
+    all'AI. All'AI va un solo esempio per merchant (vedi
+    ``group_by_merchant``); le sottocategorie ottenute finiscono nella
+    ``cache``, se passata. Restituisce (e scrive in ``stats``, se passato) i
+    conteggi di righe e merchant risolti da cache, modello locale e AI, più
+    gli errori dei batch falliti. ``profiler`` misura ogni passaggio.
+    """
+    stats = {} if stats is None else stats
+    request = prepare_ai_request(
+        df, cache, group_by_sign, stats, profiler, local_model, min_confidence
+    )
+    if request is None or client is None:
+        return stats
+    with profiler.stage("ai_batch_categorize", rows=len(request["transactions"])):
+        ai_results = ai_batch_categorize(
+            request["transactions"], profiler.wrap_client(client), on_batch_done, stats["errors"]
+        )
+    return apply_ai_results(df, request, ai_results, stats, cache, local_model)
+
+def build_budget_prompt(summary) -> str:
+    # summary: aggregati del periodo prodotti da PeriodRollup.summary
+    totals = budget_aggregates(summary)
+    entrate = totals["entrate"]
+    fisso = totals["fisso"]
+    variabile = totals["variabile"]
+    risparmi = totals["risparmi"]
+    var_by_cat = totals["top_variabili"]
+    return f"""Sei un consulente finanziario personale. Analizza questi dati e dai 3-4 consigli pratici per ottimizzare il budget mensile.
+Dati periodo analizzato:
+- Entrate totali: {entrate:.0f}€
+- Spese fisse: {fisso:.0f}€ ({(fisso/entrate*100) if entrate > 0 else 0:.1f}%)
+- Spese variabili: {variabile:.0f}€ ({(variabile/entrate*100) if entrate > 0 else 0:.1f}%)
+- Risparmi/investimenti: {risparmi:.0f}€ ({(risparmi/entrate*100) if entrate > 0 else 0:.1f}%)
+Principali spese variabili:
+{var_by_cat.to_string()}
+Fornisci consigli pratici, con numeri specifici e percentuali. Sii conciso (max 4 punti)."""
+
+def advice_key(prompt: str) -> str:
+    # Il prompt contiene esattamente gli aggregati inviati: stessi numeri, stessa chiave
+    return hashlib.sha256(f"{AI_MODEL}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+def stream_budget_advice(prompt, client):
+    messages = [{"role": "user", "content": prompt}]
+    for chunk in client.chat_completion(
+        messages=messages,
+        model=AI_MODEL,
+        max_tokens=500,
+        temperature=0.7,
+        stream=True,
+    ):
+        token = chunk.choices[0].delta.content
+        if token:
+            yield token
+
+
+AMOUNT_NUMBER_RE = r"(?i)^[+-]?((\d+\.?\d*|\.\d+)(e[+-]?\d+)?|inf|infinity)$"
+
+def parse_amounts(values: pd.Series) -> pd.Series:
+    """Converte una colonna di importi testuali (formato IT o EN) in float.
+
+    Il separatore decimale è quello che compare per ultimo: ``1.234,56`` e
+    ``1,234.56`` diventano entrambi 1234.56. I valori non validi diventano NaN.
+    Tutte le operazioni girano sui kernel di pyarrow, senza loop Python.
+    """
+    arr = pa.array(values.astype(str).to_numpy(dtype=object), type=pa.string())
+    arr = pc.utf8_trim_whitespace(arr)
+    arr = pc.replace_substring(pc.replace_substring(arr, "€", ""), " ", "")
+    # Distanza dalla fine dell'ultima virgola / dell'ultimo punto (-1 se assente)
+    reversed_arr = pc.utf8_reverse(arr)
+    comma = pc.find_substring(reversed_arr, ",")
+    dot = pc.find_substring(reversed_arr, ".")
+    has_comma = pc.not_equal(comma, -1)
+    has_dot = pc.not_equal(dot, -1)
+    italian = pc.and_(has_comma, pc.or_(pc.invert(has_dot), pc.less(comma, dot)))
+    english = pc.and_(has_dot, pc.or_(pc.invert(has_comma), pc.less(dot, comma)))
+    it = pc.replace_substring(pc.replace_substring(arr, ".", ""), ",", ".")
+    en = pc.replace_substring(arr, ",", "")
+    normalized = pc.if_else(italian, it, pc.if_else(english, en, arr))
+    empty = pc.is_in(pc.utf8_lower(normalized), value_set=pa.array(["", "nan"]))
+    normalized = pc.if_else(empty, pa.scalar(None, pa.string()), normalized)
+    try:
+        numbers = pc.cast(normalized, pa.float64())
+    except pa.ArrowInvalid:
+        # Solo se c'è almeno un valore non numerico: azzera quelli non validi
+        valid = pc.match_substring_regex(normalized, AMOUNT_NUMBER_RE)
+        numbers = pc.cast(pc.if_else(valid, normalized, pa.scalar(None, pa.string())), pa.float64())
+    return pd.Series(numbers.to_numpy(zero_copy_only=False), index=values.index)
+
+def build_internal_df(
+    df_raw,
+    col_date,
+    col_desc,
+    col_amount,
+    col_name=None,
+    col_type=None,
+    col_iban=None,
+    default_account=DEFAULT_ACCOUNT,
+):
+    # Solo le colonne mappate vengono materializzate, già nello schema compatto.
+    # Senza colonna IBAN tutte le righe vanno su ``default_account``
+    n = len(df_raw)
+    df = pd.DataFrame(index=df_raw.index)
+    df["date"] = pd.to_datetime(df_raw[col_date], errors="coerce", dayfirst=True)
+
+    if col_name and col_name in df_raw.columns:
+        description = (
+            df_raw[col_name].astype(str).fillna("") + " - " + df_raw[col_desc].astype(str).fillna("")
+        ).str.strip(" -")
+    else:
+        description = df_raw[col_desc].astype(str)
+    df["description"] = description.astype(TEXT_DTYPE)
+
+    amount = parse_amounts(df_raw[col_amount])
+    df["amount"] = compact_amounts(amount)
+
+    if col_iban and col_iban in df_raw.columns:
+        df["account"] = as_category(df_raw[col_iban].astype(str))
+    else:
+        df["account"] = pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [default_account or DEFAULT_ACCOUNT])
+
+    if col_type and col_type in df_raw.columns:
+        df["bank_category"] = as_category(df_raw[col_type].astype(str))
+    else:
+        df["bank_category"] = pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [""])
+
+    df["direction"] = pd.Categorical.from_codes(
+        np.where(amount.gt(0), 0, 1).astype(np.int8), ["Entrata", "Uscita"]
+    )
+    for col in ["macro_category", "subcategory", "normalized_merchant", "canonical_merchant"]:
+        df[col] = pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), [""])
+
+    return df.sort_values("date", kind="stable")
+
+def process_csv(
+    file,
+    csv_format,
+    mapping,
+    chunksize=CSV_CHUNK_ROWS,
+    known_fingerprints=None,
+    stats=None,
+    profiler=NULL_PROFILER,
+    merchant_index=None,
+    account=None,
+    rules=None,
+):
+    """Legge il CSV a blocchi, li normalizza e categorizza uno alla volta.
+
+    ``mapping`` contiene gli argomenti colonna di ``build_internal_df``
+    (``col_date``, ``col_desc``, ...). In memoria resta al più un blocco del
+    file originale, oltre al risultato già categorizzato.
+
+    Ogni riga riceve la colonna ``fingerprint``; quelle già presenti in
+    ``known_fingerprints`` vengono scartate prima della categorizzazione.
+    Se passato, ``stats`` riceve il numero di righe lette e scartate;
+    ``profiler`` somma su tutti i blocchi i tempi di lettura
+    (``load_csv``), normalizzazione, impronte e categorizzazione. Tutti i
+    blocchi risolvono i merchant canonici nello stesso ``merchant_index``
+    (uno nuovo se non passato). ``account`` è il conto delle righe quando la
+    mappatura non ha una colonna IBAN. Le regole (``rules``, altrimenti
+    quelle correnti di ``RULES``) si fissano all'inizio: se il file delle
+    regole cambia durante la lettura, tutti i blocchi usano ancora la stessa
+    versione.
+    """
+    known = pd.Index(known_fingerprints).unique() if known_fingerprints is not None else None
+    if rules is None:
+        rules = RULES.current()
+    seen_counts = SeenCounts()
+    if merchant_index is None:
+        merchant_index = MerchantIndex()
+    parts = []
+    read = skipped = 0
+    for chunk in profiler.iterate("load_csv", iter_csv_chunks(file, csv_format, chunksize)):
+        with profiler.stage("build_internal_df", rows=len(chunk)):
+            df = build_internal_df(chunk, **mapping, default_account=account)
+        with profiler.stage("fingerprint", rows=len(df)):
+            df["fingerprint"] = transaction_fingerprints(df, seen_counts)
+            read += len(df)
+            if known is not None and len(known):
+                is_known = known.get_indexer(df["fingerprint"]) >= 0
+                skipped += int(is_known.sum())
+                df = df[~is_known]
+        with profiler.stage("categorize_df", rows=len(df)):
+            parts.append(categorize_df(df, merchant_index, rules))
+    if stats is not None:
+        stats.update(rows=read, skipped=skipped)
+    if not parts:
+        empty = build_internal_df(
+            read_csv_preview(file, csv_format, nrows=0), **mapping, default_account=account
+        )
+        empty["fingerprint"] = transaction_fingerprints(empty)
+        return categorize_df(empty, merchant_index, rules)
+    # Ogni blocco è già ordinato: il sort stabile rende l'ordine identico a
+    # quello di un'unica lettura del file
+    with profiler.stage("concat_blocks", rows=read - skipped):
+        return concat_transactions(parts).sort_values("date", kind="stable")
+
+def process_files(
+    jobs,
+    max_workers=UPLOAD_MAX_WORKERS,
+    known_fingerprints=None,
+    stats=None,
+    profiler=NULL_PROFILER,
+    merchant_index=None,
+    rules=None,
+):
+    """Elabora più estratti conto in parallelo e li unisce in un unico dataset.
+
+    Ogni elemento di ``jobs`` è un dict con ``name``, ``file``,
+    ``csv_format``, ``mapping`` e, facoltativo, ``account``: i file passano
+    da ``process_csv`` in thread separati, con lo stesso
+    ``merchant_index`` e le stesse regole. Le transazioni presenti in più file (es. due export
+    dello stesso conto con periodi sovrapposti) restano una volta sola.
+    ``stats`` riceve i totali e, in ``files``, righe lette e scartate per file.
+    """
+    if merchant_index is None:
+        merchant_index = MerchantIndex()
+    known = pd.Index(known_fingerprints).unique() if known_fingerprints is not None else None
+    if rules is None:
+        rules = RULES.current()
+    file_stats = [{} for _ in jobs]
+
+    def run(job, job_stats):
+        return process_csv(
+            job["file"],
+            job["csv_format"],
+            job["mapping"],
+            known_fingerprints=known,
+            stats=job_stats,
+            profiler=profiler,
+            merchant_index=merchant_index,
+            account=job.get("account"),
+            rules=rules,
+        )
+
+    workers = max(1, min(max_workers, len(jobs)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(run, jobs, file_stats))
+    with profiler.stage("merge_files", rows=sum(len(p) for p in parts)):
+        # L'ordine dei file è quello di ``jobs``: a parità di data l'unione è stabile
+        merged = concat_transactions(parts).sort_values("date", kind="stable")
+        duplicated = merged["fingerprint"].duplicated().to_numpy()
+        # Le etichette di riga dei CSV si ripetono tra un file e l'altro: indice nuovo
+        merged = merged[~duplicated].reset_index(drop=True)
+    if stats is not None:
+        stats.update(
+            rows=sum(s["rows"] for s in file_stats),
+            skipped=sum(s["skipped"] for s in file_stats) + int(duplicated.sum()),
+            duplicates=int(duplicated.sum()),
+            files={job["name"]: s for job, s in zip(jobs, file_stats)},
+        )
+    return merged
+
+MAPPING_KEYWORDS = {
+    "col_date": ["Data operazione", "Data", "date"],
+    "col_desc": ["Descrizione", "Causale", "Description"],
+    "col_amount": ["Importo", "Amount", "Valore"],
+    "col_name": ["Nome", "Name", "Beneficiario", "Controparte"],
+    "col_type": ["Tipologia", "Tipo", "Type"],
+    "col_iban": ["Iban", "IBAN", "Account"],
+}
+REQUIRED_MAPPING = ["col_date", "col_desc", "col_amount"]
+
+def suggest_column(col_names, keywords):
+    for k in keywords:
+        for c in col_names:
+            if k.lower() in c.lower():
+                return c
+    return None
+
+def suggest_mapping(col_names) -> dict:
+    """Mappatura proposta per le intestazioni ``col_names`` (``None`` se non trovata)."""
+    return {key: suggest_column(col_names, keywords) for key, keywords in MAPPING_KEYWORDS.items()}
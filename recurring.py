@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+
+from frame_schema import amounts_float64
+
+# Nome, giorni del periodo, tolleranza in giorni, addebiti minimi
+PERIODS = [
+    ("settimanale", 7.0, 1.5, 4),
+    ("mensile", 30.44, 4.0, 3),
+    ("annuale", 365.25, 15.0, 3),
+]
+# Variazione massima di importo tra un addebito e il successivo (aumenti di prezzo)
+MAX_PRICE_CHANGE = 0.25
+# Quota minima di addebiti consecutivi con intervallo e importo regolari
+MIN_MATCH_SHARE = 0.75
+RECURRING_COLUMNS = [
+    "merchant",
+    "period",
+    "interval_days",
+    "charges",
+    "amount",
+    "amount_cv",
+    "first_date",
+    "last_date",
+    "next_date",
+    "next_amount",
+    "monthly_cost",
+    "active",
+    "subcategory",
+]
+
+
+def _codes(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype(np.int64), values.cat.categories.astype(str).to_numpy()
+    codes, uniques = pd.factorize(values.astype(object))
+    return codes.astype(np.int64), np.asarray(uniques, dtype=str)
+
+
+def _first_per_group(group: np.ndarray) -> np.ndarray:
+    # ``group`` è ordinato: True sulla prima posizione di ogni gruppo
+    return np.r_[True, group[1:] != group[:-1]] if len(group) else np.zeros(0, dtype=bool)
+
+
+def detect_recurring(df, merchant_column="canonical_merchant", reference_date=None):
+    """Pagamenti ricorrenti (settimanali, mensili, annuali) nelle uscite di ``df``.
+
+    Gli importi che un merchant addebita identici almeno due volte sono i
+    suoi livelli di prezzo e solo quelle uscite vengono considerate: gli
+    acquisti sporadici dallo stesso merchant non rompono la serie, mentre un
+    aumento di prezzo la prosegue (dal secondo addebito al nuovo prezzo).
+    Ordinate per merchant e data, gli intervalli tra addebiti consecutivi si
+    calcolano in un solo passaggio. Un merchant è ricorrente se l'intervallo
+    mediano è vicino a un periodo di ``PERIODS`` e almeno
+    ``MIN_MATCH_SHARE`` dei passaggi da un addebito al successivo rispettano
+    il periodo con una variazione di importo entro ``MAX_PRICE_CHANGE``. Il
+    costo è quello degli ordinamenti, O(n log n), tutto vettoriale.
+
+    Restituisce ``(ricorrenze, righe)``: una riga per merchant ricorrente con
+    periodo, prossimo addebito previsto (data e importo) e costo mensile
+    equivalente; e una maschera booleana allineata alle righe di ``df`` con
+    gli addebiti che fanno parte di una ricorrenza. Una ricorrenza è attiva
+    se il prossimo addebito non è in ritardo rispetto a ``reference_date``
+    (di default l'ultima data del dataset).
+    """
+    is_recurring = np.zeros(len(df), dtype=bool)
+    if merchant_column not in df.columns:
+        merchant_column = "normalized_merchant"
+    codes, names = _codes(df[merchant_column])
+    amount = amounts_float64(df["amount"]).to_numpy()
+    dates = df["date"].to_numpy(dtype="datetime64[D]")
+    valid = (amount < 0) & ~np.isnat(dates) & (codes >= 0)
+    valid[valid] = names[codes[valid]] != ""
+    pos = np.flatnonzero(valid)
+    if reference_date is None:
+        reference_date = dates[~np.isnat(dates)].max() if (~np.isnat(dates)).any() else None
+    if not len(pos):
+        return pd.DataFrame(columns=RECURRING_COLUMNS), is_recurring
+
+    code = codes[pos]
+    cents = np.rint(-amount[pos] * 100).astype(np.int64)
+    day = dates[pos].astype(np.int64)
+
+    # Livelli di prezzo: coppie (merchant, centesimi) che si ripetono
+    keys = code * (int(cents.max()) + 1) + cents
+    _, inverse, level_counts = np.unique(keys, return_inverse=True, return_counts=True)
+    repeated = level_counts[inverse] >= 2
+    pos, code, cents, day = pos[repeated], code[repeated], cents[repeated], day[repeated]
+
+    # Addebiti per merchant in ordine di data; lo stesso giorno conta una volta
+    order = np.lexsort((day, code))
+    pos, code, cents, day = pos[order], code[order], cents[order], day[order]
+    first = _first_per_group(code)
+    charge = first | np.r_[True, day[1:] != day[:-1]]
+    c_code, c_cents, c_day = code[charge], cents[charge], day[charge]
+    c_first = _first_per_group(c_code)
+    starts = np.flatnonzero(c_first)
+    ends = np.r_[starts[1:], len(c_code)] - 1
+    group_code = c_code[starts]
+    n_charges = ends - starts + 1
+    group_of = np.cumsum(c_first) - 1
+
+    follows = ~c_first[1:]
+    intervals = np.diff(c_day)[follows].astype(np.float64)
+    interval_group = group_of[1:][follows]
+    median = (
+        pd.Series(intervals).groupby(interval_group).median().reindex(range(len(starts))).to_numpy()
+    )
+
+    period_days = np.array([p[1] for p in PERIODS])
+    tolerance = np.array([p[2] for p in PERIODS])
+    min_charges = np.array([p[3] for p in PERIODS])
+    distance = np.abs(np.nan_to_num(median, nan=-1e9)[:, None] - period_days[None, :])
+    period = distance.argmin(axis=1)
+    in_period = distance[np.arange(len(period)), period] <= tolerance[period]
+
+    previous = c_cents[:-1][follows]
+    steady = np.abs(c_cents[1:][follows] - previous) <= MAX_PRICE_CHANGE * previous
+    on_time = np.abs(intervals - period_days[period[interval_group]]) <= tolerance[period[interval_group]]
+    regular = np.bincount(interval_group, weights=on_time & steady, minlength=len(starts))
+    share = regular / np.maximum(n_charges - 1, 1)
+    total = np.bincount(group_of, weights=c_cents, minlength=len(starts))
+    squares = np.bincount(group_of, weights=c_cents.astype(np.float64) ** 2, minlength=len(starts))
+    mean = total / n_charges
+    cv = np.sqrt(np.maximum(squares / n_charges - mean ** 2, 0)) / mean
+
+    detected = in_period & (n_charges >= min_charges[period]) & (share >= MIN_MATCH_SHARE)
+    groups = np.flatnonzero(detected)
+    is_recurring[pos[np.isin(code, group_code[groups])]] = True
+
+    period = period[groups]
+    last_day = pd.to_datetime(c_day[ends[groups]].astype("datetime64[D]"))
+    first_day = pd.to_datetime(c_day[starts[groups]].astype("datetime64[D]"))
+    # Mesi e anni di calendario, non 30 o 365 giorni fissi
+    next_date = np.select(
+        [period == 0, period == 1],
+        [last_day + pd.Timedelta(days=7), last_day + pd.DateOffset(months=1)],
+        last_day + pd.DateOffset(years=1),
+    )
+    next_date = pd.to_datetime(next_date)
+    next_amount = c_cents[ends[groups]] / 100
+    last_pos = pos[charge][ends[groups]]
+    recurrences = pd.DataFrame({
+        "merchant": names[group_code[groups]],
+        "period": np.array([p[0] for p in PERIODS], dtype=object)[period],
+        "interval_days": median[groups],
+        "charges": n_charges[groups],
+        "amount": np.round(mean[groups] / 100, 2),
+        "amount_cv": np.round(cv[groups], 4),
+        "first_date": first_day,
+        "last_date": last_day,
+        "next_date": next_date,
+        "next_amount": next_amount,
+        "monthly_cost": np.round(next_amount * PERIODS[1][1] / period_days[period], 2),
+        "active": next_date + pd.to_timedelta(tolerance[period], unit="D") >= pd.Timestamp(reference_date),
+        "subcategory": df["subcategory"].to_numpy()[last_pos].astype(str) if "subcategory" in df.columns else "",
+    })
+    return recurrences.sort_values("next_date", kind="stable").reset_index(drop=True), is_recurring
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+from frame_schema import amounts_float64
+
+SUMMARY_COLUMNS = ["macro_category", "subcategory", "amount", "amount_abs", "count"]
+
+
+def _aggregate(df, keys) -> pd.DataFrame:
+    amount = amounts_float64(df["amount"])
+    return (
+        df.assign(amount=amount, amount_abs=amount.abs())
+        .groupby(keys, sort=False, observed=True)
+        .agg(
+            amount=("amount", "sum"),
+            amount_abs=("amount_abs", "sum"),
+            count=("amount", "size"),
+        )
+        .reset_index()
+    )
+
+
+class PeriodRollup:
+    """Cubo mese × macro-categoria × sottocategoria con indice ordinato per data.
+
+    Viene costruito una volta per dataset. ``summary(start, end)`` somma i
+    mesi interamente compresi nell'intervallo dal cubo e aggrega riga per riga
+    solo i mesi di bordo, trovati con una ricerca binaria sulle date: il
+    costo dipende dal numero di mesi, non da quello delle transazioni.
+    """
+
+    def __init__(self, df):
+        dates = df["date"]
+        n_valid = int(dates.notna().sum())
+        head = dates.iloc[:n_valid]
+        # Le date senza valore (NaT) devono stare in fondo, come dopo sort_values
+        if not (head.notna().all() and head.is_monotonic_increasing):
+            df = df.sort_values("date", kind="stable")
+        self.df = df
+        self.n_valid = n_valid
+        self.dates = df["date"].to_numpy()[:n_valid]
+
+        months = self.dates.astype("datetime64[M]")
+        month_starts, first_pos = np.unique(months, return_index=True)
+        self.month_starts = month_starts
+        # Righe del mese i: posizioni [month_pos[i], month_pos[i + 1])
+        self.month_pos = np.append(first_pos, n_valid)
+
+        valid = df.iloc[:n_valid]
+        month_idx = np.repeat(np.arange(len(month_starts)), np.diff(self.month_pos))
+        self.cube = _aggregate(
+            valid[["macro_category", "subcategory", "amount"]].assign(month=month_idx),
+            ["month", "macro_category", "subcategory"],
+        )
+
+    @property
+    def date_min(self):
+        return pd.Timestamp(self.dates[0]) if self.n_valid else pd.NaT
+
+    @property
+    def date_max(self):
+        return pd.Timestamp(self.dates[-1]) if self.n_valid else pd.NaT
+
+    def positions(self, start, end):
+        """Intervallo di righe ``[lo, hi)`` con data tra ``start`` ed ``end`` inclusi."""
+        lo = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start)), side="left")
+        hi = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end)), side="right")
+        return int(lo), int(max(lo, hi))
+
+    def rows(self, start, end):
+        lo, hi = self.positions(start, end)
+        return self.df.iloc[lo:hi]
+
+    def summary(self, start, end) -> pd.DataFrame:
+        """Somme e conteggi per macro-categoria e sottocategoria nel periodo."""
+        lo, hi = self.positions(start, end)
+        # Mesi le cui righe cadono tutte in [lo, hi)
+        first_full = np.searchsorted(self.month_pos[:-1], lo, side="left")
+        end_full = np.searchsorted(self.month_pos[1:], hi, side="right")
+        if first_full < end_full:
+            in_months = self.cube["month"].between(first_full, end_full - 1)
+            parts = [self.cube.loc[in_months, SUMMARY_COLUMNS]]
+            edges = [(lo, self.month_pos[first_full]), (self.month_pos[end_full], hi)]
+        else:
+            parts = []
+            edges = [(lo, hi)]
+        for a, b in edges:
+            if b > a:
+                edge = self.df.iloc[a:b][["macro_category", "subcategory", "amount"]]
+                parts.append(_aggregate(edge, ["macro_category", "subcategory"]))
+        if not parts:
+            return pd.DataFrame(columns=SUMMARY_COLUMNS)
+        return (
+            pd.concat(parts, ignore_index=True)
+            .groupby(["macro_category", "subcategory"], sort=True, observed=True)
+            [["amount", "amount_abs", "count"]]
+            .sum()
+            .reset_index()
+        )
+
+
+def budget_aggregates(summary) -> dict:
+    """Totali per macro-categoria e prime 5 sottocategorie variabili."""
+    by_macro = summary.groupby("macro_category", observed=True)["amount"].sum()
+    variable = summary[summary["macro_category"] == "Variabile"]
+    return {
+        "entrate": by_macro.get("Entrata", 0.0),
+        "fisso": abs(by_macro.get("Fisso", 0.0)),
+        "variabile": abs(by_macro.get("Variabile", 0.0)),
+        "risparmi": abs(by_macro.get("Risparmi & investimenti", 0.0)),
+        "top_variabili": (
+            variable.groupby("subcategory", observed=True)["amount"]
+            .sum()
+            .abs()
+            .sort_values(ascending=False)
+            .head(5)
+        ),
+    }
+
+
+def chart_aggregates(summary) -> dict:
+    """Totali per macro-categoria e dati dei grafici a torta e a barre."""
+    by_macro = summary.groupby("macro_category", observed=True)[["amount", "amount_abs"]].sum()
+    macro_pie = pd.DataFrame({
+        "macro_category": by_macro.index,
+        "value_for_chart": np.where(
+            by_macro.index == "Entrata", by_macro["amount"], by_macro["amount_abs"]
+        ),
+    })
+    variable_bar = (
+        summary[summary["macro_category"] == "Variabile"]
+        .groupby("subcategory", observed=True)["amount_abs"]
+        .sum()
+        .reset_index()
+        .sort_values("amount_abs")
+    )
+    return {"by_macro": by_macro, "macro_pie": macro_pie, "variable_bar": variable_bar}
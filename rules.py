@@ -0,0 +1,318 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from frame_schema import amounts_float64
+
+SIGNS = ("entrata", "uscita")
+# Testi su cui si misura il costo di ogni regola, una ``categorize`` ogni
+# TIMING_EVERY: nelle altre si conta solo quanti testi sono passati
+TIMING_SAMPLE = 256
+TIMING_EVERY = 16
+
+
+class RuleError(ValueError):
+    """File delle regole non valido: JSON malformato, campi sconosciuti, regex errate."""
+
+
+def _as_list(value, field, rule_id) -> list:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(v, str) and v for v in value):
+        raise RuleError(f"regola «{rule_id}»: ``{field}`` deve essere una lista di stringhe")
+    return value
+
+
+class Rule:
+    """Una regola del file: condizioni sul testo e sulla riga, sottocategoria assegnata.
+
+    Il testo (descrizione in minuscolo) soddisfa la regola se contiene una
+    delle ``keywords`` come sottostringa, una delle ``words`` come parola
+    intera o una delle ``regex``. ``sign`` limita la regola alle entrate o
+    alle uscite, ``amount_min``/``amount_max`` all'importo in valore
+    assoluto (estremi inclusi), ``accounts`` ai conti elencati. Le
+    condizioni presenti devono valere tutte.
+    """
+
+    FIELDS = {
+        "id", "subcategory", "priority", "sign", "keywords", "words", "regex",
+        "amount_min", "amount_max", "accounts", "note",
+    }
+
+    def __init__(self, spec: dict, subcategories):
+        if not isinstance(spec, dict) or not spec.get("id"):
+            raise RuleError(f"ogni regola deve essere un oggetto con ``id``: {spec!r}")
+        self.id = str(spec["id"])
+        unknown = set(spec) - self.FIELDS
+        if unknown:
+            raise RuleError(f"regola «{self.id}»: campi sconosciuti {sorted(unknown)}")
+        self.subcategory = spec.get("subcategory")
+        if self.subcategory not in subcategories:
+            raise RuleError(f"regola «{self.id}»: sottocategoria sconosciuta «{self.subcategory}»")
+        self.priority = spec.get("priority", 0)
+        if not isinstance(self.priority, (int, float)):
+            raise RuleError(f"regola «{self.id}»: ``priority`` deve essere un numero")
+        self.sign = spec.get("sign")
+        if self.sign not in (None, *SIGNS):
+            raise RuleError(f"regola «{self.id}»: ``sign`` deve essere uno tra {SIGNS}")
+        self.keywords = [k.lower() for k in _as_list(spec.get("keywords"), "keywords", self.id)]
+        self.words = [w.lower() for w in _as_list(spec.get("words"), "words", self.id)]
+        self.regex = _as_list(spec.get("regex"), "regex", self.id)
+        self.amount_min = spec.get("amount_min")
+        self.amount_max = spec.get("amount_max")
+        for bound in (self.amount_min, self.amount_max):
+            if bound is not None and not isinstance(bound, (int, float)):
+                raise RuleError(f"regola «{self.id}»: gli estremi di importo devono essere numeri")
+        self.accounts = _as_list(spec.get("accounts"), "accounts", self.id)
+        self.literals = [re.escape(k) for k in self.keywords] + [
+            rf"(?<!\w){re.escape(w)}(?!\w)" for w in self.words
+        ]
+        try:
+            patterns = self.literals + [f"(?:{r})" for r in self.regex]
+            self.text = re.compile("|".join(patterns)) if patterns else None
+        except re.error as e:
+            raise RuleError(f"regola «{self.id}»: regex non valida ({e})") from None
+        if self.text is None and not self.has_row_conditions:
+            raise RuleError(f"regola «{self.id}»: nessuna condizione, catturerebbe tutto")
+
+    @property
+    def has_row_conditions(self) -> bool:
+        return self.amount_min is not None or self.amount_max is not None or bool(self.accounts)
+
+    @property
+    def plain(self) -> bool:
+        # Solo parole e sottostringhe: entra nella scansione unica del testo
+        return not self.regex and not self.has_row_conditions
+
+
+class RuleSet:
+    """Regole compilate in un matcher, con contatori di uso e tempi per regola.
+
+    Le regole sono ordinate per ``priority`` decrescente e, a pari priorità,
+    per posizione nel file: vince la prima soddisfatta. Le regole di sole
+    parole e sottostringhe finiscono, per ciascun segno, in due regex (una
+    per le sottostringhe, una per le parole intere) con le keyword in ordine
+    di priorità, valutate una volta per descrizione distinta: la keyword
+    catturata dà la regola migliore in quel punto del testo. Le regole con
+    regex o condizioni su importo e conto si valutano dopo, una per una,
+    solo sulle righe che non hanno già una regola più prioritaria.
+
+    ``hits`` conta le righe assegnate da ogni regola; ``seconds`` stima il
+    tempo speso da ciascuna sulle descrizioni viste, misurando la sua regex
+    da sola su ``TIMING_SAMPLE`` testi una chiamata ogni ``TIMING_EVERY`` e
+    riportando il costo per testo su tutti i testi arrivati nel frattempo.
+    """
+
+    def __init__(self, specs: list, subcategory_macro: dict, version: str = ""):
+        rules = [Rule(spec, subcategory_macro) for spec in specs]
+        ids = [r.id for r in rules]
+        duplicated = sorted({i for i in ids if ids.count(i) > 1})
+        if duplicated:
+            raise RuleError(f"id di regola ripetuti: {duplicated}")
+        order = sorted(range(len(rules)), key=lambda i: -rules[i].priority)
+        self.rules = [rules[i] for i in order]
+        self.version = version
+        self._macro = np.array([subcategory_macro[r.subcategory] for r in self.rules], dtype=object)
+        self._sub = np.array([r.subcategory for r in self.rules], dtype=object)
+        self._scanners = {sign: self._scanner(sign) for sign in SIGNS}
+        self._conditional = [k for k, r in enumerate(self.rules) if not r.plain]
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def _scanner(self, sign):
+        # Due scansioni per segno, sottostringhe e parole intere, ognuna con
+        # un solo gruppo: il lookahead trova anche le keyword sovrapposte e, a
+        # parità di posizione, l'alternanza prova le keyword in ordine di
+        # priorità, quindi basta il rank minimo tra tutte le posizioni
+        scans = []
+        for field, template in (("keywords", "(?=({}))"), ("words", r"(?<!\w)(?=({})(?!\w))")):
+            ranks = {}
+            for rank, rule in enumerate(self.rules):
+                if rule.plain and rule.sign in (None, sign):
+                    for literal in getattr(rule, field):
+                        ranks.setdefault(literal, rank)
+            if ranks:
+                alternation = "|".join(re.escape(literal) for literal in ranks)
+                scans.append((re.compile(template.format(alternation)), ranks))
+        return scans
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = np.zeros(len(self.rules), dtype=np.int64)
+            self.seconds = np.zeros(len(self.rules), dtype=np.float64)
+            self.rows = 0
+            self._calls = 0
+            self._untimed = 0
+
+    def _best_rank(self, scans, text: str) -> int:
+        best = -1
+        for pattern, ranks in scans:
+            for m in pattern.finditer(text):
+                rank = ranks[m.group(1)]
+                if best < 0 or rank < best:
+                    best = rank
+                    if rank == 0:
+                        return best
+        return best
+
+    def categorize(self, descriptions, amounts, accounts=None, default_income=None, default_expense=None):
+        """Due array (macro, sottocategoria) allineati alle righe, più il rank della regola.
+
+        Le righe con importo positivo sono entrate, le altre uscite; quelle
+        senza regola ricevono la coppia ``default_income`` o
+        ``default_expense``. Il rank è la posizione in ``rules`` (-1 se
+        nessuna regola) e serve a spiegare il risultato riga per riga.
+        """
+        amount = amounts_float64(pd.Series(amounts)).to_numpy()
+        income = amount > 0
+        codes, texts = pd.factorize(pd.Series(descriptions).astype(str).str.lower())
+        texts = np.asarray(texts, dtype=object)
+        ranks = np.full(len(codes), len(self.rules), dtype=np.int64)
+        for sign, rows in (("entrata", income), ("uscita", ~income)):
+            scanner = self._scanners[sign]
+            if not scanner or not rows.any():
+                continue
+            # Una scansione per descrizione distinta, e solo per quelle con questo segno
+            used = np.unique(codes[rows])
+            best = np.full(len(texts), len(self.rules), dtype=np.int64)
+            best[used] = [self._best_rank(scanner, texts[u]) for u in used]
+            best[best < 0] = len(self.rules)
+            ranks[rows] = best[codes[rows]]
+
+        for k in self._conditional:
+            rule = self.rules[k]
+            pending = np.flatnonzero(ranks > k)
+            if rule.sign is not None:
+                pending = pending[income[pending] == (rule.sign == "entrata")]
+            magnitude = np.abs(amount[pending])
+            keep = np.ones(len(pending), dtype=bool)
+            if rule.amount_min is not None:
+                keep &= magnitude >= rule.amount_min
+            if rule.amount_max is not None:
+                keep &= magnitude <= rule.amount_max
+            if rule.accounts and accounts is not None:
+                keep &= np.isin(np.asarray(accounts, dtype=object)[pending], rule.accounts)
+            elif rule.accounts:
+                keep[:] = False
+            pending = pending[keep]
+            if rule.text is not None and len(pending):
+                used = np.unique(codes[pending])
+                found = np.zeros(len(texts), dtype=bool)
+                found[used] = [rule.text.search(texts[u]) is not None for u in used]
+                pending = pending[found[codes[pending]]]
+            ranks[pending] = k
+
+        self._record(ranks, texts)
+        matched = ranks < len(self.rules)
+        macro = np.empty(len(ranks), dtype=object)
+        sub = np.empty(len(ranks), dtype=object)
+        macro[matched], sub[matched] = self._macro[ranks[matched]], self._sub[ranks[matched]]
+        for rows, default in ((~matched & income, default_income), (~matched & ~income, default_expense)):
+            if default is not None:
+                macro[rows], sub[rows] = default
+        ranks[~matched] = -1
+        return macro, sub, ranks
+
+    def _record(self, ranks, texts):
+        hits = np.bincount(ranks, minlength=len(self.rules) + 1)[: len(self.rules)]
+        with self._lock:
+            self.hits += hits
+            self.rows += len(ranks)
+            self._untimed += len(texts)
+            timed = self._calls % TIMING_EVERY == 0
+            self._calls += 1
+            if not timed:
+                return
+            untimed, self._untimed = self._untimed, 0
+        sample = texts[:TIMING_SAMPLE]
+        seconds = np.zeros(len(self.rules))
+        for k, rule in enumerate(self.rules):
+            if rule.text is None or not len(sample):
+                continue
+            started = time.perf_counter()
+            for text in sample:
+                rule.text.search(text)
+            seconds[k] = (time.perf_counter() - started) * untimed / len(sample)
+        with self._lock:
+            self.seconds += seconds
+
+    def report(self) -> pd.DataFrame:
+        """Una riga per regola: righe catturate, quota sul totale e tempo stimato."""
+        with self._lock:
+            hits, seconds, rows = self.hits.copy(), self.seconds.copy(), self.rows
+        return pd.DataFrame({
+            "id": [r.id for r in self.rules],
+            "subcategory": self._sub,
+            "priority": [r.priority for r in self.rules],
+            "hits": hits,
+            "share": hits / rows if rows else np.zeros(len(hits)),
+            "ms": np.round(seconds * 1000, 2),
+        })
+
+
+class RuleBook:
+    """Il file JSON delle regole, ricompilato quando cambia su disco.
+
+    ``current()`` controlla data di modifica e dimensione del file (una
+    ``stat``, nessuna lettura) e ricompila solo se sono cambiate. Un file
+    modificato ma non valido non ferma la categorizzazione: resta in uso
+    l'ultima versione buona e l'errore finisce in ``error``. Il primo
+    caricamento invece deve riuscire.
+    """
+
+    def __init__(self, path: str, subcategory_macro: dict):
+        self.path = path
+        self.subcategory_macro = subcategory_macro
+        self.error = None
+        self.loaded_at = None
+        self._stamp = None
+        self._rules = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> RuleSet:
+        with open(self.path, "rb") as f:
+            raw = f.read()
+        try:
+            data = json.loads(raw.decode("utf-8"))
+        except ValueError as e:
+            raise RuleError(f"{self.path}: JSON non valido ({e})") from None
+        specs = data.get("rules") if isinstance(data, dict) else None
+        if not isinstance(specs, list):
+            raise RuleError(f"{self.path}: manca la lista ``rules``")
+        return RuleSet(specs, self.subcategory_macro, version=hashlib.sha1(raw).hexdigest()[:12])
+
+    def current(self) -> RuleSet:
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            # File rimosso o spostato: si continua con le regole già compilate
+            if self._rules is None:
+                raise
+            self.error = str(e)
+            return self._rules
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return self._rules
+        with self._lock:
+            if stamp != self._stamp:
+                try:
+                    self._rules = self._load()
+                    self.error = None
+                    self.loaded_at = time.time()
+                except (OSError, RuleError) as e:
+                    if self._rules is None:
+                        raise
+                    self.error = str(e)
+                self._stamp = stamp
+        return self._rules
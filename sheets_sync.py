@@ -0,0 +1,197 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from ai_batch import RateLimiter
+from frame_schema import amounts_float64
+from history_store import transaction_fingerprints
+from instrumentation import NULL_PROFILER
+
+# Colonna del dataset e intestazione nel foglio, nell'ordine di un foglio nuovo
+SHEET_COLUMNS = [
+    ("date", "Data"),
+    ("description", "Descrizione"),
+    ("amount", "Importo"),
+    ("account", "Conto"),
+    ("macro_category", "Macro-categoria"),
+    ("subcategory", "Sottocategoria"),
+    ("canonical_merchant", "Merchant"),
+    ("fingerprint", "Impronta"),
+]
+FINGERPRINT_HEADER = dict(SHEET_COLUMNS)["fingerprint"]
+
+
+def open_worksheet(credentials: dict, spreadsheet: str, title: str):
+    """Il foglio ``title`` dello spreadsheet (chiave o URL), creato se manca.
+
+    ``credentials`` è il JSON di un service account con accesso allo
+    spreadsheet. gspread si importa qui, solo quando la sincronizzazione
+    serve davvero.
+    """
+    import gspread
+
+    client = gspread.service_account_from_dict(credentials)
+    if spreadsheet.startswith("https://"):
+        book = client.open_by_url(spreadsheet)
+    else:
+        book = client.open_by_key(spreadsheet)
+    try:
+        return book.worksheet(title)
+    except gspread.WorksheetNotFound:
+        return book.add_worksheet(title, rows=1, cols=len(SHEET_COLUMNS))
+
+
+def _cells(df, column) -> list:
+    # Valori già pronti per il JSON dell'API: niente NaN, date ISO, impronte esadecimali
+    if column not in df.columns:
+        return [""] * len(df)
+    values = df[column]
+    if column == "date":
+        return pd.to_datetime(values).dt.strftime("%Y-%m-%d").fillna("").tolist()
+    if column == "amount":
+        amounts = amounts_float64(values).round(2)
+        return amounts.astype(object).where(amounts.notna(), "").tolist()
+    if column == "fingerprint":
+        # Un uint64 non sta in un numero del foglio (double): va scritto come testo
+        return [format(v, "016x") for v in values.to_numpy(dtype=np.uint64).tolist()]
+    return values.astype(object).where(values.notna(), "").astype(str).tolist()
+
+
+def _is_quota_error(error) -> bool:
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+def sync_to_sheet(
+    df,
+    worksheet,
+    chunk_rows: int = 5000,
+    requests_per_second: float = None,
+    max_retries: int = 3,
+    backoff: float = 5.0,
+    stats=None,
+    profiler=NULL_PROFILER,
+):
+    """Aggiunge a ``worksheet`` le transazioni di ``df`` che il foglio non ha ancora.
+
+    Il foglio viene letto una volta sola, solo l'intestazione e la colonna
+    ``Impronta``: le righe la cui impronta è già presente vengono saltate,
+    le altre scritte con ``append_rows`` in blocchi di ``chunk_rows``, una
+    chiamata API per blocco invece di una per cella. ``requests_per_second``
+    distanzia le scritture e un errore di quota (429) viene ritentato con
+    backoff esponenziale: un blocco rifiutato per quota non è stato scritto.
+    Se la sincronizzazione si interrompe a metà, la successiva riprende dai
+    blocchi mancanti.
+
+    Un foglio vuoto riceve l'intestazione di ``SHEET_COLUMNS`` insieme al
+    primo blocco; in un foglio esistente le colonne si scrivono nell'ordine
+    della sua intestazione, che deve avere la colonna ``Impronta``.
+    ``df`` senza colonna ``fingerprint`` riceve le impronte con
+    ``transaction_fingerprints``. ``stats`` riceve righe scritte, già
+    presenti, blocchi e chiamate API fatte.
+    """
+    calls = 0
+    with profiler.stage("sheets_read"):
+        header = worksheet.row_values(1)
+        calls += 1
+        if header:
+            if FINGERPRINT_HEADER not in header:
+                raise ValueError(
+                    f"il foglio «{worksheet.title}» non ha la colonna «{FINGERPRINT_HEADER}»: "
+                    "non è stato creato dalla sincronizzazione"
+                )
+            existing = worksheet.col_values(header.index(FINGERPRINT_HEADER) + 1)[1:]
+            calls += 1
+        else:
+            existing = []
+
+    with profiler.stage("sheets_diff", rows=len(df)):
+        if "fingerprint" not in df.columns:
+            df = df.assign(fingerprint=transaction_fingerprints(df))
+        fingerprints = _cells(df, "fingerprint")
+        # Il foglio può avere impronte ripetute (sincronizzazioni concorrenti
+        # da altri processi, righe vuote): basta sapere quali ci sono
+        new = ~pd.Index(fingerprints).isin(pd.Index(existing).unique())
+        # Una transazione ripetuta in ``df`` si scrive una volta sola
+        new &= ~pd.Index(fingerprints).duplicated()
+        df = df[new]
+        labels = header or [label for _, label in SHEET_COLUMNS]
+        by_label = {label: column for column, label in SHEET_COLUMNS}
+        columns = [_cells(df, by_label.get(label, "")) for label in labels]
+        rows = [list(row) for row in zip(*columns)]
+        if not header:
+            rows.insert(0, labels)
+
+    limiter = RateLimiter(requests_per_second)
+    starts = list(range(0, len(rows), chunk_rows))
+    with profiler.stage("sheets_write", rows=len(df)):
+        for start in starts:
+            for attempt in range(max_retries + 1):
+                if attempt:
+                    time.sleep(backoff * 2 ** (attempt - 1))
+                limiter.acquire()
+                calls += 1
+                try:
+                    # RAW: una descrizione che inizia con "=" resta testo, non formula
+                    worksheet.append_rows(
+                        rows[start:start + chunk_rows],
+                        value_input_option="RAW",
+                        insert_data_option="INSERT_ROWS",
+                    )
+                    break
+                except Exception as e:
+                    if attempt == max_retries or not _is_quota_error(e):
+                        raise
+    if stats is not None:
+        stats.update(
+            rows=len(df),
+            skipped=int((~new).sum()),
+            chunks=len(starts),
+            calls=calls,
+        )
+    return len(df)
+
+
+class QuotaExceeded(Exception):
+    """Errore 429 simulato, con lo stesso ``response.status_code`` di ``gspread.APIError``."""
+
+    def __init__(self):
+        super().__init__("FakeWorksheet: quota di scrittura superata")
+        self.response = type("Response", (), {"status_code": 429})()
+
+
+class FakeWorksheet:
+    """Foglio in memoria con i metodi di ``gspread.Worksheet`` usati da ``sync_to_sheet``.
+
+    ``values`` contiene le righe come le restituirebbe l'API (tutto testo,
+    come con ``RAW`` letto indietro), ``calls`` il nome di ogni chiamata
+    fatta. ``quota_failures`` fa fallire con 429 le prime N scritture, senza
+    scrivere nulla.
+    """
+
+    def __init__(self, title: str = "Transazioni", quota_failures: int = 0):
+        self.title = title
+        self.quota_failures = quota_failures
+        self.values = []
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def row_values(self, row: int) -> list:
+        with self._lock:
+            self.calls.append("row_values")
+            return list(self.values[row - 1]) if row <= len(self.values) else []
+
+    def col_values(self, col: int) -> list:
+        with self._lock:
+            self.calls.append("col_values")
+            return [row[col - 1] if col <= len(row) else "" for row in self.values]
+
+    def append_rows(self, values, value_input_option="RAW", insert_data_option=None, **kwargs):
+        with self._lock:
+            self.calls.append("append_rows")
+            if self.quota_failures:
+                self.quota_failures -= 1
+                raise QuotaExceeded()
+            self.values.extend([str(v) for v in row] for row in values)
@@ -0,0 +1,132 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from frame_schema import amounts_float64
+
+SEARCH_COLUMNS = ["description", "canonical_merchant", "normalized_merchant"]
+FILTER_COLUMNS = ["macro_category", "subcategory", "account", "direction"]
+SORT_COLUMNS = ["date", "amount", "description", "canonical_merchant", "macro_category", "subcategory"]
+HIDDEN_COLUMNS = ["fingerprint"]
+# Selezioni ricordate per tabella: una per vista (``key`` di ``select``)
+SELECTION_MEMO_KEYS = 8
+
+
+def _text_column(series) -> pa.Array:
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Una conversione per categoria, non per riga
+        arr = pa.DictionaryArray.from_arrays(
+            pa.array(series.cat.codes.to_numpy(), mask=series.isna().to_numpy()),
+            pa.array(series.cat.categories.astype(str).to_numpy(dtype=object), type=pa.string()),
+        )
+        return arr.dictionary_decode()
+    return pa.array(series.astype("string[pyarrow]").array).cast(pa.string())
+
+
+class TransactionTable:
+    """Vista paginata del dataset, con ricerca, filtri e ordinamento lato server.
+
+    Il testo di ricerca (descrizione e merchant, in minuscolo) viene
+    preparato una volta come colonna pyarrow: una ricerca è un
+    ``match_substring`` vettoriale per parola. Gli ordinamenti per colonna
+    si calcolano alla prima richiesta e restano in memoria, come l'ultima
+    selezione di ogni vista (``key``): la stessa tabella mostrata in più
+    punti della pagina non ricalcola la selezione a ogni rerun. Al browser
+    va solo la pagina chiesta con ``page``.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        columns = [_text_column(df[c]).fill_null("") for c in SEARCH_COLUMNS if c in df.columns]
+        self._text = pc.utf8_lower(pc.binary_join_element_wise(*columns, "\x1f"))
+        self._orders = {}
+        self._selections = {}
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def options(self, column) -> list:
+        """Valori presenti in ``column``, per i filtri."""
+        if column not in self.df.columns:
+            return []
+        values = self.df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.cat.remove_unused_categories().cat.categories
+        return sorted(pd.unique(pd.Series(values).dropna().astype(str)))
+
+    def _order(self, column: str):
+        """Posizioni ordinate per ``column``: valori non nulli e nulli separati."""
+        if column not in self._orders:
+            key = self.df[column].reset_index(drop=True)
+            if isinstance(key.dtype, pd.CategoricalDtype):
+                key = key.cat.reorder_categories(sorted(key.cat.categories, key=str))
+            missing = key.isna().to_numpy()
+            order = key.sort_values(kind="stable", na_position="last").index.to_numpy()
+            n_valid = len(order) - int(missing.sum())
+            self._orders[column] = (order[:n_valid], order[n_valid:])
+        return self._orders[column]
+
+    def select(
+        self, lo=0, hi=None, query="", filters=None, sort_by="date", descending=False, key=""
+    ) -> np.ndarray:
+        """Posizioni di riga tra ``lo`` e ``hi`` che rispettano ricerca e filtri, già ordinate.
+
+        ``query`` è una o più parole, tutte da trovare nella descrizione o nel
+        merchant; ``filters`` è ``{colonna: [valori ammessi]}``. ``key``
+        identifica la vista: la sua ultima selezione viene riusata se non
+        cambia nulla.
+        """
+        hi = len(self.df) if hi is None else hi
+        filters = {c: sorted(v) for c, v in (filters or {}).items() if v}
+        signature = (lo, hi, query, tuple(filters.items()), sort_by, descending)
+        last = self._selections.get(key)
+        if last is not None and last[0] == signature:
+            return last[1]
+
+        mask = np.ones(hi - lo, dtype=bool)
+        text = self._text.slice(lo, hi - lo)
+        for term in query.lower().split():
+            mask &= pc.match_substring(text, term).to_numpy(zero_copy_only=False)
+        for column, values in filters.items():
+            mask &= self._isin(self.df[column].iloc[lo:hi], values)
+        positions = lo + np.flatnonzero(mask)
+
+        if sort_by != "date" or descending:
+            valid, missing = self._order(sort_by)
+            keep = np.zeros(len(self.df), dtype=bool)
+            keep[positions] = True
+            valid = valid[keep[valid]]
+            positions = np.concatenate([valid[::-1] if descending else valid, missing[keep[missing]]])
+        # Senza ordinamento esplicito restano in ordine di data, come nel dataset
+        self._selections.pop(key, None)
+        self._selections[key] = (signature, positions)
+        while len(self._selections) > SELECTION_MEMO_KEYS:
+            self._selections.pop(next(iter(self._selections)))
+        return positions
+
+    @staticmethod
+    def _isin(series, values) -> np.ndarray:
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Confronto sui codici: le categorie ammesse si cercano una volta sola
+            allowed = np.flatnonzero(series.cat.categories.astype(str).isin(values))
+            return np.isin(series.cat.codes.to_numpy(), allowed)
+        return series.astype(str).isin(values).to_numpy()
+
+    def page(self, positions, page: int, page_size: int) -> pd.DataFrame:
+        start = page * page_size
+        rows = self.df.iloc[positions[start:start + page_size]]
+        return rows.drop(columns=[c for c in HIDDEN_COLUMNS if c in rows.columns])
+
+    def export(self, positions, fmt: str = "csv") -> bytes:
+        """CSV o Parquet delle righe selezionate, con gli importi in float64."""
+        rows = self.df.iloc[positions]
+        rows = rows.drop(columns=[c for c in HIDDEN_COLUMNS if c in rows.columns])
+        rows = rows.assign(amount=amounts_float64(rows["amount"]))
+        if fmt == "parquet":
+            buffer = io.BytesIO()
+            rows.to_parquet(buffer, index=False)
+            return buffer.getvalue()
+        return rows.to_csv(index=False).encode("utf-8")